@@ -28,8 +28,15 @@ from oslo_log import log
 from os_vm_expire.api.controllers import versions
 from os_vm_expire.api import hooks
 from os_vm_expire.common import config
+from os_vm_expire.common import metrics
 from os_vm_expire.model import repositories
 
+try:
+    # Only available when running under uWSGI
+    import uwsgidecorators
+except ImportError:
+    uwsgidecorators = None
+
 CONF = config.CONF
 
 
@@ -55,6 +62,19 @@ def build_wsgi_app(controller=None, transactional=False):
     return wsgi_app
 
 
+def _start_metrics_exporter():
+    """Serves the metrics of the API process on [metrics]/api_port."""
+    if not CONF.metrics.api_port:
+        return
+    exporter = metrics.Exporter('api', CONF.metrics.api_port,
+                                textfile=False)
+    if uwsgidecorators:
+        # Listener threads do not survive the fork of uWSGI workers
+        uwsgidecorators.postfork(exporter.start)
+    else:
+        exporter.start()
+
+
 def main_app(func):
     def _wrapper(global_config, **local_conf):
 
@@ -67,6 +87,11 @@ def main_app(func):
         # starts ensures we don't lose requests due to lazy initialization of
         # db connections.
         repositories.setup_database_engine_and_factory()
+        if uwsgidecorators:
+            # When the app is loaded before uWSGI forks its workers, each
+            # worker must drop the connections opened by the master.
+            uwsgidecorators.postfork(repositories.dispose_engine_after_fork)
+        _start_metrics_exporter()
 
         wsgi_app = func(global_config, **local_conf)
 
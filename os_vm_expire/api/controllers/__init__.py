@@ -9,18 +9,28 @@
 #  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 #  License for the specific language governing permissions and limitations
 #  under the License.
-import collections
+try:
+    from collections import abc as collections_abc
+except ImportError:  # Python 2
+    import collections as collections_abc
+import hashlib
+import time
 
 from oslo_policy import policy
 import pecan
 from webob import exc
 
 from os_vm_expire import api
+from os_vm_expire.common import metrics
 from os_vm_expire.common import utils
 from os_vm_expire import i18n as u
 
 LOG = utils.getLogger(__name__)
 
+# Authorization results of _do_enforce_rbac(), see _enforce_memoized()
+_RBAC_MEMO = {}
+_RBAC_MEMO_SIZE = 1024
+
 
 def is_json_request_accept(req):
     """Test if http request 'accept' header configured for JSON response.
@@ -59,8 +69,35 @@ def _do_enforce_rbac(inst, req, action_name, ctx, **kwargs):
         policy_dict.update(kwargs)
         # Enforce access controls.
         if ctx.policy_enforcer:
-            ctx.policy_enforcer.enforce(action_name, flatten(policy_dict),
-                                        credentials, do_raise=True)
+            _enforce_memoized(ctx.policy_enforcer, action_name,
+                              flatten(policy_dict), credentials)
+
+
+def _enforce_memoized(enforcer, action_name, target, credentials):
+    """Enforce a policy, reusing the results of previous requests.
+
+    Results are keyed on the action, the roles and whether the target
+    belongs to the credentials project, and on the rules version of the
+    enforcer (see os_vm_expire.common.policy.Enforcer), so rules should only
+    depend on roles and project ownership. Enforcers without rules version
+    evaluate the policy on each call.
+    """
+    if getattr(enforcer, 'rules_version', None) is None:
+        enforcer.enforce(action_name, target, credentials, do_raise=True)
+        return
+    # Reloads the policy file if modified
+    enforcer.load_rules()
+    key = (id(enforcer), enforcer.rules_version, action_name,
+           frozenset(credentials['roles'] or ()),
+           target.get('project_id') == credentials['project_id'])
+    allowed = _RBAC_MEMO.get(key)
+    if allowed is None:
+        allowed = enforcer.enforce(action_name, target, credentials)
+        if len(_RBAC_MEMO) >= _RBAC_MEMO_SIZE:
+            _RBAC_MEMO.clear()
+        _RBAC_MEMO[key] = allowed
+    if not allowed:
+        raise policy.PolicyNotAuthorized(action_name, target, credentials)
 
 
 def enforce_rbac(action_name='default'):
@@ -91,9 +128,14 @@ def handle_exceptions(operation_name=u._('System')):
     def exceptions_decorator(fn):
 
         def handler(inst, *args, **kwargs):
+            started_at = time.time()
+            code = 500
             try:
-                return fn(inst, *args, **kwargs)
-            except exc.HTTPError:
+                result = fn(inst, *args, **kwargs)
+                code = pecan.response.status_int
+                return result
+            except exc.HTTPError as e:
+                code = e.code
                 LOG.exception('Webob error seen')
                 raise  # Already converted to Webob exception, just reraise
             # In case PolicyNotAuthorized, we do not want to expose payload by
@@ -101,6 +143,7 @@ def handle_exceptions(operation_name=u._('System')):
             except policy.PolicyNotAuthorized as pna:
                 status, message = api.generate_safe_exception_message(
                     operation_name, pna)
+                code = status
                 LOG.error(message)
                 pecan.abort(status, message)
             except Exception as e:
@@ -108,6 +151,10 @@ def handle_exceptions(operation_name=u._('System')):
                 LOG.logger.disabled = False
                 LOG.exception(e)
                 pecan.abort(500, str(e))
+            finally:
+                metrics.API_REQUEST_DURATION.labels(
+                    type(inst).__name__, pecan.request.method, code).observe(
+                        time.time() - started_at)
 
         return handler
 
@@ -144,6 +191,26 @@ def enforce_content_types(valid_content_types=[]):
     return content_types_decorator
 
 
+def set_etag(*parts):
+    """Sets a weak ETag, hash of parts, on the response.
+
+    Parts should identify the resource representation, for example the
+    version of the entities it is built from and the query parameters.
+
+    :returns: True if the ETag matches the If-None-Match request header,
+              the client copy being then up to date.
+    """
+    etag = hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+    pecan.response.etag = (etag, False)
+    return etag in pecan.request.if_none_match
+
+
+def not_modified():
+    """Returns an empty 304 Not Modified response."""
+    pecan.response.status = 304
+    return pecan.response
+
+
 def flatten(d, parent_key=''):
     """Flatten a nested dictionary
 
@@ -153,7 +220,7 @@ def flatten(d, parent_key=''):
     items = []
     for k, v in d.items():
         new_key = parent_key + '.' + k if parent_key else k
-        if isinstance(v, collections.MutableMapping):
+        if isinstance(v, collections_abc.MutableMapping):
             items.extend(flatten(v, new_key).items())
         else:
             items.append((new_key, v))
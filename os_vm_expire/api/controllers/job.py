@@ -0,0 +1,148 @@
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#  License for the specific language governing permissions and limitations
+#  under the License.
+
+import pecan
+
+from os_vm_expire import api
+from os_vm_expire.api import controllers
+from os_vm_expire.api.controllers import vmexpire
+from os_vm_expire.common import config
+from os_vm_expire.common import hrefs
+from os_vm_expire.common import utils
+from os_vm_expire import i18n as u
+from os_vm_expire.model import models
+from os_vm_expire.model import repositories as repo
+
+
+CONF = config.CONF
+
+LOG = utils.getLogger(__name__)
+
+
+def _job_not_found():
+    """Throw exception indicating job not found."""
+    pecan.abort(404, u._('Not Found. Sorry but your job is in '
+                         'another castle.'))
+
+
+def get_body_selector(data):
+    """Returns the selector of a job request body, None if not set.
+
+    Selector is a {"project_id": ...} or {"domain_id": ...} object. Aborts
+    with 400 if it is invalid.
+    """
+    selector = data.get('selector')
+    if selector is None:
+        return None
+    items = list(selector.items()) if isinstance(selector, dict) else []
+    if (len(items) != 1 or items[0][0] not in ('project_id', 'domain_id') or
+            not isinstance(items[0][1], str) or not items[0][1].strip()):
+        pecan.abort(400, u._('selector must be a {"project_id": id} or '
+                             '{"domain_id": id} object'))
+    key, value = items[0]
+    return {key: value.strip()}
+
+
+def job_to_dict(project_id, job, failures=True):
+    """Returns the fields of a job, with its href.
+
+    :param failures: include the list of failed instances
+    """
+    fields = job.to_dict_fields()
+    if not failures:
+        del fields['failures']
+    fields['links'] = {
+        'self': hrefs.convert_resource_id_to_href(project_id + '/jobs',
+                                                  job.id)
+    }
+    return fields
+
+
+class JobController(controllers.ACLMixin):
+
+    """Handles bulk jobs creation and retrieval requests.
+
+    Jobs apply an operation (add, extend or delete) to the expirations of
+    many instances. They are processed by the cleaner, chunk by chunk, so
+    that long operations do not hold API workers.
+    """
+
+    def __init__(self, project_id):
+        self.project_id = str(project_id)
+        self.job_repo = repo.get_vmexpire_job_repository()
+
+    @pecan.expose(generic=True)
+    def index(self, **kwargs):
+        pecan.abort(405)  # HTTP 405 Method Not Allowed as default
+
+    @index.when(method='GET', template='json')
+    @controllers.handle_exceptions(u._('Job retrieval'))
+    @controllers.enforce_rbac('job:get')
+    def on_get(self, meta, job_id=None):
+        if job_id is None:
+            jobs = self.job_repo.get_project_jobs(self.project_id)
+            jobs_resp = [job_to_dict(self.project_id, job, failures=False)
+                         for job in jobs]
+            repo.commit()
+            return {'jobs': jobs_resp, 'total': len(jobs_resp)}
+
+        job = self.job_repo.get(entity_id=str(job_id),
+                                suppress_exception=True)
+        if not job or job.project_id != self.project_id:
+            _job_not_found()
+        job_resp = job_to_dict(self.project_id, job)
+        repo.commit()
+        return {'job': job_resp}
+
+    @index.when(method='POST', template='json')
+    @controllers.handle_exceptions(u._('Job create'))
+    @controllers.enforce_rbac('job:create')
+    @controllers.enforce_content_types(['application/json'])
+    def on_post(self, meta):
+        data = api.load_body(pecan.request)
+        operation = data.get('operation') if isinstance(data, dict) else None
+        if operation not in models.VmExpireJob.OPERATIONS:
+            pecan.abort(400, u._('operation must be one of {operations}'
+                                 ).format(operations=', '.join(
+                                     models.VmExpireJob.OPERATIONS)))
+        selector = get_body_selector(data)
+        if selector is None:
+            instance_ids = vmexpire.get_body_instance_ids(
+                data, CONF.max_instances_per_job)
+        elif 'instance_ids' in data:
+            pecan.abort(400, u._('instance_ids and selector are exclusive'))
+        elif operation == 'add':
+            pecan.abort(400, u._('selector only applies to extend and '
+                                 'delete operations'))
+        else:
+            instance_ids = []
+        all_tenants = data.get('all_tenants', False)
+        if not isinstance(all_tenants, bool):
+            pecan.abort(400, u._('all_tenants must be a boolean'))
+        if (selector and not all_tenants and
+                selector.get('project_id') != self.project_id):
+            pecan.abort(400, u._('selector of other projects, or of a '
+                                 'domain, requires all_tenants'))
+        if all_tenants:
+            ctxt = controllers._get_vmexpire_context(pecan.request)
+            if not ctxt or not ctxt.is_admin:
+                pecan.response.status = 403
+                return "all_tenants is restricted to admin users"
+
+        job = self.job_repo.create_job(self.project_id, operation,
+                                       instance_ids, all_tenants=all_tenants,
+                                       selector=selector)
+        job_resp = job_to_dict(self.project_id, job)
+        repo.commit()
+        pecan.response.status = 202
+        pecan.response.headers['Location'] = job_resp['links']['self']
+        return {'job': job_resp}
@@ -14,6 +14,7 @@ import pecan
 from six.moves.urllib import parse
 
 from os_vm_expire.api import controllers
+from os_vm_expire.api.controllers import job
 from os_vm_expire.api.controllers import vmexclude
 from os_vm_expire.api.controllers import vmexpire
 from os_vm_expire.common import utils
@@ -94,10 +95,23 @@ class V1Controller(BaseVersionController):
     def _lookup(self, project_id, *remainder):
         if not project_id:
             return self.on_get()
+        if remainder[:2] == ('vmexpires', 'lookup'):
+            return vmexpire.VmExpireLookupController(project_id), \
+                remainder[2:]
+        if remainder[:2] == ('vmexpires', 'changes'):
+            return vmexpire.VmExpireChangesController(project_id), \
+                remainder[2:]
+        if remainder[:2] == ('vmexpires', 'stats'):
+            return vmexpire.VmExpireStatsController(project_id), \
+                remainder[2:]
+        if remainder[:2] == ('vmexpires', 'bulk'):
+            return vmexpire.VmExpireBulkController(project_id), remainder[2:]
         if remainder and remainder[0] == 'vmexpires':
             return vmexpire.VmExpireController(project_id), remainder
         elif remainder and remainder[0] == 'vmexcludes':
             return vmexclude.VmExcludeController(project_id), remainder
+        elif remainder and remainder[0] == 'jobs':
+            return job.JobController(project_id), remainder
         else:
             return self.on_get()
 
@@ -132,7 +146,7 @@ class VersionsController(object):
         self._redirect_to_default_json_home_if_needed(pecan.request)
 
         if 'build' in kwargs:
-            return {'build': version.__version__}
+            return {'build': version.get_version()}
 
         versions_info = [version_class.get_version_info(pecan.request) for
                          version_class in AVAILABLE_VERSIONS.values()]
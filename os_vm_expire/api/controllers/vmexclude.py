@@ -18,6 +18,7 @@ import pecan
 # from os_vm_expire import api
 from os_vm_expire import api
 from os_vm_expire.api import controllers
+from os_vm_expire.common import cache
 from os_vm_expire.common import hrefs
 from os_vm_expire.common import utils
 from os_vm_expire import i18n as u
@@ -58,10 +59,33 @@ class VmExcludeController(controllers.ACLMixin):
         vm_repo = self.vmexclude_repo
         instances = []
         if instance_id is None:
+            base_url = utils.get_base_url_from_request()
+            cache_key = None
+            if cache.is_enabled():
+                version = repo.get_cache_generation_repository(
+                ).get_generation(repo.VMEXCLUDE_CACHE_SCOPE)
+                cache_key = cache.make_key('vmexcludes', self.project_id,
+                                           version, base_url)
+            else:
+                version = vm_repo.get_list_version()
+            if controllers.set_etag('vmexcludes', self.project_id, version,
+                                    base_url):
+                repo.commit()
+                return controllers.not_modified()
+            if cache_key:
+                instances_resp_overall = cache.get_value(cache_key)
+                if instances_resp_overall is not None:
+                    repo.commit()
+                    return instances_resp_overall
             instances = vm_repo.get_type_entities()
         else:
             instance = vm_repo.get(entity_id=str(instance_id))
             # url = hrefs.convert_vmexpire_to_href(instance.id)
+            if controllers.set_etag('vmexclude', instance.id,
+                                    instance.updated_at,
+                                    utils.get_base_url_from_request()):
+                repo.commit()
+                return controllers.not_modified()
             repo.commit()
             return {
                 'vmexclude': hrefs.convert_to_hrefs(instance.to_dict_fields())
@@ -80,6 +104,8 @@ class VmExcludeController(controllers.ACLMixin):
         instances_resp_overall = hrefs.add_self_href(self.project_id + '/vmexcludes/', instances_resp_overall)
         instances_resp_overall.update({'total': total})
         repo.commit()
+        if cache_key:
+            cache.set_value(cache_key, instances_resp_overall)
         return instances_resp_overall
 
     @index.when(method='POST', template='json')
@@ -119,7 +145,7 @@ class VmExcludeController(controllers.ACLMixin):
     def on_delete(self, meta, instance_id):
         instance = self.vmexclude_repo.get(entity_id=instance_id)
         if instance:
-            self.vmexclude_repo.delete_entity_by_id(entity_id=instance.id)
+            self.vmexclude_repo.delete_entity(instance)
             repo.commit()
         pecan.response.status = 204
         return
@@ -11,12 +11,17 @@
 #  under the License.
 
 # from oslo_log import versionutils
+import datetime
+
+from oslo_serialization import jsonutils
+from oslo_utils import strutils
+from oslo_utils import timeutils
 import pecan
-# import time
-# import datetime
+import time
 
-# from os_vm_expire import api
+from os_vm_expire import api
 from os_vm_expire.api import controllers
+from os_vm_expire.common import cache
 from os_vm_expire.common import hrefs
 from os_vm_expire.common import utils
 from os_vm_expire import i18n as u
@@ -37,6 +42,208 @@ def _vmexpire_not_found():
                          'another castle.'))
 
 
+def _get_list_filters(params):
+    """Returns listing filters and sort of query parameters.
+
+    Aborts with 400 if a parameter is invalid.
+    """
+    filters = {}
+    try:
+        for name in ('expire_before', 'expire_after'):
+            if params.get(name):
+                filters[name] = int(params.get(name))
+        for name in ('notified', 'notified_last'):
+            if params.get(name):
+                filters[name] = strutils.bool_from_string(params.get(name),
+                                                          strict=True)
+    except ValueError as e:
+        pecan.abort(400, u._('Invalid filter: {error}').format(error=e))
+    for name in ('user_id', 'instance_name'):
+        if params.get(name):
+            filters[name] = params.get(name)
+
+    sort_key = params.get('sort_key', 'id')
+    if sort_key not in repo.VmExpireRepo.SORT_KEYS:
+        pecan.abort(400, u._('Invalid sort_key, allowed values: '
+                             '{keys}').format(
+                                 keys=', '.join(repo.VmExpireRepo.SORT_KEYS)))
+    sort_dir = params.get('sort_dir', 'asc')
+    if sort_dir not in ('asc', 'desc'):
+        pecan.abort(400, u._('Invalid sort_dir, allowed values: asc, desc'))
+    return filters, sort_key, sort_dir
+
+
+def vmexpire_href_prefix(base_url=None):
+    """Returns the href of an expiration, without its id."""
+    return hrefs.convert_vmexpire_to_href('', base_url)[:-len('????')]
+
+
+def vmexpire_row_to_dict(row, href_prefix):
+    """Serializes a listing row, see VmExpireRepo.LIST_COLUMNS.
+
+    Output matches convert_to_hrefs(VmExpire.to_dict_fields()), without
+    loading ORM objects nor deriving the base url for each row.
+
+    :param row: row of LIST_COLUMNS values
+    :param href_prefix: result of vmexpire_href_prefix()
+    """
+    created_at = row.created_at
+    updated_at = row.updated_at
+    fields = {
+        'created': created_at.isoformat() if created_at else created_at,
+        'updated': updated_at.isoformat() if updated_at else updated_at,
+        'id': row.id,
+        'instance_id': row.instance_id,
+        'project_id': row.project_id,
+        'expire': row.expire,
+        'notified': row.notified,
+        'notified_last': row.notified_last,
+        'user_id': row.user_id,
+        'instance_name': row.instance_name,
+        'links': {'self': href_prefix + row.id}
+    }
+    if row.deleted_at:
+        fields['deleted_at'] = row.deleted_at.isoformat()
+    if row.deleted:
+        fields['deleted'] = True
+    return fields
+
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def changes_cursor(value):
+    """Returns the changes cursor of a naive UTC datetime.
+
+    Cursors are the number of microseconds since the epoch, clients should
+    handle them as opaque strings.
+    """
+    delta = value - _EPOCH
+    return str((delta.days * 24 * 3600 + delta.seconds) * 1000000 +
+               delta.microseconds)
+
+
+def _parse_changes_cursor(cursor):
+    """Returns the naive UTC datetime of a changes cursor.
+
+    Aborts with 400 if the cursor is invalid.
+    """
+    try:
+        return _EPOCH + datetime.timedelta(microseconds=int(cursor))
+    except (ValueError, OverflowError):
+        pecan.abort(400, u._('Invalid since cursor {cursor}').format(
+            cursor=cursor))
+
+
+def _lookup_vmexpires(project_id, instance_ids):
+    """Returns the expirations of instances, keyed by instance id.
+
+    Instances without expiration are not in the result. Aborts with 400 if
+    more than max_instances_per_request instances are given.
+
+    :param project_id: project of the expirations, None for all projects
+    :param instance_ids: list of instance ids
+    """
+    instance_ids = set(i.strip() for i in instance_ids if i and i.strip())
+    if len(instance_ids) > CONF.max_instances_per_request:
+        pecan.abort(400, u._('Too many instance ids, maximum is '
+                             '{max}').format(
+                                 max=CONF.max_instances_per_request))
+    rows = repo.get_vmexpire_repository().get_by_instances(
+        instance_ids, project_id=project_id)
+    href_prefix = vmexpire_href_prefix(utils.get_base_url_from_request())
+    vmexpires = dict((row.instance_id, vmexpire_row_to_dict(row, href_prefix))
+                     for row in rows)
+    return {'vmexpires': vmexpires, 'total': len(vmexpires)}
+
+
+def get_body_instance_ids(data, max_instances):
+    """Returns the unique instance ids of a request body, in order.
+
+    Body is a {"instance_ids": [...]} object. Aborts with 400 if it is
+    invalid or has more than max_instances instance ids.
+    """
+    instance_ids = data.get('instance_ids') if isinstance(data, dict) \
+        else None
+    if (not isinstance(instance_ids, list) or
+            not all(isinstance(i, str) for i in instance_ids)):
+        pecan.abort(400, u._('instance_ids must be a list of instance ids'))
+    unique_ids = []
+    seen = set()
+    for instance_id in instance_ids:
+        instance_id = instance_id.strip()
+        if instance_id and instance_id not in seen:
+            seen.add(instance_id)
+            unique_ids.append(instance_id)
+    if len(unique_ids) > max_instances:
+        pecan.abort(400, u._('Too many instance ids, maximum is '
+                             '{max}').format(max=max_instances))
+    return unique_ids
+
+
+# Status of the failed items of bulk operations
+BULK_ERROR_STATUS = {
+    repo.BULK_NOT_FOUND: 404,
+    repo.BULK_EXCLUDED: 403,
+    repo.BULK_MAX_EXTEND: 403
+}
+
+
+def _bulk_results(results, status):
+    """Returns the per instance results of a bulk operation.
+
+    :param results: list of BulkResult
+    :param status: status of the successful items
+    """
+    items = []
+    for result in results:
+        item = {'instance_id': result.instance_id}
+        if result.error:
+            item['status'] = BULK_ERROR_STATUS[result.error]
+            item['error'] = result.message
+        else:
+            item['status'] = status
+            if status != 204:
+                item['vmexpire'] = hrefs.convert_to_hrefs(
+                    result.entity.to_dict_fields())
+        items.append(item)
+    return {'results': items}
+
+
+def _stream_vmexpires(session, page, limit, base_url, envelope):
+    """Yields the JSON body of a streamed listing, chunk by chunk.
+
+    :param session: session of the page query, closed once done
+    :param page: `Page` of rows returned by VmExpireRepo.stream_page()
+    :param limit: page size
+    :param base_url: base url of hrefs
+    :param envelope: function returning links and total of a page, emitted
+                     after the entities, once the next marker is known
+    """
+    try:
+        yield b'{"vmexpires": ['
+        href_prefix = vmexpire_href_prefix(base_url)
+        count = 0
+        last_id = None
+        next_marker = None
+        for row in page.entities:
+            if count == limit:
+                # Extra row, a next page exists
+                next_marker = last_id
+                break
+            chunk = jsonutils.dumps(vmexpire_row_to_dict(row, href_prefix))
+            if count:
+                chunk = ', ' + chunk
+            yield chunk.encode('utf-8')
+            last_id = row.id
+            count += 1
+        tail = jsonutils.dumps(
+            envelope(page._replace(next_marker=next_marker)))
+        yield ('], ' + tail[1:]).encode('utf-8')
+    finally:
+        session.close()
+
+
 class VmExpireController(controllers.ACLMixin):
 
     """Handles Order retrieval and deletion requests."""
@@ -52,43 +259,128 @@ class VmExpireController(controllers.ACLMixin):
     @index.when(method='GET', template='json')
     @controllers.handle_exceptions(u._('VmExpire retrieval'))
     @controllers.enforce_rbac('vmexpire:get')
-    def on_get(self, meta, instance_id=None):
+    def on_get(self, meta, entity_id=None):
         # if null get all else get expiration for instance
         # ctxt = controllers._get_vmexpire_context(pecan.request)
         vm_repo = self.vmexpire_repo
-        instances = []
-        if instance_id is None:
+        if entity_id is None:
+            project_id = str(self.project_id)
             all_tenants = pecan.request.GET.get('all_tenants')
             if all_tenants is not None:
                 ctxt = controllers._get_vmexpire_context(pecan.request)
                 if ctxt.is_admin:
-                    instances = vm_repo.get_entities()
+                    project_id = None
                 else:
                     pecan.response.status = 403
                     return "all_tenants is restricted to admin users"
-            else:
-                instances = vm_repo.get_project_entities(str(self.project_id))
         else:
-            instance = vm_repo.get(entity_id=str(instance_id))
+            instance = vm_repo.get(entity_id=str(entity_id))
             # url = hrefs.convert_vmexpire_to_href(instance.id)
+            if controllers.set_etag('vmexpire', instance.id,
+                                    instance.updated_at,
+                                    utils.get_base_url_from_request()):
+                repo.commit()
+                return controllers.not_modified()
             repo.commit()
             return {
                 'vmexpire': hrefs.convert_to_hrefs(instance.to_dict_fields())
                 }
 
-        total = len(instances)
+        instance_ids = pecan.request.GET.get('instance_id')
+        if instance_ids is not None:
+            result = _lookup_vmexpires(project_id, instance_ids.split(','))
+            repo.commit()
+            return result
+
+        offset, limit = repo.clean_paging_values(
+            pecan.request.GET.get('offset'),
+            pecan.request.GET.get('limit')
+        )
+        filters, sort_key, sort_dir = _get_list_filters(pecan.request.GET)
+        params = list(pecan.request.GET.items())
+        base_url = utils.get_base_url_from_request()
+        cache_key = None
+        if project_id is not None and cache.is_enabled():
+            # Read first, entities written after it are at a later generation
+            version = repo.get_cache_generation_repository().get_generation(
+                repo.vmexpire_cache_scope(project_id))
+            cache_key = cache.make_key('vmexpires', self.project_id,
+                                       project_id, version, sorted(params),
+                                       limit, base_url)
+        else:
+            version = vm_repo.get_list_version(project_id, filters)
+        # Answer polling clients before loading any row
+        if controllers.set_etag('vmexpires', self.project_id, project_id,
+                                sorted(params), limit, version, base_url):
+            repo.commit()
+            return controllers.not_modified()
+        if cache_key:
+            instances_resp_overall = cache.get_value(cache_key)
+            if instances_resp_overall is not None:
+                repo.commit()
+                return instances_resp_overall
+        marker = pecan.request.GET.get('marker')
+        if marker and not vm_repo.get(entity_id=marker,
+                                      suppress_exception=True):
+            pecan.abort(400, u._('Invalid marker {marker}').format(
+                marker=marker))
+
+        def envelope(page, data):
+            data = hrefs.add_marker_nav_hrefs(
+                self.project_id + '/vmexpires', params, limit, page, offset,
+                data, base_url)
+            data = hrefs.add_self_href(self.project_id + '/vmexpires/', data,
+                                       base_url)
+            data.update({'total': page.total})
+            return data
+
+        if limit > CONF.stream_listing_threshold and not cache_key:
+            # Entities are read and serialized by batches while the response
+            # is sent, with a session living until the end of the response.
+            # Cached listings, bounded by max_limit_paging, are built once
+            # per generation instead.
+            session = repo.new_session()
+            try:
+                page = vm_repo.stream_page(
+                    project_id=project_id,
+                    marker=marker,
+                    offset=offset,
+                    limit=limit,
+                    filters=filters,
+                    sort_key=sort_key,
+                    sort_dir=sort_dir,
+                    rows=True,
+                    session=session
+                )
+            except Exception:
+                session.close()
+                raise
+            repo.commit()
+            pecan.response.content_type = 'application/json'
+            pecan.response.app_iter = _stream_vmexpires(
+                session, page, limit, base_url,
+                lambda page: envelope(page, {}))
+            return pecan.response
+
+        page = vm_repo.get_page(
+            project_id=project_id,
+            marker=marker,
+            offset=offset,
+            limit=limit,
+            filters=filters,
+            sort_key=sort_key,
+            sort_dir=sort_dir,
+            rows=True
+        )
+        href_prefix = vmexpire_href_prefix(base_url)
         instances_resp = [
-            hrefs.convert_to_hrefs(o.to_dict_fields())
-            for o in instances
+            vmexpire_row_to_dict(row, href_prefix)
+            for row in page.entities
         ]
-        instances_resp_overall = hrefs.add_nav_hrefs(
-            'vmexpires',
-            0, total, total,
-            {'vmexpires': instances_resp}
-            )
-        instances_resp_overall = hrefs.add_self_href(self.project_id + '/vmexpires/', instances_resp_overall)
-        instances_resp_overall.update({'total': total})
+        instances_resp_overall = envelope(page, {'vmexpires': instances_resp})
         repo.commit()
+        if cache_key:
+            cache.set_value(cache_key, instances_resp_overall)
         return instances_resp_overall
 
     @index.when(method='POST', template='json')
@@ -134,7 +426,226 @@ class VmExpireController(controllers.ACLMixin):
     def on_delete(self, meta, instance_id):
         instance = self.vmexpire_repo.get(entity_id=instance_id)
         if instance:
-            self.vmexpire_repo.delete_entity_by_id(entity_id=instance.id)
+            self.vmexpire_repo.delete_entity(instance)
             repo.commit()
         pecan.response.status = 204
         return
+
+
+class VmExpireLookupController(controllers.ACLMixin):
+
+    """Handles expiration lookups by instance ids."""
+
+    def __init__(self, project_id):
+        self.project_id = str(project_id)
+
+    @pecan.expose(generic=True)
+    def index(self, **kwargs):
+        pecan.abort(405)  # HTTP 405 Method Not Allowed as default
+
+    @index.when(method='POST', template='json')
+    @controllers.handle_exceptions(u._('VmExpire lookup'))
+    @controllers.enforce_rbac('vmexpire:get')
+    @controllers.enforce_content_types(['application/json'])
+    def on_post(self):
+        data = api.load_body(pecan.request)
+        instance_ids = data.get('instance_ids') if isinstance(data, dict) \
+            else None
+        if (not isinstance(instance_ids, list) or
+                not all(isinstance(i, str) for i in instance_ids)):
+            pecan.abort(400, u._('instance_ids must be a list of instance '
+                                 'ids'))
+        result = _lookup_vmexpires(self.project_id, instance_ids)
+        repo.commit()
+        return result
+
+
+class VmExpireChangesController(controllers.ACLMixin):
+
+    """Handles expiration changes feed requests.
+
+    Clients list all expirations once, without since, then poll with the
+    returned cursor to get the expirations created, updated or deleted
+    since, at a cost proportional to the number of changes.
+    """
+
+    def __init__(self, project_id):
+        self.project_id = str(project_id)
+        self.vmexpire_repo = repo.get_vmexpire_repository()
+
+    @pecan.expose(generic=True)
+    def index(self, **kwargs):
+        pecan.abort(405)  # HTTP 405 Method Not Allowed as default
+
+    @index.when(method='GET', template='json')
+    @controllers.handle_exceptions(u._('VmExpire changes'))
+    @controllers.enforce_rbac('vmexpire:get')
+    def on_get(self):
+        now = timeutils.utcnow()
+        since = pecan.request.GET.get('since')
+        if since is not None:
+            since = _parse_changes_cursor(since)
+            if since < now - datetime.timedelta(
+                    seconds=CONF.changes_log_ttl):
+                pecan.abort(410, u._('Cursor is too old, list vmexpires '
+                                     'again'))
+        offset, limit = repo.clean_paging_values(
+            0, pecan.request.GET.get('limit'))
+        # Changes of transactions in progress may be flushed but not
+        # committed yet, they are left to the next poll.
+        until = now - datetime.timedelta(seconds=CONF.changes_grace_time)
+        changes = self.vmexpire_repo.get_changes(self.project_id, since,
+                                                 until, limit)
+        repo.commit()
+
+        cursor = changes.cursor
+        if since is not None and since > cursor:
+            cursor = since
+        base_url = utils.get_base_url_from_request()
+        href_prefix = vmexpire_href_prefix(base_url)
+        changes_resp = {
+            'vmexpires': [vmexpire_row_to_dict(row, href_prefix)
+                          for row in changes.entities],
+            'deleted': [{
+                'id': deletion.vmexpire_id,
+                'instance_id': deletion.instance_id,
+                'deleted_at': deletion.created_at.isoformat()
+            } for deletion in changes.deletions],
+            'cursor': changes_cursor(cursor),
+            'truncated': changes.truncated
+        }
+        resource = self.project_id + '/vmexpires/changes'
+        if changes.truncated:
+            changes_resp['next'] = hrefs.convert_params_to_href(
+                resource, [('since', changes_resp['cursor']),
+                           ('limit', limit)], base_url)
+        return hrefs.add_self_href(resource, changes_resp, base_url)
+
+
+class VmExpireStatsController(controllers.ACLMixin):
+
+    """Handles expiration statistics requests.
+
+    Statistics are the number of expirations of each project and day of the
+    next days, along with how many of them were notified.
+    """
+
+    def __init__(self, project_id):
+        self.project_id = str(project_id)
+        self.vmexpire_repo = repo.get_vmexpire_repository()
+
+    @pecan.expose(generic=True)
+    def index(self, **kwargs):
+        pecan.abort(405)  # HTTP 405 Method Not Allowed as default
+
+    @index.when(method='GET', template='json')
+    @controllers.handle_exceptions(u._('VmExpire statistics'))
+    @controllers.enforce_rbac('vmexpire:get')
+    def on_get(self):
+        project_id = self.project_id
+        if pecan.request.GET.get('all_tenants') is not None:
+            ctxt = controllers._get_vmexpire_context(pecan.request)
+            if ctxt.is_admin:
+                project_id = None
+            else:
+                pecan.response.status = 403
+                return "all_tenants is restricted to admin users"
+        try:
+            days = int(pecan.request.GET.get('days', 30))
+        except ValueError:
+            days = 0
+        if days < 1 or days > CONF.max_stats_days:
+            pecan.abort(400, u._('days must be an integer between 1 and '
+                                 '{max}').format(max=CONF.max_stats_days))
+        # Days start at midnight UTC
+        now = int(time.time())
+        start = now - now % (24 * 3600)
+
+        cache_key = None
+        if cache.is_enabled():
+            version = None
+            if project_id is not None:
+                version = repo.get_cache_generation_repository(
+                ).get_generation(repo.vmexpire_cache_scope(project_id))
+            cache_key = cache.make_key('vmexpires_stats', project_id, version,
+                                       start, days)
+            stats_resp = cache.get_value(
+                cache_key,
+                expiration_time=CONF.listing_cache.stats_cache_time)
+            if stats_resp is not None:
+                repo.commit()
+                return stats_resp
+
+        rows = self.vmexpire_repo.get_stats(start, days,
+                                            project_id=project_id)
+        repo.commit()
+        stats = [{
+            'project_id': row.project_id,
+            'day': time.strftime('%Y-%m-%d',
+                                 time.gmtime(start + row.day * 24 * 3600)),
+            'count': int(row.count),
+            'notified': int(row.notified),
+            'notified_last': int(row.notified_last)
+        } for row in rows]
+        stats_resp = {
+            'stats': stats,
+            'start': start,
+            'days': days,
+            'total': sum(item['count'] for item in stats)
+        }
+        if cache_key:
+            cache.set_value(cache_key, stats_resp)
+        return stats_resp
+
+
+class VmExpireBulkController(controllers.ACLMixin):
+
+    """Handles add, extend and deletion of expirations of many instances.
+
+    Requests are {"instance_ids": [...]} objects, instances being processed
+    in a single transaction. Responses list the status of each instance.
+    """
+
+    def __init__(self, project_id):
+        self.project_id = str(project_id)
+        self.vmexpire_repo = repo.get_vmexpire_repository()
+
+    def _get_instance_ids(self):
+        return get_body_instance_ids(api.load_body(pecan.request),
+                                     CONF.max_instances_per_request)
+
+    @pecan.expose(generic=True)
+    def index(self, **kwargs):
+        pecan.abort(405)  # HTTP 405 Method Not Allowed as default
+
+    @index.when(method='POST', template='json')
+    @controllers.handle_exceptions(u._('VmExpire bulk add'))
+    @controllers.enforce_rbac('vmexpire:add')
+    @controllers.enforce_content_types(['application/json'])
+    def on_post(self):
+        results = _bulk_results(
+            self.vmexpire_repo.add_vms(self._get_instance_ids()), 202)
+        repo.commit()
+        return results
+
+    @index.when(method='PUT', template='json')
+    @controllers.handle_exceptions(u._('VmExpire bulk extend'))
+    @controllers.enforce_rbac('vmexpire:extend')
+    @controllers.enforce_content_types(['application/json'])
+    def on_put(self):
+        results = _bulk_results(
+            self.vmexpire_repo.extend_vms(self._get_instance_ids(),
+                                          project_id=self.project_id), 202)
+        repo.commit()
+        return results
+
+    @index.when(method='DELETE', template='json')
+    @controllers.handle_exceptions(u._('VmExpire bulk deletion'))
+    @controllers.enforce_rbac('vmexpire:delete')
+    @controllers.enforce_content_types(['application/json'])
+    def on_delete(self):
+        results = _bulk_results(
+            self.vmexpire_repo.delete_vms(self._get_instance_ids(),
+                                          project_id=self.project_id), 204)
+        repo.commit()
+        return results
@@ -0,0 +1,107 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import zlib
+
+from os_vm_expire.api import middleware as mw
+from os_vm_expire.common import config
+from os_vm_expire.common import utils
+
+LOG = utils.getLogger(__name__)
+CONF = config.CONF
+
+# zlib window bits of each content coding, gzip adds a gzip header and
+# trailer, deflate is the zlib format (RFC 7230 section 4.2.2).
+WBITS = {
+    'gzip': 16 + zlib.MAX_WBITS,
+    'deflate': zlib.MAX_WBITS
+}
+
+
+def _compressor(coding):
+    return zlib.compressobj(CONF.compression.level, zlib.DEFLATED,
+                            WBITS[coding])
+
+
+def _compress_iter(app_iter, coding):
+    """Compresses a body iterator, chunk by chunk."""
+    compressor = _compressor(coding)
+    try:
+        for chunk in app_iter:
+            chunk = compressor.compress(chunk)
+            if chunk:
+                yield chunk
+        yield compressor.flush()
+    finally:
+        close = getattr(app_iter, 'close', None)
+        if close:
+            close()
+
+
+class CompressionMiddleware(mw.Middleware):
+    """Compresses responses according to the request Accept-Encoding header.
+
+    Bodies of [compression]/content_types smaller than
+    [compression]/min_size bytes, and already encoded bodies, are sent as
+    is. Streamed bodies, of unknown size, are compressed while sent.
+    """
+
+    def _get_coding(self, req):
+        header = req.headers.get('Accept-Encoding')
+        if header is None:
+            return None
+        encodings = utils.get_encoding_qualities(header)
+        listed = set(encoding.coding for encoding in encodings)
+        for coding, quality in encodings:
+            if not quality:
+                # Remaining codings are refused
+                return None
+            if coding == 'identity':
+                return None
+            if coding == '*':
+                # * only stands for the codings not listed, refused ones
+                # in particular
+                for algorithm in CONF.compression.algorithms:
+                    if algorithm not in listed:
+                        return algorithm
+            elif coding in CONF.compression.algorithms:
+                return coding
+        return None
+
+    def process_response(self, resp):
+        if resp.content_type not in CONF.compression.content_types:
+            return resp
+        vary = tuple(resp.vary or ())
+        if 'Accept-Encoding' not in vary:
+            resp.vary = vary + ('Accept-Encoding',)
+        if (resp.content_encoding or resp.request.method == 'HEAD' or
+                resp.status_int in (204, 206, 304)):
+            return resp
+        length = resp.content_length
+        if length is not None and length < CONF.compression.min_size:
+            return resp
+        coding = self._get_coding(resp.request)
+        if not coding:
+            return resp
+
+        if length is None:
+            resp.app_iter = _compress_iter(resp.app_iter, coding)
+            resp.content_length = None
+        else:
+            compressor = _compressor(coding)
+            resp.body = compressor.compress(resp.body) + compressor.flush()
+        resp.content_encoding = coding
+        # Strong validators differ between codings, a weak one still matches
+        # the representations of all codings, as done by nginx.
+        etag = resp.headers.get('ETag')
+        if etag and not etag.startswith('W/'):
+            resp.headers['ETag'] = 'W/' + etag
+        return resp
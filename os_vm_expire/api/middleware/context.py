@@ -16,6 +16,7 @@
 import webob.exc
 
 from os_vm_expire.api import middleware as mw
+from os_vm_expire.api.middleware import timing
 from os_vm_expire.common import config
 from os_vm_expire.common import utils
 import os_vm_expire.context
@@ -36,10 +37,23 @@ class BaseContextMiddleware(mw.Middleware):
 
         resp.headers['x-openstack-request-id'] = resp.request.request_id
 
-        LOG.info('Processed request: %(status)s - %(method)s %(url)s',
-                 {"status": resp.status,
+        stats = resp.request.environ.get(timing.STATS_ENV_KEY)
+        if stats is None:
+            LOG.info('Processed request: %(status)s - %(method)s %(url)s',
+                     {"status": resp.status,
+                      "method": resp.request.method,
+                      "url": resp.request.url})
+            return resp
+        fields = stats.to_dict()
+        values = {"status": resp.status,
                   "method": resp.request.method,
-                  "url": resp.request.url})
+                  "url": resp.request.url}
+        values.update(fields)
+        # Fields are also given as extra, for structured log formatters
+        LOG.info('Processed request: %(status)s - %(method)s %(url)s '
+                 'time=%(request_time_ms).1fms db=%(db_time_ms).1fms/'
+                 '%(db_statements)d http=%(http_time_ms).1fms/'
+                 '%(http_requests)d', values, extra=fields)
         return resp
 
 
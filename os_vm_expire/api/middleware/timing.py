@@ -0,0 +1,45 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+from os_vm_expire.api import middleware as mw
+from os_vm_expire.common import instrumentation
+from os_vm_expire.common import utils
+
+LOG = utils.getLogger(__name__)
+
+# WSGI environ key of the statistics of the request
+STATS_ENV_KEY = 'os_vm_expire.request_stats'
+
+# Requests are checked against the statement budget of this unit
+UNIT_NAME = 'api'
+
+
+class TimingMiddleware(mw.Middleware):
+    """Times requests and reports it in a Server-Timing header.
+
+    Wall time, time and number of database statements and of upstream HTTP
+    calls are collected while the request is processed, see
+    os_vm_expire.common.instrumentation. The context middleware logs them
+    with the processed request. Work done while a streamed body is sent is
+    not counted. In debug mode, requests executing more SQL statements than
+    the api statement budget are logged.
+    """
+
+    def process_request(self, req):
+        instrumentation.clear()
+        req.environ[STATS_ENV_KEY] = instrumentation.start(UNIT_NAME)
+
+    def process_response(self, resp):
+        stats = instrumentation.stop()
+        if stats is not None:
+            instrumentation.check_budget(stats)
+            resp.headers['Server-Timing'] = stats.server_timing()
+        return resp
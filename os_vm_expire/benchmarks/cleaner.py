@@ -0,0 +1,156 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+End-to-end benchmark of a cleaner cycle.
+
+Expirations are seeded, part of them expired (already notified twice, so
+deleted by the cycle), the others expiring soon (notified by the cycle).
+One cleaner check() cycle then runs against in-process Keystone, Nova and
+SMTP stand-ins, see os_vm_expire.benchmarks.fakes. Cycle and phase
+durations, database statements, upstream calls and emails per second are
+printed as JSON:
+
+    python -m os_vm_expire.benchmarks.cleaner --expirations 1000 \
+        --nova-latency 0.05 --nova-error-rate 0.1
+"""
+from __future__ import print_function
+
+import eventlet
+
+# The cleaner runs with eventlet, and so do the stand-ins: modules must be
+# patched before the servers modules bind the original sockets selectors.
+eventlet.monkey_patch()
+
+import argparse  # noqa: E402
+import json  # noqa: E402
+import time  # noqa: E402
+
+from os_vm_expire.benchmarks import fakes  # noqa: E402
+from os_vm_expire.benchmarks import utils  # noqa: E402
+from os_vm_expire.cmd import cleaner  # noqa: E402
+from os_vm_expire.common import instrumentation  # noqa: E402
+from os_vm_expire.common import metrics  # noqa: E402
+from os_vm_expire.model import repositories  # noqa: E402
+
+CONF = utils.CONF
+
+PHASES = ('tombstones', 'deletions', 'identity', 'expirations')
+
+
+def _phase_seconds(phase):
+    return metrics.REGISTRY.get_sample_value(
+        'os_vm_expire_cleaner_phase_duration_seconds_sum',
+        {'phase': phase}) or 0.0
+
+
+def configure(openstack, smtp):
+    """Points the cleaner to the stand-ins."""
+    CONF.set_override('auth_uri', openstack.identity_url, group='cleaner')
+    CONF.set_override('nova_url', openstack.nova_url, group='cleaner')
+    CONF.set_override('email_smtp_host', '127.0.0.1', group='smtp')
+    CONF.set_override('email_smtp_port', smtp.port, group='smtp')
+    CONF.set_override('email_smtp_tls', False, group='smtp')
+    CONF.set_override('email_smtp_user', None, group='smtp')
+    CONF.set_override('email_smtp_from', 'osvmexpire@example.org',
+                      group='smtp')
+
+
+def seed(expirations, expired_ratio, projects):
+    """Seeds expirations, the first expired_ratio of them being expired."""
+    now = int(time.time())
+    expired = int(expirations * expired_ratio)
+
+    def overrides(index):
+        if index < expired:
+            return {'expire': now - 3600, 'notified': True,
+                    'notified_last': True}
+        return {'expire': now + 3600}
+
+    utils.seed_vmexpires(expirations, projects=projects,
+                         overrides=overrides)
+    return expired
+
+
+def run(expirations, expired_ratio=0.5, projects=100, nova_latency=0.0,
+        nova_error_rate=0.0, db_url=None):
+    openstack = fakes.FakeOpenStack(nova_latency=nova_latency,
+                                    nova_error_rate=nova_error_rate,
+                                    seed=expirations)
+    with openstack, fakes.SmtpSink() as smtp, utils.database(db_url):
+        configure(openstack, smtp)
+        utils.delete_seeded()
+        try:
+            expired = seed(expirations, expired_ratio, projects)
+            phases_before = dict((phase, _phase_seconds(phase))
+                                 for phase in PHASES)
+
+            stats = instrumentation.start('benchmark')
+            try:
+                cleaner.check(None)
+            finally:
+                instrumentation.stop()
+            cycle_seconds = stats.elapsed()
+
+            remaining = len(
+                repositories.get_vmexpire_repository().get_entities())
+        finally:
+            repositories.clear()
+            utils.delete_seeded()
+
+    return {
+        'expirations': expirations,
+        'expired': expired,
+        'remaining': remaining,
+        'cycle_seconds': cycle_seconds,
+        'phase_seconds': dict(
+            (phase, _phase_seconds(phase) - phases_before[phase])
+            for phase in PHASES),
+        'db_statements': stats.counts[instrumentation.DB],
+        'db_seconds': stats.durations[instrumentation.DB],
+        'upstream_calls': dict(openstack.calls),
+        'emails': smtp.count,
+        'emails_per_second': (smtp.count / cycle_seconds
+                              if cycle_seconds else 0.0),
+        'deletes_per_second': (len(openstack.deleted) / cycle_seconds
+                               if cycle_seconds else 0.0)
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark a cleaner cycle against local stand-ins of '
+                    'Keystone, Nova and SMTP.')
+    parser.add_argument('--expirations', type=int, default=1000,
+                        help='number of seeded expirations')
+    parser.add_argument('--expired-ratio', type=float, default=0.5,
+                        help='ratio of expirations deleted by the cycle, '
+                             'the others are notified')
+    parser.add_argument('--projects', type=int, default=100,
+                        help='number of projects expirations are spread on')
+    parser.add_argument('--nova-latency', type=float, default=0.0,
+                        help='seconds each Nova server deletion takes')
+    parser.add_argument('--nova-error-rate', type=float, default=0.0,
+                        help='ratio of Nova server deletions failing')
+    parser.add_argument('--db-url', default=None,
+                        help='url of a dedicated database, temporary '
+                             'SQLite database if not set')
+    args = parser.parse_args(argv)
+    print(json.dumps(run(args.expirations, args.expired_ratio,
+                         args.projects, args.nova_latency,
+                         args.nova_error_rate, args.db_url),
+                     indent=4, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,251 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+In-process stand-ins of the services used by the cleaner and the worker.
+
+FakeOpenStack serves a minimal Keystone v3 (tokens, users, projects) and
+Nova (server lookup and deletion, with configurable latency and error
+rate) API over HTTP, SmtpSink accepts and counts emails. Both listen on a
+free port of the loopback interface, in background threads, and count the
+calls they receive.
+"""
+import collections
+import random
+import re
+import socketserver
+import threading
+import time
+from wsgiref import simple_server
+
+import webob
+import webob.dec
+
+TOKEN = 'fake-token'
+
+
+class _QuietHandler(simple_server.WSGIRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _ThreadingWSGIServer(socketserver.ThreadingMixIn,
+                           simple_server.WSGIServer):
+    daemon_threads = True
+
+
+class _Service(object):
+    """Server running in a background thread, see start() and stop()."""
+
+    def __init__(self):
+        self._server = None
+        self._thread = None
+        self.port = None
+
+    def _make_server(self):
+        raise NotImplementedError
+
+    def start(self):
+        self._server = self._make_server()
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name=type(self).__name__)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+class FakeOpenStack(_Service):
+    """Keystone and Nova APIs, served under /identity/v3 and /compute/v2.1.
+
+    :param nova_latency: seconds each Nova server deletion takes
+    :param nova_error_rate: ratio of Nova server deletions failing with an
+                            HTTP 500 error
+    :param seed: seed of the error draws, for reproducible runs
+    """
+
+    ROUTES = (
+        ('POST', r'^/identity/v3/auth/tokens$', 'auth_tokens'),
+        ('GET', r'^/identity/v3/users/(?P<id>[^/]+)$', 'get_user'),
+        ('GET', r'^/identity/v3/projects/(?P<id>[^/]+)$', 'get_project'),
+        ('GET', r'^/compute/v2\.1/servers/(?P<id>[^/]+)$', 'get_server'),
+        ('DELETE', r'^/compute/v2\.1/(?P<project_id>[^/]+)/servers/'
+                   r'(?P<id>[^/]+)$', 'delete_server'),
+    )
+
+    def __init__(self, nova_latency=0.0, nova_error_rate=0.0, seed=None):
+        super(FakeOpenStack, self).__init__()
+        self.nova_latency = nova_latency
+        self.nova_error_rate = nova_error_rate
+        self.calls = collections.Counter()
+        self.deleted = set()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._routes = [(method, re.compile(pattern), name)
+                        for method, pattern, name in self.ROUTES]
+
+    def _make_server(self):
+        return simple_server.make_server(
+            '127.0.0.1', 0, self.application,
+            server_class=_ThreadingWSGIServer, handler_class=_QuietHandler)
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.port
+
+    @property
+    def identity_url(self):
+        return self.url + '/identity/v3'
+
+    @property
+    def compute_url(self):
+        """Nova url, as [worker]/nova_url."""
+        return self.url + '/compute/v2.1'
+
+    @property
+    def nova_url(self):
+        """Nova url template, as [cleaner]/nova_url."""
+        return self.compute_url + '/%(tenant_id)s'
+
+    @webob.dec.wsgify
+    def application(self, req):
+        for method, pattern, name in self._routes:
+            match = pattern.match(req.path_info)
+            if match and req.method == method:
+                with self._lock:
+                    self.calls[name] += 1
+                return getattr(self, name)(req, **match.groupdict())
+        with self._lock:
+            self.calls['not_found'] += 1
+        return webob.Response(status=404)
+
+    def auth_tokens(self, req):
+        resp = webob.Response(status=201, json_body={'token': {}})
+        resp.headers['X-Subject-Token'] = TOKEN
+        return resp
+
+    def get_user(self, req, id):
+        return webob.Response(json_body={'user': {
+            'id': id, 'name': id, 'email': id + '@example.org'}})
+
+    def get_project(self, req, id):
+        return webob.Response(json_body={'project': {
+            'id': id, 'name': 'name-' + id, 'domain_id': 'default'}})
+
+    def get_server(self, req, id):
+        return webob.Response(json_body={'server': {
+            'id': id, 'name': 'vm-' + id, 'tenant_id': 'project-0',
+            'user_id': 'user-0'}})
+
+    def delete_server(self, req, project_id, id):
+        if self.nova_latency:
+            time.sleep(self.nova_latency)
+        with self._lock:
+            failed = self._random.random() < self.nova_error_rate
+            if failed:
+                self.calls['delete_server_error'] += 1
+            else:
+                self.deleted.add(id)
+        if failed:
+            return webob.Response(status=500, json_body={
+                'computeFault': {'code': 500, 'message': 'Fake failure'}})
+        return webob.Response(status=204)
+
+
+class _SmtpHandler(socketserver.StreamRequestHandler):
+    """Minimal SMTP dialog, without extensions."""
+
+    def _reply(self, line):
+        self.wfile.write((line + '\r\n').encode('ascii'))
+
+    def handle(self):
+        sink = self.server.sink
+        self._reply('220 localhost fake SMTP sink')
+        recipients = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('utf-8', 'replace').strip()
+            verb = command.split(' ', 1)[0].upper()
+            if verb in ('HELO', 'EHLO'):
+                self._reply('250 localhost')
+            elif verb == 'MAIL':
+                recipients = []
+                self._reply('250 OK')
+            elif verb == 'RCPT':
+                recipients.append(command.split(':', 1)[-1].strip(' <>'))
+                self._reply('250 OK')
+            elif verb == 'DATA':
+                self._reply('354 End data with <CR><LF>.<CR><LF>')
+                lines = []
+                while True:
+                    data = self.rfile.readline()
+                    if not data or data in (b'.\r\n', b'.\n'):
+                        break
+                    lines.append(data)
+                sink.add(recipients, b''.join(lines))
+                self._reply('250 OK')
+            elif verb == 'QUIT':
+                self._reply('221 Bye')
+                return
+            elif verb in ('RSET', 'NOOP'):
+                self._reply('250 OK')
+            else:
+                self._reply('502 Command not implemented')
+
+
+class _ThreadingTCPServer(socketserver.ThreadingMixIn,
+                          socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class SmtpSink(_Service):
+    """SMTP server keeping the recipients of the emails it accepts.
+
+    :param keep_messages: also keep the messages, not only their count
+    """
+
+    def __init__(self, keep_messages=False):
+        super(SmtpSink, self).__init__()
+        self.keep_messages = keep_messages
+        self.count = 0
+        self.recipients = collections.Counter()
+        self.messages = []
+        self._lock = threading.Lock()
+
+    def _make_server(self):
+        server = _ThreadingTCPServer(('127.0.0.1', 0), _SmtpHandler)
+        server.sink = self
+        return server
+
+    def add(self, recipients, message):
+        with self._lock:
+            self.count += 1
+            self.recipients.update(recipients)
+            if self.keep_messages:
+                self.messages.append(message)
@@ -0,0 +1,225 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark of the repository hot paths at realistic table sizes.
+
+For each size, expirations spread over projects and project excludes are
+seeded with bulk inserts, then the queries of the worker, the cleaner and
+the API are timed: get_entities() with the expiration filter of the
+cleaner, get_project_entities(), get_by_instance(), get_exclude_by_id(),
+add_vm() (Nova and Keystone lookups stubbed) and extend_vm(), each call
+being committed as in the API.
+
+Results are printed as JSON, with the current git commit, and compared
+with the results of a previous run when --baseline is given:
+
+    python -m os_vm_expire.benchmarks.repositories --sizes 10000,100000 \
+        --output after.json --baseline before.json
+
+A MySQL or PostgreSQL database can be used with --db-url. Its expirations
+and excludes are deleted, use a dedicated database.
+"""
+from __future__ import print_function
+
+import argparse
+import contextlib
+import json
+import random
+import time
+
+from os_vm_expire.benchmarks import utils
+from os_vm_expire.model import repositories
+
+CONF = utils.CONF
+
+# Calls per timed run of the single row operations
+CALLS = 100
+
+
+@contextlib.contextmanager
+def stubbed_upstream():
+    """Replaces Nova and Keystone lookups of add_vm() by local answers."""
+    get_instance = repositories.get_instance
+    get_project_domain = repositories.get_project_domain
+
+    def _get_instance(instance_id, token=None):
+        return {'display_name': 'vm-' + instance_id,
+                'tenant_id': 'project-0',
+                'user_id': 'user-0'}
+
+    def _get_project_domain(project_id, token=None):
+        return 'domain-0'
+
+    repositories.get_instance = _get_instance
+    repositories.get_project_domain = _get_project_domain
+    try:
+        yield
+    finally:
+        repositories.get_instance = get_instance
+        repositories.get_project_domain = get_project_domain
+
+
+def _per_call(fn, calls, repeat):
+    duration = utils.timed(fn, repeat)
+    return {
+        'seconds': duration / calls,
+        'calls_per_second': calls / duration if duration else 0.0
+    }
+
+
+def bench_size(size, excludes, projects, repeat):
+    """Seeds a database of size expirations, returns operation timings."""
+    seed_started_at = time.time()
+    utils.seed_vmexpires(size, projects=projects)
+    utils.seed_vmexcludes(excludes)
+    result = {'seed_seconds': time.time() - seed_started_at}
+
+    repo = repositories.get_vmexpire_repository()
+    exclude_repo = repositories.get_vmexclude_repository()
+    rng = random.Random(size)
+    expire_base = int(time.time()) + CONF.max_vm_duration * 3600 * 24
+    operations = {}
+
+    # Cleaner scan, about 1% of expirations to notify or delete
+    expiration_filter = expire_base + size // 100
+    rows = len(repo.get_entities(expiration_filter=expiration_filter))
+    repositories.clear()
+
+    def get_entities():
+        repo.get_entities(expiration_filter=expiration_filter)
+        repositories.clear()
+    operations['get_entities'] = _per_call(get_entities, 1, repeat)
+    operations['get_entities']['rows'] = rows
+
+    def get_project_entities():
+        repo.get_project_entities('project-0')
+        repositories.clear()
+    operations['get_project_entities'] = _per_call(get_project_entities, 1,
+                                                   repeat)
+    operations['get_project_entities']['rows'] = (size + projects - 1) // (
+        projects)
+
+    instance_ids = ['instance-%d' % rng.randrange(size)
+                    for _ in range(CALLS)]
+
+    def get_by_instance():
+        for instance_id in instance_ids:
+            repo.get_by_instance(instance_id)
+        repositories.clear()
+    operations['get_by_instance'] = _per_call(get_by_instance, CALLS,
+                                              repeat)
+
+    # Half of the looked up ids are excluded
+    exclude_ids = ['%s-project-%d' % (rng.choice(['excluded', 'other']),
+                                      rng.randrange(max(excludes, 1)))
+                   for _ in range(CALLS)]
+
+    def get_exclude_by_id():
+        for exclude_id in exclude_ids:
+            exclude_repo.get_exclude_by_id(exclude_id)
+        repositories.clear()
+    operations['get_exclude_by_id'] = _per_call(get_exclude_by_id, CALLS,
+                                                repeat)
+
+    added = iter(range(CALLS * repeat))
+
+    def add_vm():
+        for _ in range(CALLS):
+            repo.add_vm('new-instance-%d' % next(added))
+            repositories.commit()
+        repositories.clear()
+    with stubbed_upstream():
+        operations['add_vm'] = _per_call(add_vm, CALLS, repeat)
+
+    entity_ids = [entity.id for entity in repo.get_by_instances(
+        instance_ids[:CALLS])]
+    repositories.clear()
+
+    def extend_vm():
+        for entity_id in entity_ids:
+            repo.extend_vm(entity_id)
+            repositories.commit()
+        repositories.clear()
+    operations['extend_vm'] = _per_call(extend_vm, len(entity_ids), repeat)
+
+    result['operations'] = operations
+    return result
+
+
+def compare(results, baseline):
+    """Adds to results the ratio of their durations to baseline ones."""
+    for size, size_result in results['sizes'].items():
+        baseline_size = baseline.get('sizes', {}).get(size)
+        if not baseline_size:
+            continue
+        for name, operation in size_result['operations'].items():
+            baseline_operation = baseline_size['operations'].get(name)
+            if baseline_operation and baseline_operation['seconds']:
+                operation['baseline_ratio'] = (
+                    operation['seconds'] / baseline_operation['seconds'])
+
+
+def run(sizes, excludes=10000, projects=100, repeat=3, db_url=None):
+    results = {'commit': utils.get_commit(), 'excludes': excludes,
+               'projects': projects, 'sizes': {}}
+    # The engine is set up once per process, sizes share the database
+    with utils.database(db_url) as url:
+        results['database'] = url.split(':', 1)[0]
+        for size in sizes:
+            utils.delete_seeded()
+            try:
+                results['sizes'][str(size)] = bench_size(size, excludes,
+                                                         projects, repeat)
+            finally:
+                repositories.clear()
+                utils.delete_seeded()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark repository hot paths.')
+    parser.add_argument('--sizes', default='10000',
+                        help='comma separated numbers of seeded '
+                             'expirations, such as 10000,100000,1000000')
+    parser.add_argument('--excludes', type=int, default=10000,
+                        help='number of seeded project excludes')
+    parser.add_argument('--projects', type=int, default=100,
+                        help='number of projects expirations are spread on')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs per operation, best run is reported')
+    parser.add_argument('--db-url', default=None,
+                        help='url of a dedicated database, temporary '
+                             'SQLite database if not set')
+    parser.add_argument('--output', default=None,
+                        help='file the JSON results are written to')
+    parser.add_argument('--baseline', default=None,
+                        help='JSON results of a previous run to compare '
+                             'with')
+    args = parser.parse_args(argv)
+    sizes = [int(size) for size in args.sizes.split(',') if size]
+    results = run(sizes, args.excludes, args.projects, args.repeat,
+                  args.db_url)
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+    output = json.dumps(results, indent=4, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark of the vmexpire listing serialization.
+
+Compares rows per second of the ORM path (entities, to_dict_fields() and
+convert_to_hrefs() deriving the base url for each row) with the column
+rows path used by listings (vmexpire_row_to_dict()). A request is set in the
+pecan context so that base url derivation costs the same as in the API.
+
+    python -m os_vm_expire.benchmarks.serializer --rows 10000
+"""
+from __future__ import print_function
+
+import argparse
+import json
+
+import pecan
+from pecan import core
+
+from os_vm_expire.api.controllers import vmexpire
+from os_vm_expire.benchmarks import utils
+from os_vm_expire.common import hrefs
+from os_vm_expire.common import utils as common_utils
+from os_vm_expire.model import repositories
+
+CONF = utils.CONF
+
+
+def orm_path(repo, limit):
+    page = repo.get_page(project_id='project-0', limit=limit)
+    result = [hrefs.convert_to_hrefs(o.to_dict_fields())
+              for o in page.entities]
+    repositories.clear()
+    return result
+
+
+def rows_path(repo, limit):
+    page = repo.get_page(project_id='project-0', limit=limit, rows=True)
+    href_prefix = vmexpire.vmexpire_href_prefix(
+        common_utils.get_base_url_from_request())
+    result = [vmexpire.vmexpire_row_to_dict(row, href_prefix)
+              for row in page.entities]
+    repositories.clear()
+    return result
+
+
+def run(rows, repeat=3, db_url=None):
+    # Derive base url from the request, as done by default in the API
+    CONF.set_override('host_href', '')
+    CONF.set_override('max_limit_paging', rows)
+    core.state = core.RoutingState(
+        pecan.Request.blank('http://localhost:9411/v1/project-0/vmexpires'),
+        None, None)
+
+    results = {}
+    with utils.database(db_url):
+        utils.seed_vmexpires(rows)
+        repo = repositories.get_vmexpire_repository()
+        for name, path in (('orm', orm_path), ('rows', rows_path)):
+            duration = utils.timed(lambda: path(repo, rows), repeat)
+            results[name] = {
+                'seconds': duration,
+                'rows_per_second': rows / duration if duration else 0.0
+            }
+    results['speedup'] = (results['orm']['seconds'] /
+                          results['rows']['seconds'])
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark vmexpire listing serialization.')
+    parser.add_argument('--rows', type=int, default=10000,
+                        help='number of expirations listed')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs per path, best run is reported')
+    parser.add_argument('--db-url', default=None,
+                        help='database url, temporary SQLite database if '
+                             'not set')
+    args = parser.parse_args(argv)
+    print(json.dumps(run(args.rows, args.repeat, args.db_url), indent=4,
+                     sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark of the startup of the command line tools and services.
+
+For each entry point, the module is imported in a new interpreter with
+python -X importtime, which reports the time spent importing each module,
+and the tool is run with --help, which parses its configuration and
+exits. Import and --help durations, best of --repeat runs, and the
+packages taking most of the import time are printed as JSON, and compared
+with the results of a previous run when --baseline is given:
+
+    python -m os_vm_expire.benchmarks.startup --repeat 5 \
+        --output after.json --baseline before.json
+"""
+from __future__ import print_function
+
+import argparse
+import collections
+import json
+import os
+import subprocess
+import sys
+import time
+
+from os_vm_expire.benchmarks import utils
+
+# Entry point: (module, runs with --help)
+ENTRY_POINTS = collections.OrderedDict([
+    ('osvmexpire-manage', ('os_vm_expire.cmd.expire_manage', True)),
+    ('osvmexpire-db-manage', ('os_vm_expire.cmd.db_manage', True)),
+    ('osvmexpire-worker', ('os_vm_expire.cmd.green.worker', True)),
+    ('osvmexpire-cleaner', ('os_vm_expire.cmd.green.cleaner', True)),
+    ('osvmexpire-replay', ('os_vm_expire.cmd.replay', True)),
+    ('osvmexpire-wsgi-api', ('os_vm_expire.api.app', False)),
+])
+
+IMPORTTIME_PREFIX = 'import time:'
+
+
+def parse_importtime(output):
+    """Returns the [(name, self us, cumulative us, depth)] of -X importtime.
+
+    Modules are listed once imported, after the modules they import,
+    depth being 0 for the modules imported by the command itself.
+    """
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith(IMPORTTIME_PREFIX):
+            continue
+        fields = line[len(IMPORTTIME_PREFIX):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        # Names follow a space, indented by 2 spaces per depth
+        name = fields[2][1:].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules.append((name.strip(), int(fields[0]), int(fields[1]), depth))
+    return modules
+
+
+def _run(args):
+    env = dict(os.environ)
+    env.pop('PYTHONIMPORTTIME', None)
+    started_at = time.time()
+    process = subprocess.Popen(args, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE, env=env)
+    _, stderr = process.communicate()
+    return time.time() - started_at, process.returncode, stderr.decode(
+        'utf-8', 'replace')
+
+
+def profile_import(module, repeat):
+    """Returns the import time of module and its modules, best run kept."""
+    best = None
+    for _ in range(repeat):
+        _, returncode, stderr = _run(
+            [sys.executable, '-X', 'importtime', '-c', 'import ' + module])
+        if returncode:
+            raise Exception('Failed to import %s: %s' % (module, stderr))
+        modules = parse_importtime(stderr)
+        total = sum(cumulative for _, _, cumulative, depth in modules
+                    if depth == 0)
+        if best is None or total < best[0]:
+            best = (total, modules)
+    return best
+
+
+def _packages(modules, top):
+    """Returns the import time of the top packages, by self time."""
+    packages = collections.Counter()
+    for name, self_us, _, _ in modules:
+        packages[name.split('.', 1)[0]] += self_us
+    return collections.OrderedDict(
+        (name, us / 1000.0) for name, us in packages.most_common(top))
+
+
+def profile_help(module, repeat):
+    """Returns the best duration of a --help run of the module, in seconds."""
+    best = None
+    for _ in range(repeat):
+        duration, returncode, stderr = _run(
+            [sys.executable, '-m', module, '--help'])
+        if returncode:
+            raise Exception('%s --help failed: %s' % (module, stderr))
+        if best is None or duration < best:
+            best = duration
+    return best
+
+
+def run(entry_points, repeat=3, top=10):
+    results = {'commit': utils.get_commit(), 'python': sys.version.split()[0],
+               'entry_points': {}}
+    for name in entry_points:
+        module, help_run = ENTRY_POINTS[name]
+        import_us, modules = profile_import(module, repeat)
+        result = {
+            'module': module,
+            'import_ms': import_us / 1000.0,
+            'modules': len(modules),
+            'packages_ms': _packages(modules, top)
+        }
+        if help_run:
+            result['help_ms'] = profile_help(module, repeat) * 1000
+        results['entry_points'][name] = result
+    return results
+
+
+def compare(results, baseline):
+    """Adds to results the ratio of their durations to baseline ones."""
+    for name, result in results['entry_points'].items():
+        baseline_result = baseline.get('entry_points', {}).get(name)
+        if not baseline_result:
+            continue
+        for key in ('import_ms', 'help_ms'):
+            if key in result and baseline_result.get(key):
+                result[key[:-3] + '_baseline_ratio'] = (
+                    result[key] / baseline_result[key])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the startup of the command line tools and '
+                    'services.')
+    parser.add_argument('--entry-points', default=','.join(ENTRY_POINTS),
+                        help='comma separated entry points, among %s' %
+                             ', '.join(ENTRY_POINTS))
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs per measure, best run is reported')
+    parser.add_argument('--top', type=int, default=10,
+                        help='number of packages reported per entry point')
+    parser.add_argument('--output', default=None,
+                        help='file the JSON results are written to')
+    parser.add_argument('--baseline', default=None,
+                        help='JSON results of a previous run to compare '
+                             'with')
+    args = parser.parse_args(argv)
+    entry_points = [name for name in args.entry_points.split(',') if name]
+    for name in entry_points:
+        if name not in ENTRY_POINTS:
+            parser.error('unknown entry point %s' % name)
+    results = run(entry_points, args.repeat, args.top)
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+    output = json.dumps(results, indent=4)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
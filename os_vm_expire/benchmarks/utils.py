@@ -0,0 +1,145 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Helpers shared by benchmarks.
+"""
+import contextlib
+import os
+import subprocess
+import tempfile
+import time
+
+from oslo_db import options
+from oslo_utils import timeutils
+
+from os_vm_expire.common import config
+from os_vm_expire.common import utils
+from os_vm_expire.model import models
+from os_vm_expire.model import repositories
+
+CONF = config.CONF
+options.set_defaults(CONF)
+
+
+@contextlib.contextmanager
+def database(db_url=None):
+    """Sets up the database engine and tables for the duration of a block.
+
+    :param db_url: database connection url, a temporary SQLite database is
+                   used, and removed afterwards, if None
+    """
+    path = None
+    if not db_url:
+        fd, path = tempfile.mkstemp(prefix='osvmexpire-bench-',
+                                    suffix='.db')
+        os.close(fd)
+        db_url = 'sqlite:///' + path
+    CONF.set_override('connection', db_url, group='database')
+    repositories.setup_database_engine_and_factory()
+    models.BASE.metadata.create_all(repositories.get_engine())
+    try:
+        yield db_url
+    finally:
+        repositories.clear()
+        repositories.get_engine().dispose()
+        if path:
+            os.remove(path)
+
+
+def seed_vmexpires(count, projects=1, batch_size=1000, overrides=None):
+    """Inserts count expirations spread over projects, with bulk inserts.
+
+    Projects are named project-0 ... project-N.
+
+    :param overrides: function of the row index returning a dict of column
+                      values overriding the default ones
+    """
+    table = models.VmExpire.__table__
+    now = timeutils.utcnow()
+    expire = int(time.time()) + CONF.max_vm_duration * 3600 * 24
+    engine = repositories.get_engine()
+
+    def row(index):
+        values = {
+            'id': utils.generate_uuid(),
+            'created_at': now,
+            'updated_at': now,
+            'deleted': False,
+            'instance_id': 'instance-%d' % index,
+            'instance_name': 'vm-%d' % index,
+            'project_id': 'project-%d' % (index % projects),
+            'user_id': 'user-%d' % (index % 10),
+            'expire': expire + index,
+            'notified': False,
+            'notified_last': False
+        }
+        if overrides:
+            values.update(overrides(index))
+        return values
+
+    with engine.begin() as connection:
+        for start in range(0, count, batch_size):
+            connection.execute(table.insert(), [
+                row(index)
+                for index in range(start, min(start + batch_size, count))])
+
+
+def seed_vmexcludes(count, batch_size=1000):
+    """Inserts count project excludes, with bulk inserts.
+
+    Excluded projects are named excluded-project-0 ... excluded-project-N.
+    """
+    table = models.VmExclude.__table__
+    now = timeutils.utcnow()
+    engine = repositories.get_engine()
+    with engine.begin() as connection:
+        for start in range(0, count, batch_size):
+            connection.execute(table.insert(), [{
+                'id': utils.generate_uuid(),
+                'created_at': now,
+                'updated_at': now,
+                'deleted': False,
+                'exclude_id': 'excluded-project-%d' % index,
+                'exclude_type': 1
+            } for index in range(start, min(start + batch_size, count))])
+
+
+def delete_seeded():
+    """Deletes all expirations and excludes, seeded or not."""
+    engine = repositories.get_engine()
+    with engine.begin() as connection:
+        connection.execute(models.VmExpire.__table__.delete())
+        connection.execute(models.VmExclude.__table__.delete())
+
+
+def get_commit():
+    """Returns the git commit of the benchmarked code, None if unknown."""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            stderr=subprocess.STDOUT).decode('utf-8').strip()
+    except Exception:
+        return None
+
+
+def timed(fn, repeat=3):
+    """Returns the best duration of repeat calls of fn, in seconds."""
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        fn()
+        duration = time.time() - start
+        if best is None or duration < best:
+            best = duration
+    return best
@@ -14,9 +14,9 @@
 """
 Osvmexpire worker server.
 """
+import contextlib
 import datetime
 from email.mime.text import MIMEText
-import eventlet
 import os
 import smtplib
 import sys
@@ -24,7 +24,10 @@ import time
 
 
 from os_vm_expire.common import config
+from os_vm_expire.common import instrumentation
+from os_vm_expire.common import metrics
 from os_vm_expire.common import utils
+from os_vm_expire.model import models
 from os_vm_expire.model import repositories
 from os_vm_expire import version
 
@@ -35,9 +38,6 @@ from oslo_service import service
 from futurist import periodics
 import requests
 
-# Oslo messaging RPC server uses eventlet.
-eventlet.monkey_patch()
-
 # 'Borrowed' from the Glance project:
 # If ../os_vm_expire/__init__.py exists, add ../ to Python search path, so that
 # it will override what happens to be installed in /usr/(local/)lib/python...
@@ -73,7 +73,13 @@ def delete_vm(instance_id, project_id, token):
         'Content-Type': 'application/json',
         'Accept': 'application/json'
     }
-    r = requests.delete(nova_url + '/servers/' + instance_id, headers=headers)
+    try:
+        r = requests.delete(nova_url + '/servers/' + instance_id,
+                            headers=headers)
+    except Exception:
+        metrics.CLEANER_NOVA_DELETES.labels('error').inc()
+        raise
+    metrics.CLEANER_NOVA_DELETES.labels(r.status_code).inc()
     if r.status_code == 404:
         LOG.info('DELETE:VmNotFound:' + str(instance_id) + ':' + str(project_id))
         return True
@@ -145,6 +151,17 @@ def get_project_name(project_id, token):
 
 
 def send_email(instance, token, delete=False):
+    """Notifies the user of instance of its expiration, or its deletion.
+
+    :returns: True if the email was sent
+    """
+    sent = _send_email(instance, token, delete=delete)
+    metrics.CLEANER_EMAILS.labels('delete' if delete else 'expire',
+                                  'sent' if sent else 'failed').inc()
+    return sent
+
+
+def _send_email(instance, token, delete=False):
     LOG.debug("Send expiration notification mail")
     # fetch user from identity to get user email
     headers = {
@@ -228,10 +245,99 @@ def send_email(instance, token, delete=False):
     return True
 
 
+def purge_tombstones():
+    """Remove expired tombstones recorded by the worker."""
+    conf_opts = getattr(config.CONF, config.KS_NOTIFICATIONS_GRP_NAME)
+    repo = repositories.get_vmtombstone_repository()
+    try:
+        count = repo.purge_tombstones(conf_opts.tombstone_ttl)
+        repositories.commit()
+        LOG.debug("Purged %d tombstones", count)
+    except Exception as e:
+        LOG.exception("tombstone purge error: " + str(e))
+        repositories.rollback()
+
+
+def purge_deletions():
+    """Remove deletions logged for the changes feed, once expired."""
+    repo = repositories.get_vmexpire_deletion_repository()
+    try:
+        count = repo.purge_deletions(config.CONF.changes_log_ttl)
+        repositories.commit()
+        LOG.debug("Purged %d logged deletions", count)
+    except Exception as e:
+        LOG.exception("deletion log purge error: " + str(e))
+        repositories.rollback()
+
+
+def process_jobs():
+    """Process pending bulk jobs, committing chunk by chunk.
+
+    Progress of a job is committed with each chunk, a job failing on a
+    chunk is retried from this chunk on next run, up to
+    [cleaner]/job_max_attempts consecutive failures after which it is
+    FAILED. At most [cleaner]/job_max_chunks_per_run chunks of each job
+    are processed per run, so that a large job does not hold the cleaner
+    nor delay other jobs.
+    """
+    conf_cleaner = config.CONF.cleaner
+    repo = repositories.get_vmexpire_job_repository()
+    try:
+        count = repo.purge_jobs(conf_cleaner.job_ttl)
+        repositories.commit()
+        LOG.debug("Purged %d jobs", count)
+    except Exception as e:
+        LOG.exception("job purge error: " + str(e))
+        repositories.rollback()
+
+    for job in repo.get_pending_jobs():
+        job_id = job.id
+        LOG.debug("Process job %s" % (job_id))
+        try:
+            for _ in range(conf_cleaner.job_max_chunks_per_run):
+                repo.process_chunk(job, conf_cleaner.job_chunk_size)
+                repositories.commit()
+                if job.status == models.JobStatus.COMPLETED:
+                    break
+        except Exception as e:
+            LOG.exception("job %s error: %s" % (job_id, str(e)))
+            repositories.rollback()
+            try:
+                job = repo.record_failure(job_id, str(e),
+                                          conf_cleaner.job_max_attempts)
+                repositories.commit()
+            except Exception:
+                LOG.exception("job %s failure not recorded" % (job_id))
+                repositories.rollback()
+            else:
+                if job.status == models.JobStatus.FAILED:
+                    LOG.error("job %s failed after %d attempts" % (
+                        job_id, job.attempts))
+
+
+@contextlib.contextmanager
+def phase(name):
+    """Times a phase of the cleaner, checks its SQL statement budget."""
+    with metrics.CLEANER_PHASE_DURATION.labels(name).time():
+        with instrumentation.unit('cleaner.' + name):
+            yield
+
+
 # Every hour
 @periodics.periodic(3600)
 def check(started_at):
-    token = get_identity_token()
+    with phase('tombstones'):
+        purge_tombstones()
+    with phase('deletions'):
+        purge_deletions()
+    with phase('identity'):
+        token = get_identity_token()
+    with phase('expirations'):
+        check_expirations(token)
+
+
+def check_expirations(token):
+    """Notify users of expiring instances, delete expired instances."""
     conf_cleaner = config.CONF.cleaner
     LOG.debug("check instances")
     repo = repositories.get_vmexpire_repository()
@@ -270,7 +376,7 @@ def check(started_at):
             res = delete_vm(entity.instance_id, entity.project_id, token)
             if res:
                 try:
-                    repo.delete_entity_by_id(entity_id=entity.id)
+                    repo.delete_entity(entity)
                     repositories.commit()
                 except Exception as e:
                     LOG.exception("expiration deletion error: " + str(e))
@@ -282,19 +388,31 @@ class CleanerServer(service.Service):
 
     def __init__(self):
         super(CleanerServer, self).__init__()
-        repositories.setup_database_engine_and_factory()
         started_at = time.time()
-        callables = [(check, (started_at,), {})]
+
+        @periodics.periodic(config.CONF.cleaner.job_interval,
+                            run_immediately=True)
+        def jobs():
+            with phase('jobs'):
+                process_jobs()
+
+        callables = [(check, (started_at,), {}), (jobs, (), {})]
         self.w = periodics.PeriodicWorker(callables)
+        self._exporter = metrics.Exporter('cleaner',
+                                          config.CONF.metrics.cleaner_port)
 
     def start(self):
         LOG.info("Starting the CleanerServer")
+        # Database engine is set up in the service process, after fork
+        repositories.setup_database_engine_and_factory()
+        self._exporter.start()
         self.w.start()
         super(CleanerServer, self).start()
 
     def stop(self):
         LOG.info("Halting the CleanerServer")
         self.w.stop()
+        self._exporter.stop()
         super(CleanerServer, self).stop()
 
 
@@ -302,7 +420,7 @@ def main():
     try:
         config.CONF(sys.argv[1:],
                     project='os-vm-expire',
-                    version=version.version_info.version_string)
+                    version=version.get_version())
 
         # Import and configure logging.
         log.setup(config.CONF, 'osvmexpire')
@@ -12,7 +12,6 @@
 # limitations under the License.
 # import os_vm_expire
 from os_vm_expire.common import config
-from os_vm_expire.model.migration import commands
 
 # from oslo_config import cfg
 from oslo_db import options
@@ -32,6 +31,13 @@ log.setup(CONF, 'osvmexpire')
 LOG = log.getLogger(__name__)
 
 
+def _get_commands():
+    # NOTE: alembic and the models are imported when a command runs, not
+    # for --help or argument errors.
+    from os_vm_expire.model.migration import commands
+    return commands
+
+
 class DatabaseManager(object):
     """Database Manager class.
 
@@ -100,6 +106,7 @@ class DatabaseManager(object):
 
     def revision(self, args):
         """Process the 'revision' Alembic command."""
+        commands = _get_commands()
         config = commands.init_config()
         config.osvmexpire = CONF
         commands.generate(autogenerate=args.autogenerate,
@@ -109,16 +116,19 @@ class DatabaseManager(object):
     def upgrade(self, args):
         """Process the 'upgrade' Alembic command."""
         LOG.debug("Performing database schema migration...")
+        commands = _get_commands()
         config = commands.init_config()
         config.osvmexpire = CONF
         commands.upgrade(to_version=args.version, config=config)
 
     def history(self, args):
+        commands = _get_commands()
         config = commands.init_config()
         config.osvmexpire = CONF
         commands.history(args.verbose, config=config)
 
     def current(self, args):
+        commands = _get_commands()
         config = commands.init_config()
         config.osvmexpire = CONF
         commands.current(args.verbose, config=config)
@@ -19,28 +19,49 @@ from __future__ import print_function
 from os_vm_expire.common import config
 # from os_vm_expire.model import clean
 # from os_vm_expire.model.migration import commands
-from os_vm_expire.model.models import VmExclude
-from os_vm_expire.model import repositories
 import os_vm_expire.version
 
 import argparse
 import datetime
-import prettytable
 import six
 import sys
 import time
 
 from oslo_config import cfg
-from oslo_db import options
 from oslo_log import log as logging
 from oslo_utils import encodeutils
 
 
 CONF = cfg.CONF
-options.set_defaults(CONF)
 LOG = logging.getLogger(__name__)
 
 
+# NOTE: the database layer (oslo.db, SQLAlchemy models, requests) and
+# prettytable are imported by the commands using them, so that --help and
+# argument errors do not pay for their import.
+def _setup_database():
+    """Sets up the database engine, returns the repositories module."""
+    from oslo_db import options
+
+    from os_vm_expire.model import repositories
+
+    options.set_defaults(CONF)
+    repositories.setup_database_engine_and_factory()
+    return repositories
+
+
+def _print_table(headers, rows):
+    import prettytable
+
+    pt = prettytable.PrettyTable(headers)
+    for row in rows:
+        pt.add_row(row)
+    if six.PY3:
+        print(encodeutils.safe_encode(pt.get_string()).decode())
+    else:
+        print(encodeutils.safe_encode(pt.get_string()))
+
+
 # Decorators for actions
 def args(*args, **kwargs):
     def _decorator(func):
@@ -72,7 +93,7 @@ class VmExcludeCommands(object):
           default=None,
           help='Type of exclusion (domain, project, user)')
     def list(self, excludeType=None):
-        repositories.setup_database_engine_and_factory()
+        repositories = _setup_database()
         repo = repositories.get_vmexclude_repository()
         exclude_type = None
         if excludeType is not None:
@@ -89,20 +110,14 @@ class VmExcludeCommands(object):
             'type',
             'exclude_id'
         ]
-        pt = prettytable.PrettyTable(headers)
-
-        for instance in excludes:
-            pt.add_row(
-                [
-                    instance.id,
-                    VmExcludeCommands.EXCLUSION_MAP[instance.exclude_type],
-                    instance.exclude_id
-                ]
-            )
-        if six.PY3:
-            print(encodeutils.safe_encode(pt.get_string()).decode())
-        else:
-            print(encodeutils.safe_encode(pt.get_string()))
+        _print_table(headers, [
+            [
+                instance.id,
+                VmExcludeCommands.EXCLUSION_MAP[instance.exclude_type],
+                instance.exclude_id
+            ]
+            for instance in excludes
+        ])
 
     add_description = "Add exclusion"
 
@@ -119,9 +134,11 @@ class VmExcludeCommands(object):
         if excludeType not in VmExcludeCommands.EXCLUSION_TYPES:
             print("type is not valid")
             return
-        repositories.setup_database_engine_and_factory()
+        from os_vm_expire.model import models
+
+        repositories = _setup_database()
         repo = repositories.get_vmexclude_repository()
-        entity = VmExclude()
+        entity = models.VmExclude()
         entity.exclude_type = VmExcludeCommands.EXCLUSION_TYPES[excludeType]
         entity.exclude_id = excludeId
         try:
@@ -135,18 +152,13 @@ class VmExcludeCommands(object):
             'type',
             'exclude_id'
         ]
-        pt = prettytable.PrettyTable(headers)
-        pt.add_row(
+        _print_table(headers, [
             [
                 entity.id,
                 VmExcludeCommands.EXCLUSION_MAP[entity.exclude_type],
                 entity.exclude_id
             ]
-        )
-        if six.PY3:
-            print(encodeutils.safe_encode(pt.get_string()).decode())
-        else:
-            print(encodeutils.safe_encode(pt.get_string()))
+        ])
 
     delete_description = "Delete exclusion"
 
@@ -157,7 +169,7 @@ class VmExcludeCommands(object):
         if excludeId is None:
             print("Missing mandatory id parameter")
             return
-        repositories.setup_database_engine_and_factory()
+        repositories = _setup_database()
         repo = repositories.get_vmexclude_repository()
         repo.delete_entity_by_id(excludeId)
         repositories.commit()
@@ -178,7 +190,7 @@ class VmExpireCommands(object):
           default=None,
           help='Filter VM expiring in X days')
     def list(self, instanceid=None, days=None):
-        repositories.setup_database_engine_and_factory()
+        repositories = _setup_database()
         repo = repositories.get_vmexpire_repository()
         res = repo.get_all_by(instance_id=instanceid, project_id=None)
         headers = [
@@ -199,27 +211,20 @@ class VmExpireCommands(object):
             except Exception as e:
                 print(str(e))
                 return
-        pt = prettytable.PrettyTable(headers)
-        for instance in res:
-            if limit and instance.expire > limit:
-                continue
-
-            pt.add_row(
-                [
-                    instance.id,
-                    datetime.datetime.fromtimestamp(instance.expire),
-                    instance.instance_name,
-                    instance.instance_id,
-                    instance.project_id,
-                    instance.user_id,
-                    instance.notified,
-                    instance.notified_last
-                ]
-            )
-        if six.PY3:
-            print(encodeutils.safe_encode(pt.get_string()).decode())
-        else:
-            print(encodeutils.safe_encode(pt.get_string()))
+        _print_table(headers, [
+            [
+                instance.id,
+                datetime.datetime.fromtimestamp(instance.expire),
+                instance.instance_name,
+                instance.instance_id,
+                instance.project_id,
+                instance.user_id,
+                instance.notified,
+                instance.notified_last
+            ]
+            for instance in res
+            if not (limit and instance.expire > limit)
+        ])
 
     extend_description = "Extend a VM duration"
 
@@ -229,7 +234,7 @@ class VmExpireCommands(object):
         if not expirationid:
             print("Missing id parameter")
             return
-        repositories.setup_database_engine_and_factory()
+        repositories = _setup_database()
         repo = repositories.get_vmexpire_repository()
         repo.extend_vm(entity_id=expirationid)
         repositories.commit()
@@ -243,7 +248,7 @@ class VmExpireCommands(object):
         if not expirationid:
             print("Missing id paramerer")
             return
-        repositories.setup_database_engine_and_factory()
+        repositories = _setup_database()
         repo = repositories.get_vmexpire_repository()
         repo.delete_entity_by_id(entity_id=expirationid)
         repositories.commit()
@@ -257,7 +262,7 @@ class VmExpireCommands(object):
         if not instanceid:
             print("Missing id parameter")
             return
-        repositories.setup_database_engine_and_factory()
+        repositories = _setup_database()
         repo = repositories.get_vmexpire_repository()
         instance = repo.add_vm(instanceid)
         if not instance:
@@ -346,7 +351,7 @@ def main():
         CONF(args=sys.argv[1:],
              project='os-vm-expire',
              prog='osvmexpire-manage',
-             version=os_vm_expire.version.__version__,
+             version=os_vm_expire.version.get_version(),
              default_config_files=cfg_files)
 
     except RuntimeError as e:
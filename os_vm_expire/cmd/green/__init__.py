@@ -0,0 +1,25 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Entry points of the services using eventlet.
+
+Oslo messaging RPC server uses eventlet. The process is monkey patched when
+this package is imported, before the modules of the services and the
+libraries they use, which would otherwise keep unpatched references to
+the socket, select and threading modules. Tools and tests import the
+services from os_vm_expire.cmd and are not patched.
+"""
+import eventlet
+
+eventlet.monkey_patch()
@@ -0,0 +1,171 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Replay recorded nova notifications through the worker tasks.
+
+Notifications are read from a JSONL file, one notification per line, either
+as a plain {"event_type": ..., "payload": ...} object or as an oslo.messaging
+envelope ({"oslo.version": ..., "oslo.message": "..."}). They are processed
+by the worker Tasks without any message bus, Keystone calls being stubbed,
+and throughput, latency and database statement counts are reported.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import sys
+import time
+
+from oslo_db import options
+from oslo_log import log
+
+from os_vm_expire.common import config
+from os_vm_expire.common import instrumentation
+from os_vm_expire.model.migration import commands
+from os_vm_expire.model import repositories
+from os_vm_expire.queue import executor
+from os_vm_expire.queue import server
+
+CONF = config.CONF
+options.set_defaults(CONF)
+LOG = log.getLogger(__name__)
+
+
+def parse_notification(line):
+    """Returns (publisher_id, event_type, payload) of a recorded line."""
+    message = json.loads(line)
+    if 'oslo.message' in message:
+        message = json.loads(message['oslo.message'])
+    return (message.get('publisher_id', 'replay'),
+            message['event_type'],
+            message.get('payload', {}))
+
+
+def read_notifications(stream):
+    """Yields notifications of a JSONL stream, skipping empty lines."""
+    for line in stream:
+        line = line.strip()
+        if line:
+            yield parse_notification(line)
+
+
+def replay(notifications, workers=1, domain_id=None):
+    """Process notifications through the worker tasks.
+
+    :param notifications: iterable of (publisher_id, event_type, payload)
+    :param workers: number of executor lanes, 1 processes notifications
+                    in the calling thread
+    :param domain_id: domain returned by the stubbed Keystone lookup
+    :return: dict of statistics
+    """
+    tasks = server.Tasks()
+    # Statistics of each event, collected in the thread processing it
+    events_stats = []
+    keyed = None
+    if workers > 1:
+        keyed = executor.KeyedExecutor(workers=workers, name='replay')
+        keyed.start()
+
+    def process(publisher_id, event_type, payload):
+        stats = instrumentation.start('replay', track_statements=False)
+        try:
+            tasks.info(None, publisher_id, event_type, payload, None)
+        finally:
+            instrumentation.stop()
+        # list.append is atomic
+        events_stats.append((stats.elapsed(),
+                             stats.counts[instrumentation.DB]))
+
+    get_project_domain = repositories.get_project_domain
+    repositories.get_project_domain = lambda project_id, token=None: domain_id
+    try:
+        start = time.time()
+        for publisher_id, event_type, payload in notifications:
+            if keyed:
+                keyed.submit(server.get_instance_uuid(payload), process,
+                             publisher_id, event_type, payload)
+            else:
+                process(publisher_id, event_type, payload)
+        if keyed:
+            keyed.stop()
+        duration = time.time() - start
+    finally:
+        repositories.get_project_domain = get_project_domain
+
+    latencies = sorted(latency for latency, _ in events_stats)
+    statements = sum(count for _, count in events_stats)
+    events = len(events_stats)
+    return {
+        'events': events,
+        'workers': workers,
+        'duration': duration,
+        'events_per_second': events / duration if duration else 0.0,
+        'latency_p50_ms': instrumentation.percentile(latencies, 50) * 1000,
+        'latency_p99_ms': instrumentation.percentile(latencies, 99) * 1000,
+        'statements': statements,
+        'statements_per_event': statements / float(events) if events
+        else 0.0
+    }
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Replay recorded nova notifications through the '
+                    'osvmexpire worker.')
+    parser.add_argument('file',
+                        help='JSONL file of notifications, - for stdin')
+    parser.add_argument('--config-file', action='append', default=[],
+                        help='osvmexpire configuration file')
+    parser.add_argument('--db-url', default=None,
+                        help='database connection url, overrides the '
+                             'configuration (sqlite:///replay.db ...)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker threads')
+    parser.add_argument('--domain', default=None,
+                        help='domain id returned by the stubbed keystone')
+    parser.add_argument('--json', action='store_true',
+                        help='print statistics as json')
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    CONF([], project='os-vm-expire',
+         default_config_files=args.config_file or None)
+    if args.db_url:
+        CONF.set_override('connection', args.db_url, group='database')
+    log.setup(CONF, 'osvmexpire')
+
+    alembic_config = commands.init_config()
+    alembic_config.osvmexpire = CONF
+    commands.upgrade(config=alembic_config, to_version='head')
+    repositories.setup_database_engine_and_factory()
+
+    if args.file == '-':
+        stats = replay(read_notifications(sys.stdin), args.workers,
+                       args.domain)
+    else:
+        with open(args.file) as stream:
+            stats = replay(read_notifications(stream), args.workers,
+                           args.domain)
+
+    if args.json:
+        print(json.dumps(stats, indent=4, sort_keys=True))
+    else:
+        for key in sorted(stats):
+            print('%-22s %s' % (key, stats[key]))
+
+
+if __name__ == '__main__':
+    main()
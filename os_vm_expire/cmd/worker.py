@@ -18,16 +18,12 @@ from os_vm_expire.common import config
 from os_vm_expire.queue import server
 from os_vm_expire import version
 
-import eventlet
 import os
 import sys
 
 from oslo_log import log
 from oslo_service import service
 
-# Oslo messaging RPC server uses eventlet.
-eventlet.monkey_patch()
-
 # 'Borrowed' from the Glance project:
 # If ../barbican/__init__.py exists, add ../ to Python search path, so that
 # it will override what happens to be installed in /usr/(local/)lib/python...
@@ -49,7 +45,7 @@ def main():
     try:
         CONF = config.CONF
         CONF(sys.argv[1:], project='os-vm-expire',
-             version=version.version_info.version_string)
+             version=version.get_version())
 
         # Import and configure logging.
         log.setup(CONF, 'osvmexpire')
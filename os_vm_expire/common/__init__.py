@@ -11,9 +11,3 @@
 # WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 # License for the specific language governing permissions and limitations
 # under the License.
-
-import pbr.version
-
-
-__version__ = pbr.version.VersionInfo(
-    'os-vm-expire').version_string()
@@ -0,0 +1,69 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Cache of API listings.
+
+Listings are cached in an oslo.cache region, under keys including the
+generation of the listed entities (see CacheGenerationRepo). Generations are
+stored in database and bumped in the transaction writing the entities, so a
+write made by any process (API, worker, cleaner) invalidates the listings
+cached by all API processes.
+"""
+
+from oslo_cache import core as cache
+
+from os_vm_expire.common import config
+
+CONF = config.CONF
+
+REGION = cache.create_region()
+
+
+def _get_region():
+    # No-op once configured
+    return cache.configure_cache_region(CONF, REGION)
+
+
+def is_enabled():
+    """Returns True if listings should be cached."""
+    return CONF.cache.enabled and CONF.listing_cache.caching
+
+
+def make_key(*parts):
+    """Returns a cache key of parts, hashed by the region key mangler."""
+    return repr(parts)
+
+
+def get_value(key, expiration_time=None):
+    """Returns the value cached for key, or None.
+
+    :param expiration_time: max age of the value in seconds, defaults to
+                            [listing_cache]/cache_time
+    """
+    if expiration_time is None:
+        expiration_time = CONF.listing_cache.cache_time
+    value = _get_region().get(key, expiration_time=expiration_time)
+    if value is cache.NO_VALUE:
+        return None
+    return value
+
+
+def set_value(key, value):
+    """Caches value for key."""
+    _get_region().set(key, value)
+
+
+def invalidate():
+    """Invalidates all cached values of this process."""
+    _get_region().invalidate()
@@ -21,6 +21,7 @@ Configuration setup for os-vm-expire.
 import logging
 import os
 
+from oslo_cache import core as cache
 from oslo_config import cfg
 from oslo_log import log
 from oslo_middleware import cors
@@ -99,6 +100,27 @@ cleaner_opts = [
     cfg.IntOpt('notify_before_days_last',
                default=2,
                help=u._("os-vm-expire send last notification before X days")),
+    cfg.IntOpt('job_interval',
+               default=60, min=1,
+               help=u._("Interval in seconds between two runs of the "
+                        "pending bulk jobs.")),
+    cfg.IntOpt('job_chunk_size',
+               default=100, min=1,
+               help=u._("Number of instances of a bulk job processed, and "
+                        "committed, at once.")),
+    cfg.IntOpt('job_max_chunks_per_run',
+               default=10, min=1,
+               help=u._("Number of chunks of each bulk job processed per "
+                        "run, the job being resumed on next run.")),
+    cfg.IntOpt('job_ttl',
+               default=7 * 24 * 3600,
+               help=u._("Time in seconds completed and failed bulk jobs "
+                        "are kept before being removed.")),
+    cfg.IntOpt('job_max_attempts',
+               default=5, min=1,
+               help=u._("Number of consecutive failed attempts to process "
+                        "a chunk of a bulk job after which the job is "
+                        "FAILED and no longer processed.")),
 ]
 
 
@@ -183,7 +205,22 @@ ks_queue_opts = [
                help=u._('Version of tasks invoked via notifications')),
     cfg.IntOpt('thread_pool_size', default=10,
                help=u._('Define the number of max threads to be used for '
-                        'notification server processing functionality.')),
+                        'notification server processing functionality. '
+                        'Notifications for the same instance are always '
+                        'processed by the same thread, in order.')),
+    cfg.IntOpt('queue_size', default=100,
+               help=u._('Maximum number of pending notifications per '
+                        'processing thread. When a queue is full, the '
+                        'listener waits before fetching new notifications. '
+                        '0 means unbounded. Notifications are acknowledged '
+                        'once queued: delivery is at most once, queued '
+                        'notifications are processed when the worker stops '
+                        'but are lost if it is killed.')),
+    cfg.IntOpt('tombstone_ttl', default=3600,
+               help=u._('Time in seconds a deletion received for an unknown '
+                        'instance is remembered. A creation notification '
+                        'received in this delay for the same instance is '
+                        'ignored.')),
 ]
 
 
@@ -207,6 +244,133 @@ common_opts = [
     cfg.IntOpt('max_vm_total_duration',
                default=MAX_VM_TOTAL_DURATION_DAYS,
                help=u._("Maximum life of VM in days, whatever the extends")),
+    cfg.IntOpt('max_limit_paging',
+               default=1000,
+               help=u._("Maximum page size for the 'limit' paging URL "
+                        "parameter.")),
+    cfg.IntOpt('default_limit_paging',
+               default=1000,
+               help=u._("Default page size for the 'limit' paging URL "
+                        "parameter. Listings requested without limit only "
+                        "return this number of expirations, clients "
+                        "following the next links to get the others.")),
+    cfg.IntOpt('max_instances_per_request',
+               default=500,
+               help=u._("Maximum number of instance ids looked up by a "
+                        "single vmexpires multi-get request.")),
+    cfg.IntOpt('max_stats_days',
+               default=366, min=1,
+               help=u._("Maximum number of days of vmexpires statistics.")),
+    cfg.IntOpt('changes_log_ttl',
+               default=7 * 24 * 3600,
+               help=u._("Time in seconds deletions of expirations are "
+                        "logged for the vmexpires changes feed. Older "
+                        "cursors are rejected, clients must list "
+                        "expirations again.")),
+    cfg.IntOpt('changes_grace_time',
+               default=5, min=0,
+               help=u._("Changes of the last seconds are not reported by "
+                        "the vmexpires changes feed, so that changes of "
+                        "transactions in progress are not skipped. Should "
+                        "be greater than the duration of write "
+                        "transactions.")),
+    cfg.IntOpt('max_instances_per_job',
+               default=10000,
+               help=u._("Maximum number of instance ids of a single bulk "
+                        "job.")),
+    cfg.IntOpt('stream_listing_threshold',
+               default=500,
+               help=u._("Listings whose page size is greater than this "
+                        "value are streamed, rows being read and "
+                        "serialized by batches, instead of being built in "
+                        "memory. 0 streams all listings. Cached listings "
+                        "are always built in memory, their page size being "
+                        "bounded by max_limit_paging.")),
+    cfg.DictOpt('statement_budgets',
+                default={'api': '20', 'worker': '8',
+                         'cleaner.tombstones': '2',
+                         'cleaner.deletions': '2'},
+                help=u._("Maximum number of SQL statements of units of "
+                         "work: api (requests), worker (notifications) and "
+                         "cleaner.<phase> (tombstones, deletions, identity, "
+                         "expirations, jobs). Units over budget are logged "
+                         "with their most repeated statements in debug "
+                         "mode. Units without budget are not checked.")),
+]
+
+listing_cache_opt_group = cfg.OptGroup(name='listing_cache',
+                                       title='Listing Cache Options')
+
+listing_cache_opts = [
+    cfg.BoolOpt('caching', default=True,
+                help=u._('Toggle for caching vmexpires and vmexcludes '
+                         'listings. This has no effect unless global '
+                         'caching is enabled in the [cache] section.')),
+    cfg.IntOpt('cache_time', default=600,
+               help=u._('Time to cache listings, in seconds. Listings are '
+                        'invalidated as soon as an expiration or exclude is '
+                        'written by the API, the worker or the cleaner.')),
+    cfg.IntOpt('stats_cache_time', default=60,
+               help=u._('Time to cache vmexpires statistics, in seconds. '
+                        'Statistics of a project are invalidated as its '
+                        'listings, statistics of all projects are only '
+                        'refreshed after this time.')),
+]
+
+compression_opt_group = cfg.OptGroup(name='compression',
+                                     title='API Response Compression Options')
+
+compression_opts = [
+    cfg.ListOpt('algorithms', default=['gzip'],
+                item_type=cfg.types.String(choices=['gzip', 'deflate']),
+                help=u._('Content codings the compression middleware may '
+                         'use, among gzip and deflate. The coding with the '
+                         'highest quality in the request Accept-Encoding '
+                         'header is used.')),
+    cfg.IntOpt('min_size', default=1024, min=0,
+               help=u._('Responses whose body is smaller than this size, in '
+                        'bytes, are not compressed. Streamed responses, of '
+                        'unknown size, are always compressed.')),
+    cfg.IntOpt('level', default=6, min=1, max=9,
+               help=u._('Compression level, from 1 (fastest) to 9 '
+                        '(smallest).')),
+    cfg.ListOpt('content_types', default=['application/json'],
+                help=u._('Content types of compressed responses.')),
+]
+
+metrics_opt_group = cfg.OptGroup(name='metrics',
+                                 title='Metrics Options')
+
+metrics_opts = [
+    cfg.HostAddressOpt('listen_host', default='127.0.0.1',
+                       help=u._('Address the API, worker and cleaner '
+                                'metrics listeners bind to.')),
+    cfg.PortOpt('api_port', default=0,
+                help=u._('Port the API serves its metrics on, in the '
+                         'Prometheus text format, without authentication. '
+                         '0 disables the listener. With several API '
+                         'processes, set the PROMETHEUS_MULTIPROC_DIR '
+                         'environment variable for the metrics of all '
+                         'the processes to be served.')),
+    cfg.PortOpt('worker_port', default=0,
+                help=u._('Port the worker serves its metrics on, in the '
+                         'Prometheus text format. 0 disables the '
+                         'listener. With several asynchronous_workers, '
+                         'set the PROMETHEUS_MULTIPROC_DIR environment '
+                         'variable for the metrics of all the processes to '
+                         'be served and written.')),
+    cfg.PortOpt('cleaner_port', default=0,
+                help=u._('Port the cleaner serves its metrics on, in the '
+                         'Prometheus text format. 0 disables the '
+                         'listener.')),
+    cfg.StrOpt('textfile_dir',
+               help=u._('Directory the worker and the cleaner write their '
+                        'metrics to, as os_vm_expire_<service>.prom files '
+                        'for the node_exporter textfile collector. Unset '
+                        'disables writing.')),
+    cfg.IntOpt('textfile_interval', default=60, min=1,
+               help=u._('Interval between writes of the metrics files, in '
+                        'seconds.')),
 ]
 
 host_opts = [
@@ -231,6 +395,9 @@ def list_opts():
     yield cleaner_opt_group, cleaner_opts
     yield worker_opt_group, worker_opts
     yield mail_opt_group, mail_opts
+    yield listing_cache_opt_group, listing_cache_opts
+    yield compression_opt_group, compression_opts
+    yield metrics_opt_group, metrics_opts
 
 
 # Flag to indicate  configuration is already parsed once or not
@@ -263,10 +430,11 @@ def parse_args(conf, args=None, usage=None, default_config_files=None):
                 os.path.join(dir_path, '../../osvmexpire.conf')
             ]
 
+    # --version can only be given with args, the version is slow to compute
     conf(args=args if args else [],
          project='os-vm-expire',
          prog='os-vm-expire',
-         version=os_vm_expire.version.__version__,
+         version=os_vm_expire.version.get_version() if args else None,
          usage=usage,
          default_config_files=default_config_files)
 
@@ -297,6 +465,17 @@ def new_config():
     conf.register_opts(cleaner_opts, group=cleaner_opt_group)
     conf.register_opts(worker_opts, group=worker_opt_group)
     conf.register_opts(mail_opts, group=mail_opt_group)
+    conf.register_group(listing_cache_opt_group)
+    conf.register_opts(listing_cache_opts, group=listing_cache_opt_group)
+    conf.register_group(compression_opt_group)
+    conf.register_opts(compression_opts, group=compression_opt_group)
+    conf.register_group(metrics_opt_group)
+    conf.register_opts(metrics_opts, group=metrics_opt_group)
+
+    # Cache is disabled by default, a process local memory backend is used
+    # once enabled unless configured otherwise.
+    cache.configure(conf)
+    conf.set_default('backend', 'oslo_cache.dict', group='cache')
 
     # Update default values from libraries that carry their own oslo.config
     # initialization and configuration.
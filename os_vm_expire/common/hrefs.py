@@ -9,26 +9,28 @@
 #  WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 #  License for the specific language governing permissions and limitations
 #  under the License.
+from six.moves.urllib import parse
+
 from os_vm_expire.common import utils
 
 
-def convert_resource_id_to_href(resource_slug, resource_id):
+def convert_resource_id_to_href(resource_slug, resource_id, base_url=None):
     """Convert the resource ID to a HATEOAS-style href with resource slug."""
     if resource_id:
         resource = '{slug}/{id}'.format(slug=resource_slug, id=resource_id)
     else:
         resource = '{slug}/????'.format(slug=resource_slug)
-    return utils.hostname_for_refs(resource=resource)
+    return utils.hostname_for_refs(resource=resource, base_url=base_url)
 
 
-def convert_vmexpire_to_href(vmexpire_id):
+def convert_vmexpire_to_href(vmexpire_id, base_url=None):
     """Convert the secret-store ID to a HATEOAS-style href."""
-    return convert_resource_id_to_href('vmexpire', vmexpire_id)
+    return convert_resource_id_to_href('vmexpire', vmexpire_id, base_url)
 
 
-def convert_to_hrefs(fields):
+def convert_to_hrefs(fields, base_url=None):
     """Convert id's within a fields dict to HATEOAS-style hrefs."""
-    url = convert_vmexpire_to_href(fields['id'])
+    url = convert_vmexpire_to_href(fields['id'], base_url)
     fields['links'] = {'self': url}
     return fields
 
@@ -87,15 +89,64 @@ def add_nav_hrefs(resources_name, offset, limit,
     return data
 
 
-def add_self_href(resource_name, data):
+def convert_params_to_href(resources_name, params, base_url=None):
+    """Convert query parameters to a HATEOAS-style list href.
+
+    :param resources_name: Name of api resource
+    :param params: list of (name, value) query parameters
+    :param base_url: base url, derived from the request if None
+    """
+    if params:
+        resources_name = '{0}?{1}'.format(resources_name,
+                                          parse.urlencode(params))
+    return utils.hostname_for_refs(resource=resources_name, base_url=base_url)
+
+
+def add_marker_nav_hrefs(resources_name, params, limit, page, offset, data,
+                         base_url=None):
+    """Adds next and/or previous hrefs to keyset paged list responses.
+
+    Query parameters of the current request are kept, except paging ones,
+    so that filters apply to the other pages too.
+
+    :param resources_name: Name of api resource
+    :param params: list of (name, value) query parameters of the request
+    :param limit: Max amount of elements listed on current page
+    :param page: `os_vm_expire.model.repositories.Page` currently viewed
+    :param offset: offset of the current page, if no marker was used
+    :param base_url: base url, derived from the request if None
+    :returns: augmented dictionary with next and/or previous hrefs
+    """
+    params = [(k, v) for k, v in params
+              if k not in ('limit', 'marker', 'offset')]
+    params.append(('limit', limit))
+    if page.has_previous:
+        if page.previous_marker:
+            previous = params + [('marker', page.previous_marker)]
+        elif offset > limit:
+            previous = params + [('offset', offset - limit)]
+        else:
+            previous = params
+        data.update({'previous': convert_params_to_href(resources_name,
+                                                        previous, base_url)})
+    if page.next_marker:
+        data.update({'next': convert_params_to_href(
+            resources_name, params + [('marker', page.next_marker)],
+            base_url)})
+    return data
+
+
+def add_self_href(resource_name, data, base_url=None):
     """Add self href to response
 
     :param resources_name: Name of api resource
+    :param base_url: base url, derived from the request if None
     :returns: augmented dictionary with next and/or previous hrefs
     """
     if 'links' not in data:
         data['links'] = {}
-    data['links'].update({'self': utils.hostname_for_refs(resource=resource_name)})
+    data['links'].update({'self': utils.hostname_for_refs(
+        resource=resource_name, base_url=base_url)})
     return data
 
 
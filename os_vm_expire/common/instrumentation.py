@@ -0,0 +1,227 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Per request timing of database statements and upstream HTTP calls.
+
+Statistics are collected in the thread (or greenthread) processing the
+request, between start() and stop(), see
+os_vm_expire.api.middleware.timing. Outside of a request, recording is a
+no-op.
+
+Worker events and cleaner phases are collected as units of work too, see
+unit(). In debug mode, units executing more SQL statements than their
+[DEFAULT]/statement_budgets entry are logged with their most repeated
+statements, which usually reveal N+1 queries.
+"""
+import collections
+import contextlib
+import math
+import threading
+import time
+
+import sqlalchemy
+
+from os_vm_expire.common import config
+from os_vm_expire.common import utils
+
+CONF = config.CONF
+
+LOG = utils.getLogger(__name__)
+
+# Kinds of timed operations
+DB = 'db'
+HTTP = 'http'
+
+_LOCAL = threading.local()
+
+
+class RequestStats(object):
+    """Durations and counts of the operations of a request.
+
+    :param name: name of the unit of work, key of its statement budget
+    :param track_statements: count executions of each SQL statement
+    """
+
+    def __init__(self, name=None, track_statements=False):
+        self.name = name
+        self.started_at = time.time()
+        self.durations = {DB: 0.0, HTTP: 0.0}
+        self.counts = {DB: 0, HTTP: 0}
+        self.statements = (collections.Counter() if track_statements
+                           else None)
+
+    def add(self, kind, duration, statement=None):
+        self.durations[kind] += duration
+        self.counts[kind] += 1
+        if statement is not None and self.statements is not None:
+            self.statements[statement] += 1
+
+    def most_repeated(self, count=3):
+        """Returns the most executed statements, with their count."""
+        if not self.statements:
+            return []
+        return [(statement, executions) for statement, executions
+                in self.statements.most_common(count) if executions > 1]
+
+    def elapsed(self):
+        """Returns the time since the start of the request, in seconds."""
+        return time.time() - self.started_at
+
+    def to_dict(self):
+        """Returns the statistics as log fields, durations in ms."""
+        return {
+            'request_time_ms': round(self.elapsed() * 1000, 3),
+            'db_time_ms': round(self.durations[DB] * 1000, 3),
+            'db_statements': self.counts[DB],
+            'http_time_ms': round(self.durations[HTTP] * 1000, 3),
+            'http_requests': self.counts[HTTP]
+        }
+
+    def server_timing(self):
+        """Returns the value of a Server-Timing header."""
+        return ('total;dur=%.3f, db;dur=%.3f;desc="%d statements", '
+                'http;dur=%.3f;desc="%d requests"') % (
+                    self.elapsed() * 1000,
+                    self.durations[DB] * 1000, self.counts[DB],
+                    self.durations[HTTP] * 1000, self.counts[HTTP])
+
+
+def percentile(values, percent):
+    """Returns the nearest-rank percentile of a sorted list."""
+    if not values:
+        return 0.0
+    rank = int(math.ceil(percent / 100.0 * len(values))) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+
+def _get_stack():
+    stack = getattr(_LOCAL, 'stack', None)
+    if stack is None:
+        stack = _LOCAL.stack = []
+    return stack
+
+
+def start(name=None, track_statements=None):
+    """Starts collecting statistics of the current request or unit.
+
+    Collections nest, operations are recorded in all started ones.
+
+    :param track_statements: count executions of each SQL statement,
+                             defaults to the debug mode
+    """
+    if track_statements is None:
+        track_statements = CONF.debug
+    stats = RequestStats(name=name, track_statements=track_statements)
+    _get_stack().append(stats)
+    return stats
+
+
+def stop():
+    """Stops collecting statistics, returns those of the request."""
+    stack = _get_stack()
+    return stack.pop() if stack else None
+
+
+def clear():
+    """Drops the statistics being collected in the current thread.
+
+    Collections left started by an interrupted request would otherwise
+    also record the operations of the next one.
+    """
+    _get_stack()[:] = []
+
+
+def get_current():
+    """Returns the statistics of the current request, None if none."""
+    stack = _get_stack()
+    return stack[-1] if stack else None
+
+
+def record(kind, duration, statement=None):
+    """Adds an operation of kind to the statistics being collected."""
+    for stats in _get_stack():
+        stats.add(kind, duration, statement=statement)
+
+
+def get_budget(name):
+    """Returns the SQL statement budget of a unit of work, None if none."""
+    budget = CONF.statement_budgets.get(name)
+    return int(budget) if budget else None
+
+
+def check_budget(stats):
+    """Logs a warning, in debug mode, if stats exceed their budget.
+
+    :returns: True if the statement budget is exceeded
+    """
+    budget = get_budget(stats.name)
+    if budget is None or stats.counts[DB] <= budget:
+        return False
+    if CONF.debug:
+        LOG.warning('%(unit)s executed %(count)d SQL statements, over its '
+                    'budget of %(budget)d. Most repeated: %(repeated)s',
+                    {'unit': stats.name, 'count': stats.counts[DB],
+                     'budget': budget, 'repeated': stats.most_repeated()})
+    return True
+
+
+@contextlib.contextmanager
+def unit(name):
+    """Collects the statistics of a unit of work, checks its budget."""
+    stats = start(name)
+    try:
+        yield stats
+    finally:
+        stop()
+        check_budget(stats)
+
+
+@contextlib.contextmanager
+def timed(kind):
+    """Context manager recording the duration of its block."""
+    started_at = time.time()
+    try:
+        yield
+    finally:
+        record(kind, time.time() - started_at)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    conn.info.setdefault('query_started_at', []).append(time.time())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    started_at = conn.info['query_started_at'].pop()
+    record(DB, time.time() - started_at, statement=statement)
+
+
+def _handle_error(exception_context):
+    conn = exception_context.connection
+    started_at = conn.info.get('query_started_at') if conn else None
+    if started_at:
+        record(DB, time.time() - started_at.pop())
+
+
+def instrument_engine(engine):
+    """Times the statements executed by engine, once per engine."""
+    if sqlalchemy.event.contains(engine, 'before_cursor_execute',
+                                 _before_cursor_execute):
+        return
+    sqlalchemy.event.listen(engine, 'before_cursor_execute',
+                            _before_cursor_execute)
+    sqlalchemy.event.listen(engine, 'after_cursor_execute',
+                            _after_cursor_execute)
+    sqlalchemy.event.listen(engine, 'handle_error', _handle_error)
@@ -0,0 +1,220 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Process wide metrics, exposed in the Prometheus text format.
+
+Metrics are kept in memory by each process, in the REGISTRY of
+prometheus_client. The API, the worker and the cleaner can serve them on a
+port of their own or write them to a file read by the node_exporter
+textfile collector, see Exporter.
+
+Services running several processes must be started with the
+PROMETHEUS_MULTIPROC_DIR environment variable set to an empty directory
+of their own: processes then keep their metrics in files of this
+directory, and the metrics exposed are those of all the processes.
+"""
+import os
+import socket
+import threading
+
+import prometheus_client
+from prometheus_client import multiprocess
+
+from os_vm_expire.common import config
+from os_vm_expire.common import utils
+
+CONF = config.CONF
+
+LOG = utils.getLogger(__name__)
+
+# Registry of the metrics of os-vm-expire, without the collectors of the
+# default registry of prometheus_client.
+REGISTRY = prometheus_client.CollectorRegistry()
+
+# Buckets of long operations, such as cleaner phases or event lag
+LONG_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+
+API_REQUEST_DURATION = prometheus_client.Histogram(
+    'os_vm_expire_api_request_duration_seconds',
+    'Time spent in API controller methods.',
+    ('controller', 'method', 'code'),
+    registry=REGISTRY)
+
+WORKER_EVENTS = prometheus_client.Counter(
+    'os_vm_expire_worker_events_total',
+    'Nova notifications processed by the worker.',
+    ('event_type',),
+    registry=REGISTRY)
+
+WORKER_EVENT_LAG = prometheus_client.Histogram(
+    'os_vm_expire_worker_event_lag_seconds',
+    'Time between the emission of Nova notifications and their processing.',
+    ('event_type',), buckets=LONG_BUCKETS,
+    registry=REGISTRY)
+
+CLEANER_PHASE_DURATION = prometheus_client.Histogram(
+    'os_vm_expire_cleaner_phase_duration_seconds',
+    'Duration of the phases of cleaner cycles.',
+    ('phase',), buckets=LONG_BUCKETS,
+    registry=REGISTRY)
+
+CLEANER_EMAILS = prometheus_client.Counter(
+    'os_vm_expire_cleaner_emails_total',
+    'Expiration and deletion emails sent, or which failed, by the cleaner.',
+    ('kind', 'result'),
+    registry=REGISTRY)
+
+CLEANER_NOVA_DELETES = prometheus_client.Counter(
+    'os_vm_expire_cleaner_nova_deletes_total',
+    'Instance deletions requested to Nova by the cleaner, by HTTP status.',
+    ('status',),
+    registry=REGISTRY)
+
+DB_POOL_CHECKOUT_WAIT = prometheus_client.Histogram(
+    'os_vm_expire_db_pool_checkout_wait_seconds',
+    'Time waited to check out a database connection from the pool.',
+    registry=REGISTRY)
+
+
+def timed_checkout(connect):
+    """Wraps an engine connect method to observe pool checkout wait."""
+    def _connect(*args, **kwargs):
+        with DB_POOL_CHECKOUT_WAIT.time():
+            return connect(*args, **kwargs)
+    return _connect
+
+
+def multiprocess_dir():
+    """Returns the directory of the multiprocess mode, None if not set."""
+    return (os.environ.get('PROMETHEUS_MULTIPROC_DIR') or
+            os.environ.get('prometheus_multiproc_dir'))
+
+
+def exposed_registry():
+    """Returns the registry of the metrics exposed by the process.
+
+    In multiprocess mode, the metrics of all the processes are collected
+    from their files, the REGISTRY only having those of the process.
+    """
+    if not multiprocess_dir():
+        return REGISTRY
+    registry = prometheus_client.CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def wsgi_app(environ, start_response):
+    """WSGI application serving the metrics."""
+    app = prometheus_client.make_wsgi_app(exposed_registry())
+    return app(environ, start_response)
+
+
+def write_textfile(path):
+    """Writes the metrics to path, atomically for the textfile collector."""
+    prometheus_client.write_to_textfile(path, exposed_registry())
+
+
+class _Server(object):
+    """HTTP listener serving the metrics, in a thread."""
+
+    def __init__(self, host, port, name):
+        from wsgiref import simple_server
+
+        class _QuietHandler(simple_server.WSGIRequestHandler):
+
+            def log_message(self, format, *args):
+                LOG.debug(format, *args)
+
+        self._server = simple_server.make_server(
+            host, port, wsgi_app, handler_class=_QuietHandler)
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name=name)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class Exporter(object):
+    """Exposes the metrics of a service process, from [metrics] options.
+
+    Metrics are served over HTTP when port is set and, when textfile is
+    True, written every textfile_interval seconds to
+    <textfile_dir>/os_vm_expire_<name>.prom when textfile_dir is set.
+
+    In multiprocess mode, the exporters of all the processes expose the
+    same metrics: the first process binding the port serves them and the
+    file is written by every process.
+    """
+
+    def __init__(self, name, port, textfile=True):
+        self.name = name
+        self.port = port
+        self.textfile = textfile
+        self._server = None
+        self._stopped = threading.Event()
+        self._threads = []
+
+    @property
+    def textfile_path(self):
+        if not (self.textfile and CONF.metrics.textfile_dir):
+            return None
+        return os.path.join(CONF.metrics.textfile_dir,
+                            'os_vm_expire_%s.prom' % self.name)
+
+    def start(self):
+        if self.port:
+            try:
+                self._server = _Server(CONF.metrics.listen_host, self.port,
+                                       'osvmexpire-metrics-' + self.name)
+            except socket.error as e:
+                # Other processes of the service may own the port
+                LOG.warning('Could not serve metrics on port %d: %s',
+                            self.port, e)
+            else:
+                LOG.info('Serving metrics on %s:%d',
+                         CONF.metrics.listen_host, self.port)
+                self._server.start()
+        if self.textfile_path:
+            thread = threading.Thread(target=self._write_textfile,
+                                      name='osvmexpire-metrics-' + self.name)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _write_textfile(self):
+        while True:
+            try:
+                write_textfile(self.textfile_path)
+            except Exception:
+                LOG.exception('Failed to write metrics to %s',
+                              self.textfile_path)
+            if self._stopped.wait(CONF.metrics.textfile_interval):
+                return
+
+    def stop(self):
+        self._stopped.set()
+        if self._server is not None:
+            self._server.stop()
+            self._server = None
+        if self.textfile_path:
+            try:
+                write_textfile(self.textfile_path)
+            except Exception:
+                LOG.exception('Failed to write metrics to %s',
+                              self.textfile_path)
@@ -28,6 +28,10 @@ rules = [
                        'rule:admin'),
     policy.RuleDefault('vmexclude:delete',
                        'rule:admin'),
+    policy.RuleDefault('job:get',
+                       'rule:admin'),
+    policy.RuleDefault('job:create',
+                       'rule:admin'),
 ]
 
 
@@ -33,7 +33,9 @@ rules = [
     "vmexpire:delete": "rule:context_is_admin",
     "vmexclude:get": "rule:admin",
     "vmexclude:create": "rule:admin",
-    "vmexclude:delete": "rule:admin"
+    "vmexclude:delete": "rule:admin",
+    "job:get": "rule:admin",
+    "job:create": "rule:admin"
 }
 
 
@@ -0,0 +1,70 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Process wide policy enforcer.
+"""
+import threading
+
+from oslo_policy import policy
+
+from os_vm_expire.common import config
+
+CONF = config.CONF
+
+_ENFORCER = None
+_LOCK = threading.Lock()
+
+
+class Enforcer(policy.Enforcer):
+    """Policy enforcer tracking changes of its rules.
+
+    rules_version is incremented each time rules are set, which happens
+    when the policy file is (re)loaded, so that callers can memoize
+    authorization results per version.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.rules_version = 0
+        super(Enforcer, self).__init__(*args, **kwargs)
+
+    def set_rules(self, rules, overwrite=True, use_conf=False):
+        super(Enforcer, self).set_rules(rules, overwrite=overwrite,
+                                        use_conf=use_conf)
+        self.rules_version += 1
+
+    def clear(self):
+        super(Enforcer, self).clear()
+        self.rules_version += 1
+
+
+def get_enforcer():
+    """Returns the enforcer shared by all requests of the process.
+
+    The policy file is loaded once, then reloaded by enforce() or
+    load_rules() calls when its modification time changes.
+    """
+    global _ENFORCER
+    if _ENFORCER is None:
+        with _LOCK:
+            if _ENFORCER is None:
+                _ENFORCER = Enforcer(CONF)
+    return _ENFORCER
+
+
+def reset():
+    """Drops the shared enforcer, used for unit testing."""
+    global _ENFORCER
+    if _ENFORCER:
+        _ENFORCER.clear()
+    _ENFORCER = None
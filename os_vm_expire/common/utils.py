@@ -24,7 +24,6 @@ import uuid
 
 from oslo_log import log
 from oslo_utils import uuidutils
-import pecan
 import six
 from six.moves.urllib import parse
 
@@ -40,6 +39,10 @@ API_VERSION = 'v1'
 
 
 def _do_allow_certain_content_types(func, content_types_list=[]):
+    # NOTE: pecan is only imported by the API code paths, this module being
+    # used by the command line tools too.
+    import pecan
+
     # Allows you to bypass pecan's content-type restrictions
     cfg = pecan.util._cfg(func)
     cfg.setdefault('content_types', {})
@@ -69,6 +72,8 @@ def get_base_url_from_request():
     Some of unit tests does not have pecan context that's why using request
     attr check on pecan instance.
     """
+    import pecan
+
     if not CONF.host_href and hasattr(pecan.request, 'url'):
         p_url = parse.urlsplit(pecan.request.url)
         if p_url.path:
@@ -80,9 +85,14 @@ def get_base_url_from_request():
         return CONF.host_href
 
 
-def hostname_for_refs(resource=None):
-    """Return the HATEOAS-style return URI reference for this service."""
-    base_url = get_base_url_from_request()
+def hostname_for_refs(resource=None, base_url=None):
+    """Return the HATEOAS-style return URI reference for this service.
+
+    :param resource: resource path, relative to the API version
+    :param base_url: base url to use, derived from the request if None
+    """
+    if base_url is None:
+        base_url = get_base_url_from_request()
     ref = ['{base}/{version}'.format(base=base_url, version=API_VERSION)]
     if resource:
         ref.append('/' + resource)
@@ -105,7 +115,7 @@ def get_accepted_encodings(req):
     :param req: request object
     :returns: list of client acceptable encodings sorted by q value.
     """
-    header = req.get_header('Accept-Encoding')
+    header = req.headers.get('Accept-Encoding')
 
     return get_accepted_encodings_direct(header)
 
@@ -120,30 +130,45 @@ def get_accepted_encodings_direct(content_encoding_header):
     if content_encoding_header is None:
         return None
 
+    return [encoding.coding
+            for encoding in get_encoding_qualities(content_encoding_header)
+            if encoding.quality > 0.0]
+
+
+def get_encoding_qualities(content_encoding_header):
+    """Returns the codings of an Accept-Encoding header with their quality.
+
+    Codings refused with q=0 are kept, so that * can be resolved to other
+    codings. Malformed entries, such as quality values which are not
+    numbers between 0 and 1, are ignored.
+    :param content_encoding_header: value of the Accept-Encoding header
+    :returns: list of (coding, quality) named tuples, codings in lower case,
+              sorted by quality, highest first.
+    """
     Encoding = collections.namedtuple('Encoding', ['coding', 'quality'])
 
     encodings = list()
     for enc in content_encoding_header.split(','):
-        if ';' in enc:
-            coding, qvalue = enc.split(';')
-            try:
-                qvalue = qvalue.split('=')[1]
-                quality = float(qvalue.strip())
-            except ValueError:
-                # can't convert quality to float
-                return None
-            if quality > 1.0 or quality < 0.0:
-                # quality is outside valid range
-                return None
-            if quality > 0.0:
-                encodings.append(Encoding(coding.strip(), quality))
-        else:
-            encodings.append(Encoding(enc.strip(), 1))
+        coding, _, params = enc.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        try:
+            for param in params.split(';'):
+                name, _, value = param.partition('=')
+                if name.strip().lower() == 'q':
+                    quality = float(value.strip())
+        except ValueError:
+            # can't convert quality to float
+            continue
+        if not 0.0 <= quality <= 1.0:
+            # quality is outside valid range
+            continue
+        encodings.append(Encoding(coding, quality))
 
     # Sort the encodings by quality
-    encodings = sorted(encodings, key=lambda e: e.quality, reverse=True)
-
-    return [encoding.coding for encoding in encodings]
+    return sorted(encodings, key=lambda e: e.quality, reverse=True)
 
 
 def generate_fullname_for(instance):
@@ -15,9 +15,9 @@
 #    under the License.
 
 import oslo_context
-from oslo_policy import policy
 
 from os_vm_expire.common import config
+from os_vm_expire.common import policy
 
 CONF = config.CONF
 
@@ -34,7 +34,7 @@ class RequestContext(oslo_context.context.RequestContext):
         if project:
             kwargs['tenant'] = project
         self.project = project
-        self.policy_enforcer = policy_enforcer or policy.Enforcer(CONF)
+        self.policy_enforcer = policy_enforcer or policy.get_enforcer()
         super(RequestContext, self).__init__(**kwargs)
 
     def to_dict(self):
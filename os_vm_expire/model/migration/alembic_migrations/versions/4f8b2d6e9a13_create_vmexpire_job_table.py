@@ -0,0 +1,56 @@
+# Copyright 2018 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""create vmexpire job table
+
+Revision ID: 4f8b2d6e9a13
+Revises: 9e4a2c6b1d57
+Create Date: 2018-04-03 14:12:51.804263
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '4f8b2d6e9a13'
+down_revision = '9e4a2c6b1d57'
+
+
+def upgrade():
+    ctx = op.get_context()
+    con = op.get_bind()
+    table_exists = ctx.dialect.has_table(con, 'vmexpire_job')
+    if not table_exists:
+        op.create_table(
+            'vmexpire_job',
+            sa.Column('id', sa.String(length=36), nullable=False),
+            sa.Column('created_at', sa.DateTime(), nullable=False),
+            sa.Column('updated_at', sa.DateTime(), nullable=False),
+            sa.Column('deleted_at', sa.DateTime(), nullable=True),
+            sa.Column('deleted', sa.Boolean(), nullable=False),
+            sa.Column('project_id', sa.String(255), nullable=False),
+            sa.Column('operation', sa.String(16), nullable=False),
+            sa.Column('all_tenants', sa.Boolean(), nullable=False),
+            sa.Column('status', sa.String(16), nullable=False),
+            sa.Column('instance_ids', sa.Text(), nullable=False),
+            sa.Column('total', sa.Integer(), nullable=False),
+            sa.Column('processed', sa.Integer(), nullable=False),
+            sa.Column('failures', sa.Text(), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+        )
+        op.create_index(op.f('ix_vmexpire_job_project_id'), 'vmexpire_job',
+                        ['project_id'], unique=False)
+        op.create_index(op.f('ix_vmexpire_job_status'), 'vmexpire_job',
+                        ['status'], unique=False)
@@ -0,0 +1,47 @@
+# Copyright 2018 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""create tombstone table
+
+Revision ID: 5b2d8e4f1a37
+Revises: 3cf9516e9a67
+Create Date: 2018-03-12 10:12:45.104213
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '5b2d8e4f1a37'
+down_revision = '3cf9516e9a67'
+
+
+def upgrade():
+    ctx = op.get_context()
+    con = op.get_bind()
+    table_exists = ctx.dialect.has_table(con, 'vmtombstone')
+    if not table_exists:
+        op.create_table(
+            'vmtombstone',
+            sa.Column('id', sa.String(length=36), nullable=False),
+            sa.Column('created_at', sa.DateTime(), nullable=False),
+            sa.Column('updated_at', sa.DateTime(), nullable=False),
+            sa.Column('deleted_at', sa.DateTime(), nullable=True),
+            sa.Column('deleted', sa.Boolean(), nullable=False),
+            sa.Column('instance_id', sa.String(255), index=True,
+                      nullable=False),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('instance_id', name='_vmtombstone_uc'),
+        )
@@ -0,0 +1,44 @@
+# Copyright 2018 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""add vmexpire list indexes
+
+Revision ID: 7c1f3a9d2e48
+Revises: 5b2d8e4f1a37
+Create Date: 2018-03-19 14:02:11.538467
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '7c1f3a9d2e48'
+down_revision = '5b2d8e4f1a37'
+
+INDEXES = {
+    'ix_vmexpire_expire': ['expire'],
+    'ix_vmexpire_created_at': ['created_at'],
+    'ix_vmexpire_user_id': ['user_id'],
+    'ix_vmexpire_project_id_expire': ['project_id', 'expire'],
+    'ix_vmexpire_project_id_created_at': ['project_id', 'created_at'],
+}
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    existing = [index['name'] for index in inspector.get_indexes('vmexpire')]
+    for name in sorted(INDEXES):
+        if name not in existing:
+            op.create_index(name, 'vmexpire', INDEXES[name])
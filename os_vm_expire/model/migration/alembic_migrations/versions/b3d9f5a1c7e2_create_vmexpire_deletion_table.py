@@ -0,0 +1,57 @@
+# Copyright 2018 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""create vmexpire deletion table
+
+Revision ID: b3d9f5a1c7e2
+Revises: 4f8b2d6e9a13
+Create Date: 2018-04-09 10:27:43.119052
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'b3d9f5a1c7e2'
+down_revision = '4f8b2d6e9a13'
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    existing = [index['name'] for index in inspector.get_indexes('vmexpire')]
+    if 'ix_vmexpire_project_id_updated_at' not in existing:
+        op.create_index('ix_vmexpire_project_id_updated_at', 'vmexpire',
+                        ['project_id', 'updated_at'])
+
+    ctx = op.get_context()
+    con = op.get_bind()
+    table_exists = ctx.dialect.has_table(con, 'vmexpire_deletion')
+    if not table_exists:
+        op.create_table(
+            'vmexpire_deletion',
+            sa.Column('id', sa.String(length=36), nullable=False),
+            sa.Column('created_at', sa.DateTime(), nullable=False),
+            sa.Column('updated_at', sa.DateTime(), nullable=False),
+            sa.Column('deleted_at', sa.DateTime(), nullable=True),
+            sa.Column('deleted', sa.Boolean(), nullable=False),
+            sa.Column('vmexpire_id', sa.String(36), nullable=False),
+            sa.Column('instance_id', sa.String(255), nullable=False),
+            sa.Column('project_id', sa.String(255), nullable=False),
+            sa.PrimaryKeyConstraint('id'),
+        )
+        op.create_index('ix_vmexpire_deletion_project_id_created_at',
+                        'vmexpire_deletion', ['project_id', 'created_at'])
+        op.create_index('ix_vmexpire_deletion_created_at',
+                        'vmexpire_deletion', ['created_at'])
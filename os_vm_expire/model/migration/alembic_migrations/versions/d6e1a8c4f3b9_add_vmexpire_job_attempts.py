@@ -0,0 +1,41 @@
+# Copyright 2018 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""add vmexpire job attempts
+
+Revision ID: d6e1a8c4f3b9
+Revises: b3d9f5a1c7e2
+Create Date: 2018-04-12 09:41:06.372915
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'd6e1a8c4f3b9'
+down_revision = 'b3d9f5a1c7e2'
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    existing = [column['name']
+                for column in inspector.get_columns('vmexpire_job')]
+    if 'attempts' not in existing:
+        op.add_column('vmexpire_job',
+                      sa.Column('attempts', sa.Integer(), nullable=False,
+                                server_default='0'))
+    if 'error' not in existing:
+        op.add_column('vmexpire_job',
+                      sa.Column('error', sa.Text(), nullable=True))
@@ -0,0 +1,44 @@
+# Copyright 2018 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""add vmexpire job selector
+
+Revision ID: e8b3f1c6a2d4
+Revises: d6e1a8c4f3b9
+Create Date: 2018-04-19 14:27:51.803164
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'e8b3f1c6a2d4'
+down_revision = 'd6e1a8c4f3b9'
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    existing = [column['name']
+                for column in inspector.get_columns('vmexpire_job')]
+    if 'selector' not in existing:
+        op.add_column('vmexpire_job',
+                      sa.Column('selector', sa.Text(), nullable=True))
+    if 'project_ids' not in existing:
+        op.add_column('vmexpire_job',
+                      sa.Column('project_ids', sa.Text(), nullable=True))
+    if 'marker' not in existing:
+        op.add_column('vmexpire_job',
+                      sa.Column('marker', sa.String(length=255),
+                                nullable=True))
@@ -207,7 +207,16 @@ class VmExpire(BASE, ModelBase):
         nullable=True)
 
     __table_args__ = (sa.UniqueConstraint('instance_id',
-                                          name='_vmexpire_uc'),)
+                                          name='_vmexpire_uc'),
+                      sa.Index('ix_vmexpire_expire', 'expire'),
+                      sa.Index('ix_vmexpire_created_at', 'created_at'),
+                      sa.Index('ix_vmexpire_user_id', 'user_id'),
+                      sa.Index('ix_vmexpire_project_id_expire',
+                               'project_id', 'expire'),
+                      sa.Index('ix_vmexpire_project_id_created_at',
+                               'project_id', 'created_at'),
+                      sa.Index('ix_vmexpire_project_id_updated_at',
+                               'project_id', 'updated_at'),)
 
     def __init__(self, parsed_request=None):
         """Creates secret from a dict."""
@@ -250,3 +259,193 @@ class VmExclude(BASE, ModelBase):
             'exclude_id': self.exclude_id,
             'exclude_type': self.exclude_type
         }
+
+
+class VmTombstone(BASE, ModelBase):
+    """Represents a deleted instance that was not known when deleted.
+
+    Tombstones are recorded when a deletion notification is received before
+    the creation one, so that the late creation does not add an expiration
+    for a VM that no longer exists.
+    """
+
+    __tablename__ = 'vmtombstone'
+
+    instance_id = sa.Column(
+        sa.String(255), index=True,
+        nullable=False)
+
+    __table_args__ = (sa.UniqueConstraint('instance_id',
+                                          name='_vmtombstone_uc'),)
+
+    def __init__(self, parsed_request=None):
+        """Creates tombstone."""
+        super(VmTombstone, self).__init__()
+
+    def _do_extra_dict_fields(self):
+        """Sub-class hook method: return dict of fields."""
+        return {
+            'id': self.id,
+            'instance_id': self.instance_id
+        }
+
+
+class VmExpireDeletion(BASE, ModelBase):
+    """Represents the removal of an expiration from a project.
+
+    Expirations are hard deleted, deletions are logged so that changes
+    feeds can report them. created_at is the deletion time.
+    """
+
+    __tablename__ = 'vmexpire_deletion'
+
+    vmexpire_id = sa.Column(
+        sa.String(36),
+        nullable=False)
+    instance_id = sa.Column(
+        sa.String(255),
+        nullable=False)
+    project_id = sa.Column(
+        sa.String(255),
+        nullable=False)
+
+    __table_args__ = (sa.Index('ix_vmexpire_deletion_project_id_created_at',
+                               'project_id', 'created_at'),
+                      sa.Index('ix_vmexpire_deletion_created_at',
+                               'created_at'),)
+
+    def __init__(self, parsed_request=None):
+        """Creates deletion."""
+        super(VmExpireDeletion, self).__init__()
+
+    def _do_extra_dict_fields(self):
+        """Sub-class hook method: return dict of fields."""
+        return {
+            'id': self.id,
+            'vmexpire_id': self.vmexpire_id,
+            'instance_id': self.instance_id,
+            'project_id': self.project_id
+        }
+
+
+class CacheGeneration(BASE, ModelBase):
+    """Represents the generation of cached listings of a scope.
+
+    The generation of a scope is incremented in the transaction writing
+    entities of this scope, changing the keys of its cached listings.
+    """
+
+    __tablename__ = 'cache_generation'
+
+    scope = sa.Column(
+        sa.String(255),
+        nullable=False)
+    generation = sa.Column(
+        sa.BigInteger,
+        nullable=False,
+        default=0)
+
+    __table_args__ = (sa.UniqueConstraint('scope',
+                                          name='_cache_generation_uc'),)
+
+    def __init__(self, parsed_request=None):
+        """Creates cache generation."""
+        super(CacheGeneration, self).__init__()
+
+    def _do_extra_dict_fields(self):
+        """Sub-class hook method: return dict of fields."""
+        return {
+            'id': self.id,
+            'scope': self.scope,
+            'generation': self.generation
+        }
+
+
+class JobStatus(object):
+    """Status of bulk jobs."""
+    PENDING = 'PENDING'
+    ACTIVE = 'ACTIVE'
+    COMPLETED = 'COMPLETED'
+    FAILED = 'FAILED'
+
+
+class VmExpireJob(BASE, ModelBase):
+    """Represents an asynchronous bulk operation on expirations.
+
+    Jobs are processed by the cleaner, instance_ids being processed by
+    chunks. processed is the number of processed instances, failures the
+    list of instances the operation failed for. attempts is the number of
+    consecutive failed attempts to process the next chunk, error the
+    reason of the last one, the job being FAILED after too many attempts.
+
+    Jobs with a selector ({"project_id": ...} or {"domain_id": ...}) apply
+    to the expirations of projects instead of instance_ids. project_ids
+    are the selected projects, resolved by the cleaner for a domain, and
+    marker the last instance processed, expirations being selected by
+    chunks in instance_id order.
+    """
+
+    __tablename__ = 'vmexpire_job'
+
+    OPERATIONS = ('add', 'extend', 'delete')
+
+    project_id = sa.Column(
+        sa.String(255), index=True,
+        nullable=False)
+    operation = sa.Column(
+        sa.String(16),
+        nullable=False)
+    all_tenants = sa.Column(
+        sa.Boolean,
+        nullable=False, default=False)
+    status = sa.Column(
+        sa.String(16), index=True,
+        nullable=False, default=JobStatus.PENDING)
+    instance_ids = sa.Column(
+        JsonBlob(),
+        nullable=False)
+    total = sa.Column(
+        sa.Integer,
+        nullable=False)
+    processed = sa.Column(
+        sa.Integer,
+        nullable=False, default=0)
+    failures = sa.Column(
+        JsonBlob(),
+        nullable=True)
+    attempts = sa.Column(
+        sa.Integer,
+        nullable=False, default=0)
+    error = sa.Column(
+        sa.Text,
+        nullable=True)
+    selector = sa.Column(
+        JsonBlob(),
+        nullable=True)
+    project_ids = sa.Column(
+        JsonBlob(),
+        nullable=True)
+    marker = sa.Column(
+        sa.String(255),
+        nullable=True)
+
+    def __init__(self, parsed_request=None):
+        """Creates job."""
+        super(VmExpireJob, self).__init__()
+
+    def _do_extra_dict_fields(self):
+        """Sub-class hook method: return dict of fields."""
+        return {
+            'id': self.id,
+            'project_id': self.project_id,
+            'operation': self.operation,
+            'all_tenants': self.all_tenants,
+            'status': self.status,
+            'total': self.total,
+            'processed': self.processed,
+            'failed': len(self.failures or []),
+            'failures': self.failures or [],
+            'attempts': self.attempts or 0,
+            'error': self.error,
+            'selector': self.selector
+        }
@@ -20,46 +20,93 @@ TODO: The top part of this file was 'borrowed' from Glance, but seems
 quite intense for sqlalchemy, and maybe could be simplified.
 """
 
+import collections
 import datetime
+import itertools
 import logging
+import os
 import re
+import sys
 import threading
 import time
 
 from oslo_db import exception as db_exc
-from oslo_db.sqlalchemy import session
 from oslo_utils import timeutils
 # from oslo_utils import uuidutils
-import requests
 import sqlalchemy
-# from sqlalchemy import func as sa_func
+from sqlalchemy.dialects import mysql
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects import sqlite
+from sqlalchemy import func as sa_func
 # from sqlalchemy import or_
 import sqlalchemy.orm as sa_orm
 
 from os_vm_expire.common import config
+from os_vm_expire.common import instrumentation
+from os_vm_expire.common import metrics
 from os_vm_expire.common import utils
 from os_vm_expire import i18n as u
-from os_vm_expire.model.migration import commands
 from os_vm_expire.model import models
 
 LOG = utils.getLogger(__name__)
 
 _ENGINE = None
+_ENGINE_PID = None
 _SESSION_FACTORY = None
 BASE = models.BASE
 sa_logger = None
 
 # Singleton repository references, instantiated via get_xxxx_repository()
 #   functions below.  Please keep this list in alphabetical order.
+_CACHE_GENERATION_REPOSITORY = None
 _VMEXPIRE_REPOSITORY = None
+_VMEXPIRE_DELETION_REPOSITORY = None
+_VMEXPIRE_JOB_REPOSITORY = None
+_VMTOMBSTONE_REPOSITORY = None
 
 CONF = config.CONF
 
+# Page of entities returned by paged queries. next_marker is None on the last
+# page. has_previous tells if some entities precede this page, previous_marker
+# then being the marker of the previous page, None for the first page.
+Page = collections.namedtuple('Page', ['entities', 'total', 'next_marker',
+                                       'has_previous', 'previous_marker'])
+
+# Result of an instance of a bulk operation. entity is the expiration, None
+# if the operation failed for this instance, error then being one of the
+# BULK_* reasons below and message a description of the failure.
+BulkResult = collections.namedtuple('BulkResult', ['instance_id', 'entity',
+                                                   'error', 'message'])
+BULK_NOT_FOUND = 'not_found'
+BULK_EXCLUDED = 'excluded'
+BULK_MAX_EXTEND = 'max_extend'
+
+# Changes of the expirations of a project, see VmExpireRepo.get_changes().
+# entities are the rows created or updated and deletions the
+# VmExpireDeletion entities logged up to cursor, the time of the last
+# reported change. truncated tells if more changes follow cursor.
+Changes = collections.namedtuple('Changes', ['entities', 'deletions',
+                                             'cursor', 'truncated'])
+
+# Cache generation scope of the excludes, see vmexpire_cache_scope()
+VMEXCLUDE_CACHE_SCOPE = 'vmexclude'
+
+# Insert statements of dialects supporting an upsert of cache generations
+_UPSERT_DIALECTS = {
+    'postgresql': postgresql.insert,
+    'sqlite': sqlite.insert
+}
+
 _FACADE = None
 _LOCK = threading.Lock()
 
 
 def _create_facade_lazily():
+    # NOTE: heavy modules used by some code paths only, such as the engine
+    # facade, the alembic commands or requests, are imported where they are
+    # used, to keep the startup of command line tools fast.
+    from oslo_db.sqlalchemy import session
+
     global _LOCK, _FACADE
 
     if _FACADE is None:
@@ -74,10 +121,11 @@ def hard_reset():
     """Performs a hard reset of database resources, used for unit testing."""
     # TODO(jvrbanac): Remove this as soon as we improve our unit testing
     # to not require this.
-    global _ENGINE, _SESSION_FACTORY
+    global _ENGINE, _ENGINE_PID, _SESSION_FACTORY
     if _ENGINE:
         _ENGINE.dispose()
     _ENGINE = None
+    _ENGINE_PID = None
     _SESSION_FACTORY = None
 
     # Make sure we reinitialize the engine and session factory
@@ -85,7 +133,7 @@ def hard_reset():
 
 
 def setup_database_engine_and_factory():
-    global sa_logger, _SESSION_FACTORY, _ENGINE
+    global sa_logger, _SESSION_FACTORY, _ENGINE, _ENGINE_PID
 
     LOG.info('Setting up database engine and session factory')
     if CONF.debug:
@@ -93,11 +141,107 @@ def setup_database_engine_and_factory():
         sa_logger.setLevel(logging.DEBUG)
 
     _ENGINE = _get_engine(_ENGINE)
+    _ENGINE_PID = os.getpid()
+
+    _SESSION_FACTORY = _create_session_factory(_ENGINE)
 
+
+def _create_session_factory(engine):
     # Utilize SQLAlchemy's scoped_session to ensure that we only have one
     # session instance per thread.
-    session_maker = sa_orm.sessionmaker(bind=_ENGINE)
-    _SESSION_FACTORY = sqlalchemy.orm.scoped_session(session_maker)
+    session_maker = sa_orm.sessionmaker(bind=engine)
+    sqlalchemy.event.listen(session_maker, 'before_flush',
+                            _bump_flushed_cache_generations)
+    sqlalchemy.event.listen(session_maker, 'before_flush',
+                            _log_flushed_deletions)
+    sqlalchemy.event.listen(session_maker, 'after_commit',
+                            _reset_cache_generations)
+    sqlalchemy.event.listen(session_maker, 'after_rollback',
+                            _reset_cache_generations)
+    return sqlalchemy.orm.scoped_session(session_maker)
+
+
+def vmexpire_cache_scope(project_id):
+    """Returns the cache generation scope of the expirations of a project."""
+    return 'vmexpire:' + project_id
+
+
+def _bump_flushed_cache_generations(session, flush_context, instances):
+    """Bumps the cache generations of the entities about to be flushed.
+
+    Flushes of any process (API, worker, cleaner) invalidate the cached
+    listings, in the transaction writing the entities. Generations are
+    bumped even when the process does not cache listings itself, as API
+    processes may.
+    """
+    scopes = set()
+    for entity in itertools.chain(session.new, session.dirty,
+                                  session.deleted):
+        if isinstance(entity, models.VmExpire):
+            if entity in session.dirty and not session.is_modified(entity):
+                continue
+            # Expiration may move from a project to another
+            history = sqlalchemy.inspect(entity).attrs.project_id.history
+            for project_id in itertools.chain(history.sum(),
+                                              [entity.project_id]):
+                if project_id:
+                    scopes.add(vmexpire_cache_scope(project_id))
+        elif isinstance(entity, models.VmExclude):
+            scopes.add(VMEXCLUDE_CACHE_SCOPE)
+    if scopes:
+        get_cache_generation_repository().bump_generations(scopes, session)
+
+
+def _log_flushed_deletions(session, flush_context, instances):
+    """Logs the expirations about to be removed from a project.
+
+    Expirations deleted, or moved to another project, are recorded in the
+    deletion log in the same transaction, for the changes feed.
+    """
+    for entity in itertools.chain(session.dirty, session.deleted):
+        if not isinstance(entity, models.VmExpire):
+            continue
+        old_project_ids = sqlalchemy.inspect(
+            entity).attrs.project_id.history.deleted
+        if entity in session.deleted:
+            project_id = (old_project_ids[0] if old_project_ids
+                          else entity.project_id)
+        elif old_project_ids and old_project_ids[0] != entity.project_id:
+            project_id = old_project_ids[0]
+        else:
+            continue
+        deletion = models.VmExpireDeletion()
+        deletion.vmexpire_id = entity.id
+        deletion.instance_id = entity.instance_id
+        deletion.project_id = project_id
+        session.add(deletion)
+
+
+def _reset_cache_generations(session):
+    session.info.pop('cache_generations', None)
+
+
+def dispose_engine_after_fork():
+    """Drop database resources inherited from a parent process.
+
+    Pooled connections opened by the parent must not be used by a forked
+    child, as both processes would share the same sockets. Connections are
+    released without being closed, the parent keeps using them.
+    Called automatically when a session is requested from a new process, it
+    can also be registered as a post-fork hook (uWSGI for example).
+    """
+    global _SESSION_FACTORY, _ENGINE_PID
+
+    if _ENGINE is None or _ENGINE_PID == os.getpid():
+        return
+    LOG.debug('Process forked, disposing inherited database connections')
+    try:
+        _ENGINE.dispose(close=False)
+    except TypeError:
+        # SQLAlchemy < 1.4.33 cannot release connections without closing
+        _ENGINE.dispose()
+    _ENGINE_PID = os.getpid()
+    _SESSION_FACTORY = _create_session_factory(_ENGINE)
 
 
 def start():
@@ -144,8 +288,55 @@ def clear():
         _SESSION_FACTORY.remove()
 
 
+def clean_paging_values(offset_arg=0, limit_arg=None):
+    """Cleans and safely limits raw paging offset/limit values."""
+    offset_arg = offset_arg or 0
+    limit_arg = limit_arg or CONF.default_limit_paging
+
+    try:
+        offset = int(offset_arg)
+        if offset < 0:
+            offset = 0
+        if offset > sys.maxsize:
+            offset = 0
+    except ValueError:
+        offset = 0
+
+    try:
+        limit = int(limit_arg)
+        if limit < 1:
+            limit = 1
+        if limit > CONF.max_limit_paging:
+            limit = CONF.max_limit_paging
+    except ValueError:
+        limit = CONF.default_limit_paging
+
+    LOG.debug("Clean paging values limit=%(limit)s, offset=%(offset)s",
+              {'limit': limit, 'offset': offset})
+
+    return offset, limit
+
+
+def get_engine():
+    """Returns the database engine, None if not set up yet."""
+    return _ENGINE
+
+
+def new_session():
+    """Returns a new session, not managed by the per thread registry.
+
+    Used when a session must outlive the request cycle, such as for
+    streamed responses. Caller is responsible for closing the session.
+    """
+    if _ENGINE_PID != os.getpid():
+        dispose_engine_after_fork()
+    return _SESSION_FACTORY.session_factory()
+
+
 def get_session():
     """Helper method to grab session."""
+    if _ENGINE_PID != os.getpid():
+        dispose_engine_after_fork()
     return _SESSION_FACTORY()
 
 
@@ -184,13 +375,21 @@ def _create_engine():
     # engine = session.create_engine(connection, **engine_args)
     engine = _create_facade_lazily().get_engine()
 
-    # Wrap the engine's connect method with a retry decorator.
-    engine.connect = wrap_db_error(engine.connect)
+    # Wrap the engine's connect method with a retry decorator, sessions
+    # check out their connection through it. The engine is kept by the
+    # facade, it is only wrapped once.
+    if not getattr(engine, 'osvmexpire_connect_wrapped', False):
+        engine.connect = metrics.timed_checkout(
+            wrap_db_error(engine.connect))
+        engine.osvmexpire_connect_wrapped = True
+    instrumentation.instrument_engine(engine)
 
     return engine
 
 
 def _auto_generate_tables(engine, tables):
+    from os_vm_expire.model.migration import commands
+
     if tables and 'alembic_version' in tables:
         # Upgrade the database to the latest version.
         LOG.info('Updating schema to latest version')
@@ -248,6 +447,8 @@ def delete_all_project_resources(project_id):
 
 
 def get_identity_token():
+    import requests
+
     conf_worker = config.CONF.worker
     ks_uri = conf_worker.auth_uri
 
@@ -276,7 +477,8 @@ def get_identity_token():
                 }
         }
     }
-    r = requests.post(ks_uri + '/auth/tokens', json=auth)
+    with instrumentation.timed(instrumentation.HTTP):
+        r = requests.post(ks_uri + '/auth/tokens', json=auth)
     if 'X-Subject-Token' not in r.headers:
         LOG.error('Could not get authorization')
         return None
@@ -284,8 +486,15 @@ def get_identity_token():
     return token
 
 
-def get_project_domain(project_id):
-    token = get_identity_token()
+def get_project_domain(project_id, token=None):
+    """Returns the domain id of a project, None if not found.
+
+    :param project_id: id of the project
+    :param token: identity token, a new one is requested if not set
+    """
+    import requests
+
+    token = token or get_identity_token()
     if not token:
         return None
     conf_worker = config.CONF.worker
@@ -294,7 +503,9 @@ def get_project_domain(project_id):
         'X-Auth-Token': token,
         'Content-Type': 'application/json'
     }
-    r = requests.get(ks_uri + '/projects/' + str(project_id), headers=headers)
+    with instrumentation.timed(instrumentation.HTTP):
+        r = requests.get(ks_uri + '/projects/' + str(project_id),
+                         headers=headers)
     if not r.status_code == 200:
         LOG.error('Failed to get domain_id for project ' + str(project_id))
         return None
@@ -303,8 +514,41 @@ def get_project_domain(project_id):
     return domain_id
 
 
-def get_instance(instance_id):
-    token = get_identity_token()
+def get_domain_project_ids(domain_id, token=None):
+    """Returns the ids of the projects of a domain, None on failure.
+
+    :param domain_id: id of the domain
+    :param token: identity token, a new one is requested if not set
+    """
+    import requests
+
+    token = token or get_identity_token()
+    if not token:
+        return None
+    conf_worker = config.CONF.worker
+    ks_uri = conf_worker.auth_uri
+    headers = {
+        'X-Auth-Token': token,
+        'Content-Type': 'application/json'
+    }
+    with instrumentation.timed(instrumentation.HTTP):
+        r = requests.get(ks_uri + '/projects', headers=headers,
+                         params={'domain_id': domain_id})
+    if not r.status_code == 200:
+        LOG.error('Failed to get projects of domain ' + str(domain_id))
+        return None
+    return [project['id'] for project in r.json()['projects']]
+
+
+def get_instance(instance_id, token=None):
+    """Returns name, project and user of a Nova instance, None if not found.
+
+    :param instance_id: id of the instance
+    :param token: identity token, a new one is requested if not set
+    """
+    import requests
+
+    token = token or get_identity_token()
     if not token:
         return None
     conf_worker = config.CONF.worker
@@ -313,7 +557,9 @@ def get_instance(instance_id):
         'X-Auth-Token': token,
         'Content-Type': 'application/json'
     }
-    r = requests.get(nv_uri + '/servers/' + str(instance_id), headers=headers)
+    with instrumentation.timed(instrumentation.HTTP):
+        r = requests.get(nv_uri + '/servers/' + str(instance_id),
+                         headers=headers)
     if not r.status_code == 200:
         LOG.error('Failed to get information for instance ' + str(instance_id))
         return None
@@ -382,7 +628,8 @@ class BaseRepo(object):
         except sa_orm.exc.NoResultFound:
             LOG.debug("Not found for %s", entity_id)
             entity = None
-            _raise_entity_not_found(self._do_entity_name(), entity_id)
+            if not suppress_exception:
+                _raise_entity_not_found(self._do_entity_name(), entity_id)
 
         return entity
 
@@ -399,7 +646,7 @@ class BaseRepo(object):
                      instance_uuid +
                      ", deleting first"
                      )
-            self.delete_entity_by_id(entity_id=instance.id)
+            self.delete_entity(instance)
 
         instance_data = get_instance(instance_uuid)
         if not instance_data:
@@ -427,18 +674,15 @@ class BaseRepo(object):
             LOG.exception('Failed to get domain for project')
 
         exclude_repo = get_vmexclude_repository()
-        if project_domain:
-            exclude_id = exclude_repo.get_exclude_by_id(project_domain)
-            if exclude_id:
-                LOG.debug('domain %s is excluded, skipping' % (project_domain))
-                _raise_entity_invalid(instance_uuid, "domain is excluded")
-
-        exclude_id = exclude_repo.get_exclude_by_id(entity.project_id)
-        if exclude_id:
+        excluded = exclude_repo.get_excluded_ids(
+            [project_domain, entity.project_id, entity.user_id])
+        if project_domain and project_domain in excluded:
+            LOG.debug('domain %s is excluded, skipping' % (project_domain))
+            _raise_entity_invalid(instance_uuid, "domain is excluded")
+        if entity.project_id in excluded:
             LOG.debug('project %s is excluded, skipping' % (entity.project_id))
             _raise_entity_invalid(instance_uuid, "project is excluded")
-        exclude_id = exclude_repo.get_exclude_by_id(entity.user_id)
-        if exclude_id:
+        if entity.user_id in excluded:
             LOG.debug('user %s is excluded, skipping' % (entity.user_id))
             _raise_entity_invalid(instance_uuid, "user is excluded")
 
@@ -532,7 +776,11 @@ class BaseRepo(object):
         entity = self.get(entity_id=entity_id,
                           session=session)
 
-        entity.delete(session=session)
+        self.delete_entity(entity, session=session)
+
+    def delete_entity(self, entity, session=None):
+        """Remove an entity already loaded, without fetching it again."""
+        entity.delete(session=self.get_session(session))
 
     def _do_entity_name(self):
         """Sub-class hook: return entity name, such as for debugging."""
@@ -558,6 +806,19 @@ class BaseRepo(object):
         """
         return values
 
+    def _get_query_version(self, query, model):
+        """Returns the version of the entities matching a query.
+
+        The version is a (count, max updated_at) tuple, computed by a
+        single aggregate query without loading entities. It changes when
+        an entity is created, updated or deleted.
+        """
+        count, updated_at = query.with_entities(
+            sa_func.count(model.id),
+            sa_func.max(model.updated_at)
+        ).one()
+        return count, updated_at
+
     def _update_values(self, entity_ref, values):
         for k in values:
             if getattr(entity_ref, k) != values[k]:
@@ -665,6 +926,14 @@ class BaseRepo(object):
 class VmExpireRepo(BaseRepo):
     """Repository for the expire entity."""
 
+    # Keys allowed to sort listings, backed by indexes
+    SORT_KEYS = ('id', 'expire', 'created_at')
+
+    # Columns selected by listings returning rows instead of entities
+    LIST_COLUMNS = ('id', 'created_at', 'updated_at', 'deleted_at',
+                    'deleted', 'instance_id', 'instance_name', 'project_id',
+                    'user_id', 'expire', 'notified', 'notified_last')
+
     def _do_entity_name(self):
         """Sub-class hook: return entity name, such as for debugging."""
         return "VMExpire"
@@ -688,6 +957,529 @@ class VmExpireRepo(BaseRepo):
         return session.query(models.VmExpire).filter_by(
             project_id=project_id)
 
+    def _build_list_query(self, project_id, filters, session):
+        """Builds query listing entities of a project, or all if None.
+
+        :param project_id: id of osvmexpire project entity, None for all
+        :param filters: dict of filters, see get_page()
+        :param session: existing db session reference.
+        """
+        query = session.query(models.VmExpire)
+        if project_id is not None:
+            query = query.filter(models.VmExpire.project_id == project_id)
+        filters = filters or {}
+        if filters.get('expire_before') is not None:
+            query = query.filter(
+                models.VmExpire.expire < filters['expire_before'])
+        if filters.get('expire_after') is not None:
+            query = query.filter(
+                models.VmExpire.expire > filters['expire_after'])
+        if filters.get('user_id') is not None:
+            query = query.filter(
+                models.VmExpire.user_id == filters['user_id'])
+        if filters.get('notified') is not None:
+            query = query.filter(
+                models.VmExpire.notified == filters['notified'])
+        if filters.get('notified_last') is not None:
+            query = query.filter(
+                models.VmExpire.notified_last == filters['notified_last'])
+        if filters.get('instance_name'):
+            query = query.filter(models.VmExpire.instance_name.startswith(
+                filters['instance_name'], autoescape=True))
+        return query
+
+    def get_list_version(self, project_id=None, filters=None, session=None):
+        """Returns the version of the entities of a listing.
+
+        :param project_id: id of osvmexpire project entity, None for all
+        :param filters: dict of filters, see get_page()
+        :param session: existing db session reference. If None, gets session.
+        :returns: (count, max updated_at) tuple
+        """
+        session = self.get_session(session)
+        query = self._build_list_query(project_id, filters, session)
+        return self._get_query_version(query, models.VmExpire)
+
+    def _build_keyset_filter(self, sort_column, marker, forward,
+                             inclusive=False):
+        """Builds the filter selecting entities after/before a marker.
+
+        Entities are ordered by (sort column, id), marker being the
+        `models.VmExpire` entity the page starts from.
+        """
+        id_column = models.VmExpire.id
+        if forward:
+            id_filter = id_column >= marker.id if inclusive \
+                else id_column > marker.id
+        else:
+            id_filter = id_column <= marker.id if inclusive \
+                else id_column < marker.id
+        if sort_column is id_column:
+            return id_filter
+        value = getattr(marker, sort_column.key)
+        return sqlalchemy.or_(
+            sort_column > value if forward else sort_column < value,
+            sqlalchemy.and_(sort_column == value, id_filter)
+        )
+
+    def _prepare_page(self, project_id, marker, offset, limit, filters,
+                      sort_key, sort_dir, rows, session):
+        """Builds the query of a page, see get_page().
+
+        :returns: tuple (page query, total, has_previous, previous_marker),
+                  the page query returning up to limit + 1 entities
+        """
+        if sort_key not in self.SORT_KEYS:
+            raise Exception(u._('Invalid sort key {key}').format(key=sort_key))
+        query = self._build_list_query(project_id, filters, session)
+
+        total = query.with_entities(
+            sa_func.count(models.VmExpire.id)).scalar()
+
+        sort_column = getattr(models.VmExpire, sort_key)
+        forward = sort_dir != 'desc'
+        marker_entity = None
+        if marker:
+            marker_entity = session.get(models.VmExpire, marker)
+            if marker_entity is None:
+                _raise_entity_not_found(self._do_entity_name(), marker)
+
+        def order(query, forward):
+            columns = [sort_column, models.VmExpire.id]
+            if sort_column is models.VmExpire.id:
+                columns = [sort_column]
+            return query.order_by(*[
+                column.asc() if forward else column.desc()
+                for column in columns])
+
+        page_query = query
+        if rows:
+            page_query = page_query.with_entities(*[
+                getattr(models.VmExpire, column)
+                for column in self.LIST_COLUMNS])
+        page_query = order(page_query, forward)
+        if marker_entity:
+            page_query = page_query.filter(
+                self._build_keyset_filter(sort_column, marker_entity,
+                                          forward))
+        elif offset:
+            page_query = page_query.offset(offset)
+        # Fetch one more entity to know if there is a next page
+        page_query = page_query.limit(limit + 1)
+
+        has_previous = False
+        previous_marker = None
+        if marker_entity:
+            previous_query = order(query.with_entities(models.VmExpire.id),
+                                   not forward)
+            previous_ids = [row.id for row in previous_query.filter(
+                self._build_keyset_filter(sort_column, marker_entity,
+                                          not forward, inclusive=True)
+            ).limit(limit + 1)]
+            has_previous = len(previous_ids) > 0
+            if len(previous_ids) > limit:
+                previous_marker = previous_ids[-1]
+        elif offset:
+            has_previous = True
+
+        return page_query, total, has_previous, previous_marker
+
+    def get_page(self, project_id=None, marker=None, offset=0, limit=None,
+                 filters=None, sort_key='id', sort_dir='asc', rows=False,
+                 session=None):
+        """Gets a page of entities, ordered by sort key then id.
+
+        When a marker is given, entities following the marker are returned
+        using a keyset query (WHERE (sort_key, id) > marker), so the cost of
+        a page does not depend on its position. Otherwise offset is used.
+
+        :param project_id: id of osvmexpire project entity, None for all
+        :param marker: id of the last entity of the previous page
+        :param offset: number of entities to skip, ignored with a marker
+        :param limit: max number of entities to return
+        :param filters: dict of filters, supported keys are expire_before,
+                        expire_after (timestamps), user_id, notified,
+                        notified_last and instance_name (name prefix)
+        :param sort_key: one of SORT_KEYS
+        :param sort_dir: asc or desc
+        :param rows: if True, page entities are rows of LIST_COLUMNS values
+                     instead of `models.VmExpire` objects, avoiding ORM
+                     object loading
+        :param session: existing db session reference. If None, gets session.
+        :returns: a `Page`
+        """
+        session = self.get_session(session)
+        offset, limit = clean_paging_values(offset, limit)
+        page_query, total, has_previous, previous_marker = \
+            self._prepare_page(project_id, marker, offset, limit, filters,
+                               sort_key, sort_dir, rows, session)
+        entities = page_query.all()
+        next_marker = None
+        if len(entities) > limit:
+            entities = entities[:limit]
+            next_marker = entities[-1].id
+
+        return Page(entities, total, next_marker, has_previous,
+                    previous_marker)
+
+    def stream_page(self, project_id=None, marker=None, offset=0, limit=None,
+                    filters=None, sort_key='id', sort_dir='asc', rows=False,
+                    batch_size=100, session=None):
+        """Gets a page of entities, fetched by batches while iterated.
+
+        Same as get_page(), except that entities of the returned `Page` is
+        an iterator reading rows from a server side cursor, batch_size rows
+        at a time, and next_marker is not set. The iterator yields up to
+        limit + 1 entities, an extra entity telling that a next page exists.
+        The session must stay open until the iteration is over.
+        """
+        session = self.get_session(session)
+        offset, limit = clean_paging_values(offset, limit)
+        page_query, total, has_previous, previous_marker = \
+            self._prepare_page(project_id, marker, offset, limit, filters,
+                               sort_key, sort_dir, rows, session)
+        entities = iter(page_query.yield_per(batch_size))
+        return Page(entities, total, None, has_previous, previous_marker)
+
+    def get_changes(self, project_id, since, until, limit, session=None):
+        """Returns the changes of the expirations of a project.
+
+        Changes are the rows created or updated, read on the
+        (project_id, updated_at) index, and the logged deletions, in the
+        (since, cursor] time range. At most about limit changes of each kind
+        are returned: the range is cut at the limit-th change, all the
+        changes at the cut time being returned so that the next range starts
+        after it.
+
+        :param project_id: project of the expirations
+        :param since: time of the last change already known, None to list
+                      all the expirations, without deletions
+        :param until: changes after this time are not returned
+        :param limit: max number of changes of each kind
+        :param session: existing db session reference.
+        :return: `Changes`, entities being rows of LIST_COLUMNS
+        """
+        session = self.get_session(session)
+        updated_at = models.VmExpire.updated_at
+        query = session.query(*[
+            getattr(models.VmExpire, column)
+            for column in self.LIST_COLUMNS
+        ]).filter(models.VmExpire.project_id == project_id,
+                  updated_at <= until)
+        deleted_at = models.VmExpireDeletion.created_at
+        deletions = session.query(models.VmExpireDeletion).filter(
+            models.VmExpireDeletion.project_id == project_id,
+            deleted_at <= until)
+        if since is not None:
+            query = query.filter(updated_at > since)
+            deletions = deletions.filter(deleted_at > since)
+
+        cursor = until
+        queries = [(query, updated_at)]
+        if since is not None:
+            queries.append((deletions, deleted_at))
+        for changes, column in queries:
+            cut = changes.with_entities(column).order_by(column).offset(
+                limit - 1).limit(1).scalar()
+            if cut is not None and cut < cursor:
+                cursor = cut
+        entities = query.filter(updated_at <= cursor).order_by(
+            updated_at, models.VmExpire.id).all()
+        if since is None:
+            deletions = []
+        else:
+            deletions = deletions.filter(deleted_at <= cursor).order_by(
+                deleted_at).all()
+        return Changes(entities, deletions, cursor, cursor < until)
+
+    def get_by_instances(self, instance_ids, project_id=None, session=None):
+        """Returns the expirations of instances, as rows of LIST_COLUMNS.
+
+        Expirations are read by a single IN query on the instance_id index.
+
+        :param instance_ids: ids of the instances
+        :param project_id: if set, only expirations of this project are
+                           returned
+        :param session: existing db session reference.
+        :return: list of rows, instances without expiration being skipped
+        """
+        if not instance_ids:
+            return []
+        session = self.get_session(session)
+        query = session.query(*[
+            getattr(models.VmExpire, column)
+            for column in self.LIST_COLUMNS
+        ]).filter(models.VmExpire.instance_id.in_(instance_ids))
+        if project_id:
+            query = query.filter(models.VmExpire.project_id == project_id)
+        return query.all()
+
+    def get_stats(self, start, days, project_id=None, session=None):
+        """Returns expiration counts grouped by project and day.
+
+        Days are computed in SQL from the time left before expiration, so
+        that rows are counted by the database, using the (project_id,
+        expire) index when project_id is set. The remainder is subtracted
+        before dividing, the division being exact whatever the dialect
+        (integer, decimal or float division).
+
+        :param start: timestamp of the start of the first day
+        :param days: number of days counted from start
+        :param project_id: if set, only expirations of this project are
+                           counted
+        :param session: existing db session reference.
+        :return: list of (project_id, day, count, notified, notified_last)
+                 rows ordered by project and day, day being the index of the
+                 day from start and notified and notified_last the number of
+                 expirations already notified.
+        """
+        session = self.get_session(session)
+        expire = models.VmExpire.expire
+        elapsed = expire - start
+        day = sqlalchemy.cast(
+            (elapsed - elapsed % (24 * 3600)) / (24 * 3600),
+            sqlalchemy.Integer).label('day')
+        query = session.query(
+            models.VmExpire.project_id,
+            day,
+            sa_func.count().label('count'),
+            sa_func.sum(sqlalchemy.case(
+                (models.VmExpire.notified.is_(True), 1),
+                else_=0)).label('notified'),
+            sa_func.sum(sqlalchemy.case(
+                (models.VmExpire.notified_last.is_(True), 1),
+                else_=0)).label('notified_last')
+        ).filter(expire >= start, expire < start + days * 24 * 3600)
+        if project_id:
+            query = query.filter(models.VmExpire.project_id == project_id)
+        return query.group_by(models.VmExpire.project_id, day).order_by(
+            models.VmExpire.project_id, day).all()
+
+    def get_project_instance_ids(self, project_ids, marker=None, limit=None,
+                                 session=None):
+        """Returns the instance ids of the expirations of projects.
+
+        Instance ids are sorted, so that expirations can be read by chunks,
+        each chunk starting after the last instance id of the previous one.
+
+        :param project_ids: ids of the projects
+        :param marker: if set, only instance ids after it are returned
+        :param limit: max number of instance ids
+        :param session: existing db session reference.
+        :return: list of instance ids
+        """
+        if not project_ids:
+            return []
+        session = self.get_session(session)
+        query = session.query(models.VmExpire.instance_id).filter(
+            models.VmExpire.project_id.in_(project_ids))
+        if marker:
+            query = query.filter(models.VmExpire.instance_id > marker)
+        query = query.order_by(models.VmExpire.instance_id)
+        if limit:
+            query = query.limit(limit)
+        return [instance_id for instance_id, in query]
+
+    def count_project_instances(self, project_ids, marker=None,
+                                session=None):
+        """Returns the number of expirations of projects.
+
+        :param project_ids: ids of the projects
+        :param marker: if set, only instances after it are counted
+        :param session: existing db session reference.
+        """
+        if not project_ids:
+            return 0
+        session = self.get_session(session)
+        query = session.query(sa_func.count(models.VmExpire.id)).filter(
+            models.VmExpire.project_id.in_(project_ids))
+        if marker:
+            query = query.filter(models.VmExpire.instance_id > marker)
+        return query.scalar()
+
+    def _get_instances_entities(self, instance_ids, project_id, session):
+        query = session.query(models.VmExpire).filter(
+            models.VmExpire.instance_id.in_(instance_ids))
+        if project_id:
+            query = query.filter(models.VmExpire.project_id == project_id)
+        return dict((entity.instance_id, entity) for entity in query)
+
+    def add_vms(self, instance_ids, session=None):
+        """Adds the expirations of instances, see add_vm().
+
+        Nova instances are looked up with a single identity token, then
+        domains of their distinct projects, and exclusions are checked by a
+        single query. Existing expirations of the instances are replaced.
+        Entities are flushed once, the caller commits.
+
+        :param instance_ids: ids of the instances, without duplicates
+        :param session: existing db session reference.
+        :return: list of BulkResult, in instance_ids order
+        """
+        session = self.get_session(session)
+        token = get_identity_token()
+        instances = dict((instance_id, get_instance(instance_id, token))
+                         for instance_id in instance_ids)
+        domains = {}
+        for data in instances.values():
+            if data and data['tenant_id'] not in domains:
+                try:
+                    domains[data['tenant_id']] = get_project_domain(
+                        data['tenant_id'], token)
+                except Exception:
+                    LOG.exception('Failed to get domain for project')
+                    domains[data['tenant_id']] = None
+        excluded = get_vmexclude_repository().get_excluded_ids(
+            set(domains) | set(d for d in domains.values() if d) |
+            set(data['user_id'] for data in instances.values() if data),
+            session=session)
+        existing = self._get_instances_entities(instance_ids, None, session)
+
+        expire = int(time.mktime(datetime.datetime.now().timetuple()) +
+                     (CONF.max_vm_duration * 3600 * 24))
+        results = []
+        for instance_id in instance_ids:
+            data = instances[instance_id]
+            if not data:
+                results.append(BulkResult(
+                    instance_id, None, BULK_NOT_FOUND,
+                    u._('Openstack instance not found')))
+                continue
+            if excluded.intersection((domains[data['tenant_id']],
+                                      data['tenant_id'], data['user_id'])):
+                results.append(BulkResult(
+                    instance_id, None, BULK_EXCLUDED,
+                    u._('domain, project or user is excluded')))
+                continue
+            if instance_id in existing:
+                LOG.warn("InstanceAlreadyExists:" + instance_id +
+                         ", deleting first")
+                session.delete(existing[instance_id])
+            entity = models.VmExpire()
+            entity.instance_id = instance_id
+            entity.instance_name = data['display_name']
+            entity.project_id = data['tenant_id']
+            entity.user_id = data['user_id']
+            entity.expire = expire
+            entity.notified = False
+            entity.notified_last = False
+            self._do_validate(entity.to_dict())
+            results.append(BulkResult(instance_id, entity, None, None))
+        # Replaced expirations are removed before their new version is added
+        session.flush()
+        session.add_all([r.entity for r in results if r.entity])
+        session.flush()
+        return results
+
+    def extend_vms(self, instance_ids, project_id=None, session=None):
+        """Extends the expirations of instances, see extend_vm().
+
+        Expirations are read by a single query and flushed once, the caller
+        commits. Expirations reaching max_vm_total_duration are left
+        unchanged.
+
+        :param instance_ids: ids of the instances, without duplicates
+        :param project_id: if set, expirations of other projects are not
+                           found
+        :param session: existing db session reference.
+        :return: list of BulkResult, in instance_ids order
+        """
+        session = self.get_session(session)
+        entities = self._get_instances_entities(instance_ids, project_id,
+                                                session)
+        expire = int(time.mktime(datetime.datetime.now().timetuple()) +
+                     CONF.max_vm_extend * 3600 * 24)
+        max_duration = datetime.timedelta(days=CONF.max_vm_total_duration)
+        results = []
+        for instance_id in instance_ids:
+            entity = entities.get(instance_id)
+            if not entity:
+                results.append(BulkResult(
+                    instance_id, None, BULK_NOT_FOUND,
+                    u._('No expiration found for instance')))
+                continue
+            if (entity.created_at + max_duration <
+                    datetime.datetime.fromtimestamp(expire)):
+                results.append(BulkResult(
+                    instance_id, None, BULK_MAX_EXTEND,
+                    u._('VM reached its maximum life, cannot extend it')))
+                continue
+            entity.expire = expire
+            entity.notified = False
+            entity.notified_last = False
+            results.append(BulkResult(instance_id, entity, None, None))
+        session.flush()
+        return results
+
+    def delete_vms(self, instance_ids, project_id=None, session=None):
+        """Deletes the expirations of instances.
+
+        Expirations are read by a single query and deleted by a single
+        flush, the caller commits.
+
+        :param instance_ids: ids of the instances, without duplicates
+        :param project_id: if set, expirations of other projects are not
+                           found
+        :param session: existing db session reference.
+        :return: list of BulkResult, in instance_ids order
+        """
+        session = self.get_session(session)
+        entities = self._get_instances_entities(instance_ids, project_id,
+                                                session)
+        results = []
+        for instance_id in instance_ids:
+            entity = entities.get(instance_id)
+            if not entity:
+                results.append(BulkResult(
+                    instance_id, None, BULK_NOT_FOUND,
+                    u._('No expiration found for instance')))
+                continue
+            session.delete(entity)
+            results.append(BulkResult(instance_id, entity, None, None))
+        session.flush()
+        return results
+
+    def update_instance_info(self, instance_id, instance_name=None,
+                             project_id=None, user_id=None, session=None):
+        """Update name and owner of an instance expiration.
+
+        Only expirations for which one of the given values differs are
+        loaded, so that no write occurs when nothing changed. None values
+        are left untouched. Entities are updated through the session, the
+        flush invalidating the cached listings of the old and new projects
+        and logging the expirations moved to another project.
+
+        :param instance_id: id of the instance
+        :param instance_name: new name of the instance
+        :param project_id: new project of the instance
+        :param user_id: new owner of the instance
+        :param session: existing db session reference.
+        :return: number of updated rows
+        """
+        values = {}
+        changes = []
+        for column, value in (
+                (models.VmExpire.instance_name, instance_name),
+                (models.VmExpire.project_id, project_id),
+                (models.VmExpire.user_id, user_id)):
+            if value is None:
+                continue
+            values[column.key] = value
+            changes.append(sqlalchemy.or_(column.is_(None), column != value))
+        if not values:
+            return 0
+        session = self.get_session(session)
+        entities = session.query(models.VmExpire).filter(
+            models.VmExpire.instance_id == instance_id,
+            sqlalchemy.or_(*changes)
+        ).all()
+        for entity in entities:
+            for key, value in values.items():
+                setattr(entity, key, value)
+        if entities:
+            session.flush()
+        return len(entities)
+
     def delete_all_entities(self, suppress_exception=False, session=None):
         """Deletes all entities.
 
@@ -696,7 +1488,12 @@ class VmExpireRepo(BaseRepo):
         """
         session = self.get_session(session)
         try:
+            project_ids = [project_id for project_id, in session.query(
+                models.VmExpire.project_id).distinct()]
             session.query(models.VmExpire).delete()
+            get_cache_generation_repository().bump_generations(
+                [vmexpire_cache_scope(project_id)
+                 for project_id in project_ids], session)
         except sqlalchemy.exc.SQLAlchemyError:
             LOG.exception('Problem deleting entities')
             if not suppress_exception:
@@ -730,6 +1527,21 @@ class VmExcludeRepo(BaseRepo):
         return session.query(models.VmExclude).filter_by(
             exclude_id=exclude_id).one_or_none()
 
+    def get_excluded_ids(self, exclude_ids, session=None):
+        """Returns the ids, among exclude_ids, which are excluded.
+
+        :param exclude_ids: domain/project/user ids
+        :param session: existing db session reference.
+        :return: set of excluded ids
+        """
+        exclude_ids = [i for i in exclude_ids if i]
+        if not exclude_ids:
+            return set()
+        session = self.get_session(session)
+        return set(exclude_id for (exclude_id,) in session.query(
+            models.VmExclude.exclude_id).filter(
+                models.VmExclude.exclude_id.in_(exclude_ids)))
+
     def get_type_entities(self, exclude_type=None, session=None):
         """Builds query for retrieving excludes related to given type.
 
@@ -743,6 +1555,19 @@ class VmExcludeRepo(BaseRepo):
             return session.query(models.VmExclude).filter_by(
                 exclude_type=exclude_type).all()
 
+    def get_list_version(self, exclude_type=None, session=None):
+        """Returns the version of the excludes of a type, or of all excludes.
+
+        :param exclude_type: id of osvmexclude type entity
+        :param session: existing db session reference.
+        :returns: (count, max updated_at) tuple
+        """
+        session = self.get_session(session)
+        query = session.query(models.VmExclude)
+        if exclude_type is not None:
+            query = query.filter_by(exclude_type=exclude_type)
+        return self._get_query_version(query, models.VmExclude)
+
     def get_exclude_type(self, exclude_name):
         """Get numeric value matching the exclude type (domain,project,user).
 
@@ -798,24 +1623,437 @@ class VmExcludeRepo(BaseRepo):
         session = self.get_session(session)
         try:
             session.query(models.VmExclude).delete()
+            get_cache_generation_repository().bump_generations(
+                [VMEXCLUDE_CACHE_SCOPE], session)
+        except sqlalchemy.exc.SQLAlchemyError:
+            LOG.exception('Problem deleting entities')
+            if not suppress_exception:
+                raise Exception(u._('Error deleting entities '))
+
+
+class VmTombstoneRepo(BaseRepo):
+    """Repository for the tombstone entity."""
+
+    def _do_entity_name(self):
+        """Sub-class hook: return entity name, such as for debugging."""
+        return "VMTombstone"
+
+    def _do_build_get_query(self, entity_id, session):
+        """Sub-class hook: build a retrieve query."""
+        query = session.query(models.VmTombstone)
+        query = query.filter_by(id=entity_id)
+        return query
+
+    def _do_validate(self, values):
+        """Sub-class hook: validate values."""
+        pass
+
+    def _get_threshold(self, ttl):
+        return timeutils.utcnow() - datetime.timedelta(seconds=ttl)
+
+    def add_tombstone(self, instance_id, session=None):
+        """Record a tombstone for a deleted instance, if not already present.
+
+        :param instance_id: id of the deleted instance
+        :param session: existing db session reference.
+        :return: `os_vm_expire.model.models.VmTombstone`
+        """
+        session = self.get_session(session)
+        entity = session.query(models.VmTombstone).filter_by(
+            instance_id=instance_id).one_or_none()
+        if entity:
+            entity.created_at = timeutils.utcnow()
+            entity.save(session=session)
+            return entity
+        entity = models.VmTombstone()
+        entity.instance_id = instance_id
+        return self.create_from(entity, session)
+
+    def consume_tombstone(self, instance_id, ttl, session=None):
+        """Remove the tombstone of an instance, if any.
+
+        :param instance_id: id of the instance
+        :param ttl: tombstones older than ttl seconds are ignored
+        :param session: existing db session reference.
+        :return: True if a live tombstone was found for this instance
+        """
+        session = self.get_session(session)
+        count = session.query(models.VmTombstone).filter(
+            models.VmTombstone.instance_id == instance_id,
+            models.VmTombstone.created_at >= self._get_threshold(ttl)
+        ).delete(synchronize_session=False)
+        return count > 0
+
+    def purge_tombstones(self, ttl, session=None):
+        """Delete tombstones older than ttl seconds.
+
+        :param ttl: max age of tombstones in seconds
+        :param session: existing db session reference.
+        :return: number of deleted tombstones
+        """
+        session = self.get_session(session)
+        return session.query(models.VmTombstone).filter(
+            models.VmTombstone.created_at < self._get_threshold(ttl)
+        ).delete(synchronize_session=False)
+
+    def delete_all_entities(self, suppress_exception=False, session=None):
+        """Deletes all entities.
+
+        :param suppress_exception: Pass True if want to suppress exception
+        :param session: existing db session reference. If None, gets session.
+        """
+        session = self.get_session(session)
+        try:
+            session.query(models.VmTombstone).delete()
+        except sqlalchemy.exc.SQLAlchemyError:
+            LOG.exception('Problem deleting entities')
+            if not suppress_exception:
+                raise Exception(u._('Error deleting entities '))
+
+
+class VmExpireDeletionRepo(BaseRepo):
+    """Repository for the expiration deletion log entity."""
+
+    def _do_entity_name(self):
+        """Sub-class hook: return entity name, such as for debugging."""
+        return "VmExpireDeletion"
+
+    def _do_build_get_query(self, entity_id, session):
+        """Sub-class hook: build a retrieve query."""
+        query = session.query(models.VmExpireDeletion)
+        query = query.filter_by(id=entity_id)
+        return query
+
+    def _do_validate(self, values):
+        """Sub-class hook: validate values."""
+        pass
+
+    def purge_deletions(self, ttl, session=None):
+        """Delete deletions logged more than ttl seconds ago.
+
+        :param ttl: max age of logged deletions in seconds
+        :param session: existing db session reference.
+        :return: number of deleted log entries
+        """
+        session = self.get_session(session)
+        threshold = timeutils.utcnow() - datetime.timedelta(seconds=ttl)
+        return session.query(models.VmExpireDeletion).filter(
+            models.VmExpireDeletion.created_at < threshold
+        ).delete(synchronize_session=False)
+
+    def delete_all_entities(self, suppress_exception=False, session=None):
+        """Deletes all entities.
+
+        :param suppress_exception: Pass True if want to suppress exception
+        :param session: existing db session reference. If None, gets session.
+        """
+        session = self.get_session(session)
+        try:
+            session.query(models.VmExpireDeletion).delete()
+        except sqlalchemy.exc.SQLAlchemyError:
+            LOG.exception('Problem deleting entities')
+            if not suppress_exception:
+                raise Exception(u._('Error deleting entities '))
+
+
+class CacheGenerationRepo(BaseRepo):
+    """Repository for the cache generation entity."""
+
+    def _do_entity_name(self):
+        """Sub-class hook: return entity name, such as for debugging."""
+        return "CacheGeneration"
+
+    def _do_build_get_query(self, entity_id, session):
+        """Sub-class hook: build a retrieve query."""
+        query = session.query(models.CacheGeneration)
+        query = query.filter_by(id=entity_id)
+        return query
+
+    def _do_validate(self, values):
+        """Sub-class hook: validate values."""
+        pass
+
+    def get_generation(self, scope, session=None):
+        """Returns the cache generation of a scope, 0 if never bumped.
+
+        :param scope: cache scope, see vmexpire_cache_scope()
+        :param session: existing db session reference.
+        """
+        session = self.get_session(session)
+        generation = session.query(
+            models.CacheGeneration.generation).filter_by(scope=scope).scalar()
+        return generation or 0
+
+    @staticmethod
+    def _new_generation_values(scope, now):
+        return {
+            'id': utils.generate_uuid(),
+            'created_at': now,
+            'updated_at': now,
+            'deleted': False,
+            'scope': scope,
+            'generation': 1
+        }
+
+    def _build_upsert(self, dialect_name, scope):
+        table = models.CacheGeneration.__table__
+        now = timeutils.utcnow()
+        values = self._new_generation_values(scope, now)
+        bump = {'generation': table.c.generation + 1, 'updated_at': now}
+        if dialect_name == 'mysql':
+            return mysql.insert(table).values(
+                **values).on_duplicate_key_update(**bump)
+        if dialect_name in _UPSERT_DIALECTS:
+            return _UPSERT_DIALECTS[dialect_name](table).values(
+                **values).on_conflict_do_update(index_elements=['scope'],
+                                                set_=bump)
+        return None
+
+    def bump_generations(self, scopes, session=None):
+        """Increments the cache generation of scopes.
+
+        Each scope is bumped once per transaction, by a single upsert
+        statement on dialects supporting it.
+
+        :param scopes: cache scopes, see vmexpire_cache_scope()
+        :param session: existing db session reference.
+        """
+        session = self.get_session(session)
+        bumped = session.info.setdefault('cache_generations', set())
+        connection = session.connection()
+        table = models.CacheGeneration.__table__
+        # Sorted to lock rows in the same order in all transactions
+        for scope in sorted(set(scopes) - bumped):
+            upsert = self._build_upsert(connection.dialect.name, scope)
+            if upsert is not None:
+                connection.execute(upsert)
+            else:
+                now = timeutils.utcnow()
+                if not connection.execute(table.update().where(
+                        table.c.scope == scope).values(
+                            generation=table.c.generation + 1,
+                            updated_at=now)).rowcount:
+                    connection.execute(table.insert().values(
+                        **self._new_generation_values(scope, now)))
+            bumped.add(scope)
+
+
+class VmExpireJobRepo(BaseRepo):
+    """Repository for the bulk job entity."""
+
+    def _do_entity_name(self):
+        """Sub-class hook: return entity name, such as for debugging."""
+        return "VmExpireJob"
+
+    def _do_build_get_query(self, entity_id, session):
+        """Sub-class hook: build a retrieve query."""
+        query = session.query(models.VmExpireJob)
+        query = query.filter_by(id=entity_id)
+        return query
+
+    def _do_validate(self, values):
+        """Sub-class hook: validate values."""
+        pass
+
+    def create_job(self, project_id, operation, instance_ids,
+                   all_tenants=False, selector=None, session=None):
+        """Records a job, processed later by the cleaner.
+
+        :param project_id: project of the job, extend and delete operations
+                           only apply to its expirations unless all_tenants
+        :param operation: one of models.VmExpireJob.OPERATIONS
+        :param instance_ids: ids of the instances, without duplicates
+        :param all_tenants: apply to expirations of all projects
+        :param selector: if set, {"project_id": ...} or {"domain_id": ...},
+                         the job applying to the expirations of the selected
+                         projects instead of instance_ids
+        :param session: existing db session reference.
+        :return: `os_vm_expire.model.models.VmExpireJob`
+        """
+        entity = models.VmExpireJob()
+        entity.project_id = project_id
+        entity.operation = operation
+        entity.all_tenants = all_tenants
+        entity.status = models.JobStatus.PENDING
+        entity.instance_ids = instance_ids
+        entity.total = len(instance_ids)
+        entity.processed = 0
+        entity.failures = []
+        entity.selector = selector
+        if selector and 'project_id' in selector:
+            entity.project_ids = [selector['project_id']]
+            entity.total = get_vmexpire_repository().count_project_instances(
+                entity.project_ids, session=session)
+        return self.create_from(entity, session)
+
+    def get_project_jobs(self, project_id, session=None):
+        """Returns the jobs of a project, oldest first."""
+        session = self.get_session(session)
+        return session.query(models.VmExpireJob).filter_by(
+            project_id=project_id).order_by(
+                models.VmExpireJob.created_at).all()
+
+    def get_pending_jobs(self, session=None):
+        """Returns the jobs neither completed nor failed, oldest first."""
+        session = self.get_session(session)
+        return session.query(models.VmExpireJob).filter(
+            models.VmExpireJob.status.notin_([models.JobStatus.COMPLETED,
+                                              models.JobStatus.FAILED])
+        ).order_by(models.VmExpireJob.created_at).all()
+
+    def process_chunk(self, job, chunk_size, session=None):
+        """Applies the operation of a job to its next chunk of instances.
+
+        Progress and failures are flushed with the expirations, the caller
+        commits. Projects of a domain selector are resolved with the first
+        chunk, the total of selector jobs being updated with each chunk.
+
+        :param job: `os_vm_expire.model.models.VmExpireJob`
+        :param chunk_size: max number of instances processed
+        :param session: existing db session reference.
+        :return: number of processed instances
+        """
+        session = self.get_session(session)
+        vmexpire_repo = get_vmexpire_repository()
+        if job.selector:
+            if job.project_ids is None:
+                job.project_ids = get_domain_project_ids(
+                    job.selector['domain_id'])
+                if job.project_ids is None:
+                    _raise_domain_projects_not_found(
+                        job.selector['domain_id'])
+            # Expirations are read after the marker, as those of the
+            # previous chunks may have been deleted.
+            instance_ids = vmexpire_repo.get_project_instance_ids(
+                job.project_ids, marker=job.marker, limit=chunk_size,
+                session=session)
+            project_id = None
+        else:
+            instance_ids = job.instance_ids[job.processed:
+                                            job.processed + chunk_size]
+            project_id = None if job.all_tenants else job.project_id
+        if job.operation == 'add':
+            results = vmexpire_repo.add_vms(instance_ids, session=session)
+        elif job.operation == 'extend':
+            results = vmexpire_repo.extend_vms(
+                instance_ids, project_id=project_id, session=session)
+        elif job.operation == 'delete':
+            results = vmexpire_repo.delete_vms(
+                instance_ids, project_id=project_id, session=session)
+        else:
+            _raise_entity_invalid(job.id, u._('unknown operation'))
+        # Assigned a new list, in place changes of JSON are not detected
+        job.failures = (job.failures or []) + [
+            {'instance_id': r.instance_id, 'reason': r.error,
+             'message': r.message}
+            for r in results if r.error]
+        job.processed += len(instance_ids)
+        if job.selector:
+            if instance_ids:
+                job.marker = instance_ids[-1]
+            remaining = 0
+            if len(instance_ids) == chunk_size:
+                remaining = vmexpire_repo.count_project_instances(
+                    job.project_ids, marker=job.marker, session=session)
+            job.total = job.processed + remaining
+        job.attempts = 0
+        job.error = None
+        if job.processed >= job.total:
+            job.status = models.JobStatus.COMPLETED
+        else:
+            job.status = models.JobStatus.ACTIVE
+        session.flush()
+        return len(instance_ids)
+
+    def record_failure(self, job_id, error, max_attempts, session=None):
+        """Records a failed attempt to process the next chunk of a job.
+
+        The job is FAILED, and no longer processed, after max_attempts
+        consecutive failed attempts. The caller commits.
+
+        :param job_id: id of the job, the job of the failed attempt being
+                       rolled back
+        :param error: reason of the failure
+        :param max_attempts: number of attempts after which the job fails
+        :param session: existing db session reference.
+        :return: `os_vm_expire.model.models.VmExpireJob`
+        """
+        session = self.get_session(session)
+        job = self.get(entity_id=job_id, session=session)
+        job.attempts = (job.attempts or 0) + 1
+        job.error = error
+        if job.attempts >= max_attempts:
+            job.status = models.JobStatus.FAILED
+        session.flush()
+        return job
+
+    def purge_jobs(self, ttl, session=None):
+        """Delete jobs completed, or failed, more than ttl seconds ago.
+
+        :param ttl: max age of completed and failed jobs in seconds
+        :param session: existing db session reference.
+        :return: number of deleted jobs
+        """
+        session = self.get_session(session)
+        threshold = timeutils.utcnow() - datetime.timedelta(seconds=ttl)
+        return session.query(models.VmExpireJob).filter(
+            models.VmExpireJob.status.in_([models.JobStatus.COMPLETED,
+                                           models.JobStatus.FAILED]),
+            models.VmExpireJob.updated_at < threshold
+        ).delete(synchronize_session=False)
+
+    def delete_all_entities(self, suppress_exception=False, session=None):
+        """Deletes all entities.
+
+        :param suppress_exception: Pass True if want to suppress exception
+        :param session: existing db session reference. If None, gets session.
+        """
+        session = self.get_session(session)
+        try:
+            session.query(models.VmExpireJob).delete()
         except sqlalchemy.exc.SQLAlchemyError:
             LOG.exception('Problem deleting entities')
             if not suppress_exception:
                 raise Exception(u._('Error deleting entities '))
 
 
+def get_cache_generation_repository():
+    """Returns a singleton repository instance."""
+    global _CACHE_GENERATION_REPOSITORY
+    return _get_repository(_CACHE_GENERATION_REPOSITORY, CacheGenerationRepo)
+
+
 def get_vmexpire_repository():
     """Returns a singleton repository instance."""
     global _VMEXPIRE_REPOSITORY
     return _get_repository(_VMEXPIRE_REPOSITORY, VmExpireRepo)
 
 
+def get_vmexpire_deletion_repository():
+    """Returns a singleton repository instance."""
+    global _VMEXPIRE_DELETION_REPOSITORY
+    return _get_repository(_VMEXPIRE_DELETION_REPOSITORY,
+                           VmExpireDeletionRepo)
+
+
+def get_vmexpire_job_repository():
+    """Returns a singleton repository instance."""
+    global _VMEXPIRE_JOB_REPOSITORY
+    return _get_repository(_VMEXPIRE_JOB_REPOSITORY, VmExpireJobRepo)
+
+
 def get_vmexclude_repository():
     """Returns a singleton repository instance."""
     global _VMEXPIRE_REPOSITORY
     return _get_repository(_VMEXPIRE_REPOSITORY, VmExcludeRepo)
 
 
+def get_vmtombstone_repository():
+    """Returns a singleton repository instance."""
+    global _VMTOMBSTONE_REPOSITORY
+    return _get_repository(_VMTOMBSTONE_REPOSITORY, VmTombstoneRepo)
+
+
 def _get_repository(global_ref, repo_class):
     if not global_ref:
         global_ref = repo_class()
@@ -839,6 +2077,11 @@ def _raise_entity_invalid(entity_id, msg):
         msg=msg))
 
 
+def _raise_domain_projects_not_found(domain_id):
+    raise Exception(u._("Projects of domain {domain_id} could not be "
+                        "retrieved").format(domain_id=domain_id))
+
+
 def _raise_entity_id_not_found(entity_id):
     raise Exception(u._("Entity ID {entity_id} not "
                         "found").format(entity_id=entity_id))
@@ -0,0 +1,108 @@
+# Copyright (c) 2018 IRISA
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Keyed executor used by the worker to process notifications in parallel.
+"""
+import threading
+import zlib
+
+from six.moves import queue
+
+from os_vm_expire.common import utils
+
+LOG = utils.getLogger(__name__)
+
+_STOP = object()
+
+
+class KeyedExecutor(object):
+    """Run tasks in parallel while serializing tasks sharing the same key.
+
+    Tasks are dispatched to a fixed number of lanes, each lane being a bounded
+    queue consumed by a single thread. A key is always mapped to the same
+    lane, so tasks submitted with the same key (an instance uuid for example)
+    are executed in submission order, while tasks with different keys may run
+    concurrently.
+    When a lane queue is full, submit() blocks the caller until some room is
+    available, which slows down the producer (backpressure).
+    """
+
+    def __init__(self, workers=1, queue_size=0, name='executor'):
+        """Creates the executor, call start() to run the lanes.
+
+        :param workers: number of lanes (threads)
+        :param queue_size: max number of pending tasks per lane, 0 means
+                           unbounded
+        :param name: prefix used for thread names
+        """
+        self.workers = max(1, int(workers))
+        self.name = name
+        self._lanes = [queue.Queue(maxsize=max(0, int(queue_size)))
+                       for _ in range(self.workers)]
+        self._threads = []
+
+    def lane_for(self, key):
+        """Returns the lane index a key is dispatched to."""
+        if key is None:
+            return 0
+        if not isinstance(key, bytes):
+            key = str(key).encode('utf-8')
+        return zlib.crc32(key) % self.workers
+
+    def start(self):
+        if self._threads:
+            return
+        for index, lane in enumerate(self._lanes):
+            thread = threading.Thread(target=self._run, args=(lane,),
+                                      name='%s-%d' % (self.name, index))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, key, fn, *args, **kwargs):
+        """Queue fn(*args, **kwargs) on the lane of key.
+
+        Blocks while the lane queue is full.
+        """
+        self._lanes[self.lane_for(key)].put((fn, args, kwargs))
+
+    def pending(self):
+        """Returns the number of queued tasks not started yet."""
+        return sum(lane.qsize() for lane in self._lanes)
+
+    def stop(self, wait=True):
+        """Stops the lanes once all queued tasks are processed."""
+        for lane in self._lanes:
+            lane.put(_STOP)
+        if wait:
+            for thread in self._threads:
+                thread.join()
+        self._threads = []
+
+    def _run(self, lane):
+        while True:
+            task = lane.get()
+            try:
+                if task is _STOP:
+                    return
+                fn, args, kwargs = task
+                try:
+                    fn(*args, **kwargs)
+                except Exception:
+                    LOG.exception("Problem seen processing task in %s",
+                                  self.name)
+            finally:
+                lane.task_done()
@@ -25,16 +25,27 @@ import time
 import oslo_messaging
 
 from oslo_service import service
+from oslo_utils import timeutils
 
 from os_vm_expire.common import config
+from os_vm_expire.common import instrumentation
+from os_vm_expire.common import metrics
 from os_vm_expire.common import utils
 from os_vm_expire.model import models
 from os_vm_expire.model import repositories
+from os_vm_expire.queue import executor
 
 CONF = config.CONF
 
 LOG = utils.getLogger(__name__)
 
+# Notifications handled by the worker, others are dropped by the listener
+# before reaching the endpoint.
+EVENT_TYPES = r'^(compute\.)?instance\.(create\.end|delete\.end|update)$'
+
+# Notifications are checked against the statement budget of this unit
+UNIT_NAME = 'worker'
+
 
 def find_function_name(func, if_no_name=None):
     """Returns pretty-formatted function name."""
@@ -69,10 +80,46 @@ def transactional(fn):
     return wrapper
 
 
-def monitored(fn):  # pragma: no cover
-    """Provides monitoring capabilities for task methods."""
+def get_instance_uuid(payload):
+    """Returns the instance uuid of a nova notification payload, if any."""
+    if not isinstance(payload, dict):
+        return None
+    if 'nova_object.data' in payload:
+        return payload['nova_object.data'].get('uuid')
+    return payload.get('instance_id')
+
 
-    return fn
+def get_event_lag(metadata):
+    """Returns the seconds elapsed since a notification was emitted."""
+    try:
+        emitted_at = timeutils.parse_isotime(metadata['timestamp'])
+    except Exception:
+        return None
+    return max(0.0, (timeutils.utcnow(with_timezone=True) -
+                     emitted_at).total_seconds())
+
+
+def monitored(fn):
+    """Provides monitoring capabilities for task methods.
+
+    Counts the notifications processed by event type and observes the lag
+    between their emission and their processing. Notifications are checked
+    against the worker SQL statement budget.
+    """
+
+    @functools.wraps(fn)
+    def wrapper(self, ctxt, publisher_id, event_type, payload, metadata):
+        lag = get_event_lag(metadata) if isinstance(metadata, dict) else None
+        if lag is not None:
+            metrics.WORKER_EVENT_LAG.labels(event_type).observe(lag)
+        try:
+            with instrumentation.unit(UNIT_NAME):
+                return fn(self, ctxt, publisher_id, event_type, payload,
+                          metadata)
+        finally:
+            metrics.WORKER_EVENTS.labels(event_type).inc()
+
+    return wrapper
 
 
 class Tasks(object):
@@ -113,6 +160,13 @@ class Tasks(object):
             repo = repositories.get_vmexpire_repository()
             instance = None
             instance_uuid = str(uuid)
+            conf_opts = getattr(CONF, config.KS_NOTIFICATIONS_GRP_NAME)
+            tombstone_repo = repositories.get_vmtombstone_repository()
+            if tombstone_repo.consume_tombstone(instance_uuid,
+                                                conf_opts.tombstone_ttl):
+                LOG.info('InstanceAlreadyDeleted:' + instance_uuid +
+                         ', skipping')
+                return
             try:
                 instance = repo.get_by_instance(instance_uuid)
             except Exception:
@@ -122,7 +176,7 @@ class Tasks(object):
                          instance_uuid +
                          ", deleting first"
                          )
-                repo.delete_entity_by_id(entity_id=instance.id)
+                repo.delete_entity(instance)
             entity = models.VmExpire()
             entity.instance_id = instance_uuid
             entity.instance_name = display_name
@@ -142,18 +196,17 @@ class Tasks(object):
             except Exception:
                 LOG.exception('Failed to get domain for project')
 
+            # Domain, project and user exclusions are read at once
             exclude_repo = repositories.get_vmexclude_repository()
-            if project_domain:
-                exclude_id = exclude_repo.get_exclude_by_id(project_domain)
-                if exclude_id:
-                    LOG.debug('domain %s is excluded, skipping' % (project_domain))
-                    return
-            exclude_id = exclude_repo.get_exclude_by_id(entity.project_id)
-            if exclude_id:
+            excluded = exclude_repo.get_excluded_ids(
+                [project_domain, entity.project_id, entity.user_id])
+            if project_domain and project_domain in excluded:
+                LOG.debug('domain %s is excluded, skipping' % (project_domain))
+                return
+            if entity.project_id in excluded:
                 LOG.debug('project %s is excluded, skipping' % (entity.project_id))
                 return
-            exclude_id = exclude_repo.get_exclude_by_id(entity.user_id)
-            if exclude_id:
+            if entity.user_id in excluded:
                 LOG.debug('user %s is excluded, skipping' % (entity.user_id))
                 return
 
@@ -168,12 +221,39 @@ class Tasks(object):
             instance_uuid = str(uuid)
             LOG.debug(event_type + ':' + instance_uuid)
             repo = repositories.get_vmexpire_repository()
+            instance = None
             try:
                 instance = repo.get_by_instance(instance_uuid)
-                repo.delete_entity_by_id(entity_id=instance.id)
-                LOG.debug("Delete id:" + instance.id)
             except Exception:
-                LOG.warn('Failed to delete: ' + instance_uuid)
+                LOG.debug("Instance %s not found", instance_uuid)
+            if instance:
+                repo.delete_entity(instance)
+                LOG.debug("Delete id:" + instance.id)
+            else:
+                # Creation may not be processed yet, remember the deletion
+                # so that a late creation is ignored.
+                tombstone_repo = repositories.get_vmtombstone_repository()
+                tombstone_repo.add_tombstone(instance_uuid)
+                LOG.info('InstanceNotFound:' + instance_uuid +
+                         ', tombstone recorded')
+        elif event_type in ('instance.update', 'compute.instance.update'):
+            # High volume event, only apply name and owner changes
+            if 'nova_object.data' in payload:
+                data = payload['nova_object.data']
+                uuid = data['uuid']
+            else:
+                data = payload
+                uuid = payload['instance_id']
+            repo = repositories.get_vmexpire_repository()
+            updated = repo.update_instance_info(
+                str(uuid),
+                instance_name=data.get('display_name') or None,
+                project_id=data.get('tenant_id') or None,
+                user_id=data.get('user_id') or None
+            )
+            if updated:
+                LOG.debug("UpdateInstance:" + str(uuid))
+            return
 
         LOG.debug(publisher_id)
         LOG.debug(event_type)
@@ -196,15 +276,19 @@ class TaskServer(Tasks, service.Service):
     Since this class also extends the Tasks class above, its task-based
     methods are hence available to the RPC messaging server.
     """
+    filter_rule = oslo_messaging.NotificationFilter(event_type=EVENT_TYPES)
+
     def __init__(self):
         super(TaskServer, self).__init__()
 
-        # Setting up db engine to avoid lazy initialization
-        repositories.setup_database_engine_and_factory()
-
         transport = oslo_messaging.get_transport(CONF)
 
         conf_opts = getattr(CONF, config.KS_NOTIFICATIONS_GRP_NAME)
+        self._executor = executor.KeyedExecutor(
+            workers=conf_opts.thread_pool_size,
+            queue_size=conf_opts.queue_size,
+            name='osvmexpire-worker'
+        )
         targets = [
             oslo_messaging.Target(
                 topic=conf_opts.topic,
@@ -218,13 +302,44 @@ class TaskServer(Tasks, service.Service):
             endpoints,
             pool=conf_opts.pool_name
             )
+        self._exporter = metrics.Exporter('worker', CONF.metrics.worker_port)
+
+    def info(self, ctxt, publisher_id, event_type, payload, metadata):
+        """Dispatch the notification to the lane of its instance.
+
+        Notifications about the same instance are processed in order, the
+        call blocks while the lane queue is full. The notification is
+        acknowledged when this call returns, before being processed:
+        delivery is at most once, a notification queued when the process
+        is killed is lost.
+        """
+        self._executor.submit(get_instance_uuid(payload),
+                              super(TaskServer, self).info,
+                              ctxt, publisher_id, event_type, payload,
+                              metadata)
 
     def start(self):
         LOG.info("Starting the TaskServer")
-        self._server.start()
+        # Setting up db engine to avoid lazy initialization. This is done
+        # here and not in the constructor as worker processes are forked
+        # after the server creation, and must not share db connections.
+        repositories.setup_database_engine_and_factory()
+        self._executor.start()
+        self._exporter.start()
+        # Notifications must be handed over to the executor in the order
+        # they are received, parallelism is provided by the executor lanes.
+        self._server.start(override_pool_size=1)
         super(TaskServer, self).start()
 
     def stop(self):
         LOG.info("Halting the TaskServer")
-        super(TaskServer, self).stop()
+        # Notifications are acknowledged once handed over to the executor,
+        # those queued in the lanes are processed before the process exits.
         self._server.stop()
+        self._server.wait()
+        pending = self._executor.pending()
+        if pending:
+            LOG.info("Processing %d pending notifications", pending)
+        self._executor.stop(wait=True)
+        self._exporter.stop()
+        super(TaskServer, self).stop()
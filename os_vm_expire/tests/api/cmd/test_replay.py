@@ -0,0 +1,84 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+
+from os_vm_expire.cmd import replay
+from os_vm_expire.common import instrumentation
+from os_vm_expire.model import repositories
+from os_vm_expire.tests import utils
+
+
+def notification(event_type, uuid):
+    return {
+        'event_type': event_type,
+        'publisher_id': 'nova-compute:test',
+        'payload': {
+            'nova_object.data': {
+                'uuid': uuid,
+                'display_name': uuid,
+                'tenant_id': '12345project',
+                'user_id': '12345user'
+            }
+        }
+    }
+
+
+class WhenTestingReplay(utils.OsVMExpireAPIBaseTestCase):
+
+    def tearDown(self):
+        super(WhenTestingReplay, self).tearDown()
+        repo = repositories.get_vmexpire_repository()
+        repo.delete_all_entities()
+        repositories.commit()
+        tombstone_repo = repositories.get_vmtombstone_repository()
+        tombstone_repo.delete_all_entities()
+        repositories.commit()
+
+    def test_parse_envelope(self):
+        msg = notification('instance.create.end', 'r-1')
+        envelope = {'oslo.version': '2.0', 'oslo.message': json.dumps(msg)}
+        self.assertEqual(replay.parse_notification(json.dumps(msg)),
+                         replay.parse_notification(json.dumps(envelope)))
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(50, instrumentation.percentile(values, 50))
+        self.assertEqual(99, instrumentation.percentile(values, 99))
+        self.assertEqual(0.0, instrumentation.percentile([], 99))
+
+    def test_replay(self):
+        lines = [json.dumps(notification('instance.create.end', 'r-1')),
+                 '',
+                 json.dumps(notification('instance.create.end', 'r-2')),
+                 json.dumps(notification('instance.delete.end', 'r-1'))]
+        get_project_domain = repositories.get_project_domain
+        stats = replay.replay(replay.read_notifications(lines))
+        self.assertEqual(3, stats['events'])
+        self.assertTrue(stats['statements'] > 0)
+        repo = repositories.get_vmexpire_repository()
+        self.assertEqual([], repo.get_all_by(instance_id='r-1'))
+        self.assertEqual(1, len(repo.get_all_by(instance_id='r-2')))
+        # Stubbed keystone lookup is restored
+        self.assertIs(get_project_domain, repositories.get_project_domain)
+
+    def test_replay_with_workers(self):
+        # Statements are counted in the threads processing the events
+        lines = [json.dumps(notification(event_type, 'r-%d' % i))
+                 for event_type in ('instance.create.end',
+                                    'instance.delete.end')
+                 for i in range(4)]
+        stats = replay.replay(replay.read_notifications(lines), workers=2)
+        self.assertEqual(8, stats['events'])
+        self.assertTrue(stats['statements'] >= 8)
+        repo = repositories.get_vmexpire_repository()
+        self.assertEqual([], repo.get_all_by(instance_id='r-0'))
@@ -16,9 +16,11 @@ import mock
 # import sqlalchemy.orm as sa_orm
 import time
 
+from os_vm_expire.common import instrumentation
 from os_vm_expire.model import models
 from os_vm_expire.model import repositories
 from os_vm_expire.queue.server import Tasks
+from os_vm_expire.tests import database_utils
 from os_vm_expire.tests import utils
 
 
@@ -60,6 +62,9 @@ class WhenTestingVmExpiresResource(utils.OsVMExpireAPIBaseTestCase):
         exclude_repo = repositories.get_vmexclude_repository()
         exclude_repo.delete_all_entities()
         repositories.commit()
+        tombstone_repo = repositories.get_vmtombstone_repository()
+        tombstone_repo.delete_all_entities()
+        repositories.commit()
 
     @mock.patch('requests.get', side_effect=mocked_requests_get)
     @mock.patch('requests.post', side_effect=mocked_requests_post)
@@ -76,7 +81,8 @@ class WhenTestingVmExpiresResource(utils.OsVMExpireAPIBaseTestCase):
         self.task.info(None, 'mock', 'instance.create.end', create_msg, None)
         repo = repositories.get_vmexpire_repository()
         expire = repo.get_by_instance(create_msg['nova_object.data']['uuid'])
-        self.assertEqual(expire.instance_id, create_msg['nova_object.data']['uuid'])
+        self.assertEqual(expire.instance_id,
+                         create_msg['nova_object.data']['uuid'])
         self.assertTrue(expire.expire > 0)
 
     def test_vm_delete(self):
@@ -93,7 +99,8 @@ class WhenTestingVmExpiresResource(utils.OsVMExpireAPIBaseTestCase):
         repo = repositories.get_vmexpire_repository()
         found = False
         try:
-            expire = repo.get_by_instance(delete_msg['nova_object.data']['uuid'])
+            expire = repo.get_by_instance(
+                delete_msg['nova_object.data']['uuid'])
             if expire:
                 found = True
         except Exception as e:
@@ -101,6 +108,106 @@ class WhenTestingVmExpiresResource(utils.OsVMExpireAPIBaseTestCase):
             found = False
         self.assertFalse(found)
 
+    @mock.patch('os_vm_expire.model.repositories.get_project_domain', side_effect=mocked_get_project_domain)
+    def test_vm_events_statement_budget(self, mock_get_project_domain):
+        msg = {
+            'nova_object.data': {
+                'uuid': '1-2-3-4-8',
+                'display_name': '12348',
+                'tenant_id': '12345project',
+                'user_id': '12345user'
+            }
+        }
+        self.assertLessEqual(6, instrumentation.get_budget('worker'))
+        # Exclusions of the domain, project and user are read at once
+        with database_utils.StatementBudget(6):
+            self.task.info(None, 'mock', 'instance.create.end', msg, None)
+        # Expiration is not fetched again to be deleted
+        with database_utils.StatementBudget(5):
+            self.task.info(None, 'mock', 'instance.delete.end', msg, None)
+        repo = repositories.get_vmexpire_repository()
+        self.assertEqual([], repo.get_all_by(instance_id='1-2-3-4-8'))
+
+        database_utils.create_vmexclude('12345user', exclude_type=2)
+        repositories.commit()
+        msg['nova_object.data']['uuid'] = '1-2-3-4-9'
+        with database_utils.StatementBudget(4):
+            self.task.info(None, 'mock', 'instance.create.end', msg, None)
+        self.assertEqual([], repo.get_all_by(instance_id='1-2-3-4-9'))
+
+    @mock.patch('os_vm_expire.model.repositories.get_project_domain',
+                side_effect=mocked_get_project_domain)
+    def test_vm_delete_before_create(self, mock_get_project_domain):
+        msg = {
+            'nova_object.data': {
+                'uuid': '1-2-3-4-6',
+                'display_name': '12346',
+                'tenant_id': '12345project',
+                'user_id': '12345user'
+            }
+        }
+        self.task.info(None, 'mock', 'instance.delete.end', msg, None)
+        self.task.info(None, 'mock', 'instance.create.end', msg, None)
+        repo = repositories.get_vmexpire_repository()
+        self.assertEqual([], repo.get_all_by(instance_id='1-2-3-4-6'))
+        # Tombstone is consumed by the creation, keystone is not called
+        self.assertFalse(mock_get_project_domain.called)
+        self.task.info(None, 'mock', 'instance.create.end', msg, None)
+        self.assertEqual(1, len(repo.get_all_by(instance_id='1-2-3-4-6')))
+
+    @mock.patch('os_vm_expire.model.repositories.get_project_domain',
+                side_effect=mocked_get_project_domain)
+    def test_vm_create_ignores_expired_tombstone(self,
+                                                 mock_get_project_domain):
+        msg = {
+            'nova_object.data': {
+                'uuid': '1-2-3-4-7',
+                'display_name': '12347',
+                'tenant_id': '12345project',
+                'user_id': '12345user'
+            }
+        }
+        self.task.info(None, 'mock', 'instance.delete.end', msg, None)
+        tombstone_repo = repositories.get_vmtombstone_repository()
+        tombstone = tombstone_repo.add_tombstone('1-2-3-4-7')
+        tombstone.created_at = datetime.datetime(2000, 1, 1)
+        tombstone.save()
+        repositories.commit()
+        self.task.info(None, 'mock', 'instance.create.end', msg, None)
+        repo = repositories.get_vmexpire_repository()
+        self.assertEqual(1, len(repo.get_all_by(instance_id='1-2-3-4-7')))
+        self.assertEqual(1, tombstone_repo.purge_tombstones(3600))
+
+    def test_vm_update(self):
+        self.test_vm_create()
+        repo = repositories.get_vmexpire_repository()
+        update_msg = {
+            'nova_object.data': {
+                'uuid': '1-2-3-4-5',
+                'display_name': 'renamed',
+                'tenant_id': '12345project',
+                'user_id': '12345user'
+            }
+        }
+        self.task.info(None, 'mock', 'instance.update', update_msg, None)
+        expire = repo.get_by_instance('1-2-3-4-5')
+        self.assertEqual('renamed', expire.instance_name)
+        # Nothing changed, no row is updated
+        self.assertEqual(0, repo.update_instance_info(
+            '1-2-3-4-5', instance_name='renamed', user_id='12345user'))
+
+    def test_vm_update_legacy_unknown_instance(self):
+        update_msg = {
+            'instance_id': '1-2-3-4-8',
+            'display_name': 'renamed',
+            'tenant_id': '12345project',
+            'user_id': '12345user'
+        }
+        self.task.info(None, 'mock', 'compute.instance.update', update_msg,
+                       None)
+        repo = repositories.get_vmexpire_repository()
+        self.assertEqual([], repo.get_all_by(instance_id='1-2-3-4-8'))
+
 
 class WhenTestingVmExcludesResource(utils.OsVMExpireAPIBaseTestCase):
 
@@ -0,0 +1,239 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import mock
+
+from os_vm_expire.cmd import cleaner
+from os_vm_expire.model import models
+from os_vm_expire.model import repositories
+from os_vm_expire.tests.api.controllers import test_vmexpires
+from os_vm_expire.tests import utils
+
+
+class WhenTestingJobsResource(utils.OsVMExpireAPIBaseTestCase):
+
+    def tearDown(self):
+        super(WhenTestingJobsResource, self).tearDown()
+        repositories.get_vmexpire_job_repository().delete_all_entities()
+        repositories.get_vmexpire_repository().delete_all_entities()
+        repositories.commit()
+
+    def _post_job(self, data, status=202):
+        return self.app.post_json(
+            '/12345project/jobs/', data,
+            headers={'Content-Type': 'application/json'}, status=status)
+
+    def test_can_create_and_get_job(self):
+        _post_resp = self._post_job({'operation': 'extend',
+                                     'instance_ids': ['a', 'b', 'a']})
+        job = _post_resp.json['job']
+        self.assertEqual('PENDING', job['status'])
+        self.assertEqual('extend', job['operation'])
+        self.assertEqual(2, job['total'])
+        self.assertEqual(0, job['processed'])
+        self.assertEqual(0, job['attempts'])
+        self.assertIsNone(job['error'])
+        self.assertEqual(job['links']['self'], _post_resp.location)
+
+        _get_resp = self.app.get('/12345project/jobs/' + job['id'])
+        self.assertEqual(200, _get_resp.status_int)
+        self.assertEqual(job, _get_resp.json['job'])
+
+        _list_resp = self.app.get('/12345project/jobs/')
+        self.assertEqual(1, _list_resp.json['total'])
+        self.assertEqual(job['id'], _list_resp.json['jobs'][0]['id'])
+        self.assertNotIn('failures', _list_resp.json['jobs'][0])
+
+        self.app.get('/otherproject/jobs/' + job['id'], status=404)
+        self.assertEqual(0, self.app.get('/otherproject/jobs/').json['total'])
+
+    def test_invalid_job(self):
+        self._post_job({'operation': 'renew', 'instance_ids': ['a']},
+                       status=400)
+        self._post_job({'operation': 'add', 'instance_ids': 'a'}, status=400)
+        self._post_job({'operation': 'add', 'instance_ids': ['a'],
+                        'all_tenants': 'yes'}, status=400)
+        # Context of the test app is not admin
+        self._post_job({'operation': 'delete', 'instance_ids': ['a'],
+                        'all_tenants': True}, status=403)
+        self.assertEqual(0, self.app.get('/12345project/jobs/').json['total'])
+
+    def test_invalid_selector(self):
+        for selector in ('12345project', {}, {'project_id': ''},
+                         {'project_id': 1}, {'user_id': '12345user'},
+                         {'project_id': '12345project', 'domain_id': 'd'}):
+            self._post_job({'operation': 'extend', 'selector': selector},
+                           status=400)
+        self._post_job({'operation': 'extend', 'instance_ids': ['a'],
+                        'selector': {'project_id': '12345project'}},
+                       status=400)
+        self._post_job({'operation': 'add',
+                        'selector': {'project_id': '12345project'}},
+                       status=400)
+        # Selectors of other projects require all_tenants
+        self._post_job({'operation': 'delete',
+                        'selector': {'project_id': 'otherproject'}},
+                       status=400)
+        self._post_job({'operation': 'delete',
+                        'selector': {'domain_id': 'default'}}, status=400)
+        self.assertEqual(0, self.app.get('/12345project/jobs/').json['total'])
+
+    def _create_project_vmexpires(self, project_id, count):
+        instance_ids = []
+        for index in range(count):
+            entity = test_vmexpires.create_vmexpire_model(
+                prefix='%s%d' % (project_id, index))
+            entity.project_id = project_id
+            instance_ids.append(
+                test_vmexpires.create_vmexpire(entity).instance_id)
+        return instance_ids
+
+    def test_cleaner_processes_project_selector_by_chunks(self):
+        repositories.CONF.set_override('job_chunk_size', 2, group='cleaner')
+        self.addCleanup(repositories.CONF.clear_override, 'job_chunk_size',
+                        group='cleaner')
+        self._create_project_vmexpires('12345project', 3)
+        other_ids = self._create_project_vmexpires('otherproject', 1)
+        job = self._post_job({
+            'operation': 'delete',
+            'selector': {'project_id': '12345project'}}).json['job']
+        self.assertEqual({'project_id': '12345project'}, job['selector'])
+        self.assertEqual(3, job['total'])
+
+        cleaner.process_jobs()
+
+        job = self.app.get('/12345project/jobs/' + job['id']).json['job']
+        self.assertEqual(models.JobStatus.COMPLETED, job['status'])
+        self.assertEqual(3, job['processed'])
+        self.assertEqual(3, job['total'])
+        self.assertEqual(0, job['failed'])
+        repo = repositories.get_vmexpire_repository()
+        self.assertEqual(0, repo.count_project_instances(['12345project']))
+        self.assertEqual(other_ids, repo.get_project_instance_ids(
+            ['otherproject']))
+
+    @mock.patch.object(repositories, 'get_domain_project_ids')
+    def test_cleaner_resolves_domain_selector(self, mock_projects):
+        repositories.CONF.set_override('job_chunk_size', 1, group='cleaner')
+        self.addCleanup(repositories.CONF.clear_override, 'job_chunk_size',
+                        group='cleaner')
+        self.app.extra_environ = {
+            'os_vm_expire.context': self._build_context(self.project_id,
+                                                        is_admin=True)
+        }
+        self._create_project_vmexpires('12345project', 2)
+        self._create_project_vmexpires('otherproject', 1)
+        self._create_project_vmexpires('thirdproject', 1)
+        job = self._post_job({'operation': 'extend',
+                              'selector': {'domain_id': 'mydomain'},
+                              'all_tenants': True}).json['job']
+        url = '/12345project/jobs/' + job['id']
+
+        mock_projects.return_value = None
+        cleaner.process_jobs()
+        job = self.app.get(url).json['job']
+        self.assertEqual(models.JobStatus.PENDING, job['status'])
+        self.assertEqual(1, job['attempts'])
+        self.assertIn('mydomain', job['error'])
+
+        mock_projects.return_value = ['12345project', 'otherproject']
+        cleaner.process_jobs()
+        job = self.app.get(url).json['job']
+        self.assertEqual(models.JobStatus.COMPLETED, job['status'])
+        self.assertEqual(3, job['processed'])
+        self.assertEqual(3, job['total'])
+        # Projects are resolved once, with the first chunk
+        mock_projects.assert_called_with('mydomain')
+        self.assertEqual(2, mock_projects.call_count)
+
+    def test_cleaner_caps_chunks_per_run(self):
+        repositories.CONF.set_override('job_chunk_size', 1, group='cleaner')
+        self.addCleanup(repositories.CONF.clear_override, 'job_chunk_size',
+                        group='cleaner')
+        repositories.CONF.set_override('job_max_chunks_per_run', 2,
+                                       group='cleaner')
+        self.addCleanup(repositories.CONF.clear_override,
+                        'job_max_chunks_per_run', group='cleaner')
+        job = self._post_job({'operation': 'extend',
+                              'instance_ids': ['a', 'b', 'c']}).json['job']
+        url = '/12345project/jobs/' + job['id']
+
+        cleaner.process_jobs()
+        job = self.app.get(url).json['job']
+        self.assertEqual(models.JobStatus.ACTIVE, job['status'])
+        self.assertEqual(2, job['processed'])
+
+        cleaner.process_jobs()
+        job = self.app.get(url).json['job']
+        self.assertEqual(models.JobStatus.COMPLETED, job['status'])
+        self.assertEqual(3, job['processed'])
+
+    def test_cleaner_processes_jobs_by_chunks(self):
+        repositories.CONF.set_override('job_chunk_size', 2, group='cleaner')
+        self.addCleanup(repositories.CONF.clear_override, 'job_chunk_size',
+                        group='cleaner')
+        instance_ids = []
+        for index in range(3):
+            entity = test_vmexpires.create_vmexpire_model(
+                prefix='job%d' % index)
+            entity.project_id = '12345project'
+            instance_ids.append(
+                test_vmexpires.create_vmexpire(entity).instance_id)
+        other = test_vmexpires.create_vmexpire_model(prefix='other')
+        test_vmexpires.create_vmexpire(other)
+        job = self._post_job({
+            'operation': 'delete',
+            'instance_ids': instance_ids + ['otherinstance']}).json['job']
+
+        cleaner.process_jobs()
+
+        job = self.app.get('/12345project/jobs/' + job['id']).json['job']
+        self.assertEqual(models.JobStatus.COMPLETED, job['status'])
+        self.assertEqual(4, job['processed'])
+        self.assertEqual(1, job['failed'])
+        self.assertEqual([{'instance_id': 'otherinstance',
+                           'reason': repositories.BULK_NOT_FOUND,
+                           'message': job['failures'][0]['message']}],
+                         job['failures'])
+        repo = repositories.get_vmexpire_repository()
+        self.assertEqual(
+            ['otherinstance'],
+            [row.instance_id for row in repo.get_by_instances(
+                instance_ids + ['otherinstance'])])
+
+    def test_cleaner_fails_job_after_max_attempts(self):
+        repositories.CONF.set_override('job_max_attempts', 2,
+                                       group='cleaner')
+        self.addCleanup(repositories.CONF.clear_override, 'job_max_attempts',
+                        group='cleaner')
+        job = self._post_job({'operation': 'extend',
+                              'instance_ids': ['a']}).json['job']
+        url = '/12345project/jobs/' + job['id']
+
+        with mock.patch.object(repositories.VmExpireRepo, 'extend_vms',
+                               side_effect=Exception('boom')) as extend:
+            cleaner.process_jobs()
+            job = self.app.get(url).json['job']
+            self.assertEqual(models.JobStatus.PENDING, job['status'])
+            self.assertEqual(1, job['attempts'])
+            self.assertEqual('boom', job['error'])
+
+            cleaner.process_jobs()
+            job = self.app.get(url).json['job']
+            self.assertEqual(models.JobStatus.FAILED, job['status'])
+            self.assertEqual(2, job['attempts'])
+            self.assertEqual(0, job['processed'])
+
+            # Failed jobs are no longer processed
+            cleaner.process_jobs()
+            self.assertEqual(2, extend.call_count)
+        self.assertEqual(2, self.app.get(url).json['job']['attempts'])
@@ -11,6 +11,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from os_vm_expire.common import cache
 from os_vm_expire.model import models
 
 from os_vm_expire.model import repositories
@@ -104,6 +105,39 @@ class WhenTestingVmExcludesResource(utils.OsVMExpireAPIBaseTestCase):
         self.assertIn('vmexcludes', _get_resp.json)
         self.assertEqual(len(_get_resp.json['vmexcludes']), 0)
 
+    def test_conditional_get_vmexcludes(self):
+        entity = create_vmexclude_model()
+        instance_id = create_vmexclude(entity).id
+        _get_resp = self.app.get('/12345project/vmexcludes/')
+        etag = _get_resp.headers['ETag']
+        self.assertTrue(etag.startswith('W/'))
+        _get_resp = self.app.get('/12345project/vmexcludes/',
+                                 headers={'If-None-Match': etag}, status=304)
+        self.assertEqual(b'', _get_resp.body)
+        _get_resp = self.app.get('/12345project/vmexcludes/' + instance_id)
+        self.app.get('/12345project/vmexcludes/' + instance_id,
+                     headers={'If-None-Match': _get_resp.headers['ETag']},
+                     status=304)
+        create_vmexclude(create_vmexclude_model(prefix='other'))
+        _get_resp = self.app.get('/12345project/vmexcludes/',
+                                 headers={'If-None-Match': etag})
+        self.assertEqual(200, _get_resp.status_int)
+        self.assertEqual(2, _get_resp.json['total'])
+
+    def test_cached_listing_invalidated_on_write(self):
+        repositories.CONF.set_override('enabled', True, group='cache')
+        self.addCleanup(repositories.CONF.clear_override, 'enabled',
+                        group='cache')
+        cache.invalidate()
+        create_vmexclude(create_vmexclude_model())
+        _get_resp = self.app.get('/12345project/vmexcludes/')
+        self.assertEqual(1, _get_resp.json['total'])
+        self.app.post_json('/12345project/vmexcludes/',
+                           {'id': 'otherproject', 'type': 'project'},
+                           headers={'Content-Type': 'application/json'})
+        _get_resp = self.app.get('/12345project/vmexcludes/')
+        self.assertEqual(2, _get_resp.json['total'])
+
 
 def create_vmexclude_model(prefix=None, exclude_type=0):
     if not prefix:
@@ -15,6 +15,9 @@ import mock
 import time
 
 # from os_vm_expire import context
+from os_vm_expire.api.controllers import vmexpire
+from os_vm_expire.common import cache
+from os_vm_expire.common import hrefs
 from os_vm_expire.model import models
 from os_vm_expire.model import repositories
 from os_vm_expire.tests import utils
@@ -173,6 +176,528 @@ class WhenTestingVmExpiresResource(utils.OsVMExpireAPIBaseTestCase):
         self.assertIn('vmexpires', _get_resp.json)
         self.assertEqual(len(_get_resp.json['vmexpires']), 0)
 
+    def _create_project_vmexpires(self, count):
+        ids = []
+        for index in range(count):
+            entity = create_vmexpire_model(prefix='page%d' % index)
+            entity.project_id = '12345project'
+            ids.append(create_vmexpire(entity).id)
+        return sorted(ids)
+
+    def _follow(self, href):
+        return self.app.get(href[href.index('/12345project'):])
+
+    def test_can_page_vmexpires(self):
+        ids = self._create_project_vmexpires(5)
+        _get_resp = self.app.get('/12345project/vmexpires/?limit=2')
+        self.assertEqual(200, _get_resp.status_int)
+        self.assertEqual(5, _get_resp.json['total'])
+        self.assertEqual(ids[:2],
+                         [o['id'] for o in _get_resp.json['vmexpires']])
+        self.assertNotIn('previous', _get_resp.json)
+        self.assertIn('marker=' + ids[1], _get_resp.json['next'])
+
+        _get_resp = self._follow(_get_resp.json['next'])
+        self.assertEqual(ids[2:4],
+                         [o['id'] for o in _get_resp.json['vmexpires']])
+        self.assertNotIn('marker', _get_resp.json['previous'])
+
+        _get_resp = self._follow(_get_resp.json['next'])
+        self.assertEqual(ids[4:],
+                         [o['id'] for o in _get_resp.json['vmexpires']])
+        self.assertNotIn('next', _get_resp.json)
+        self.assertIn('marker=' + ids[1], _get_resp.json['previous'])
+
+        _get_resp = self._follow(_get_resp.json['previous'])
+        self.assertEqual(ids[2:4],
+                         [o['id'] for o in _get_resp.json['vmexpires']])
+
+    def test_can_page_vmexpires_with_offset(self):
+        ids = self._create_project_vmexpires(3)
+        _get_resp = self.app.get('/12345project/vmexpires/?limit=1&offset=1')
+        self.assertEqual(ids[1:2],
+                         [o['id'] for o in _get_resp.json['vmexpires']])
+        self.assertIn('marker=' + ids[1], _get_resp.json['next'])
+        self.assertNotIn('offset', _get_resp.json['previous'])
+
+    def test_page_limit_is_bounded(self):
+        self._create_project_vmexpires(3)
+        repositories.CONF.set_override('max_limit_paging', 2)
+        self.addCleanup(repositories.CONF.clear_override, 'max_limit_paging')
+        _get_resp = self.app.get('/12345project/vmexpires/?limit=100')
+        self.assertEqual(2, len(_get_resp.json['vmexpires']))
+        self.assertIn('limit=2', _get_resp.json['next'])
+
+    def test_can_filter_vmexpires(self):
+        now = int(time.time())
+        for index in range(4):
+            entity = create_vmexpire_model(prefix='filter%d' % index)
+            entity.project_id = '12345project'
+            entity.expire = now + index * 3600 * 24
+            entity.notified = index == 3
+            create_vmexpire(entity)
+        _get_resp = self.app.get(
+            '/12345project/vmexpires/?expire_before=%d' % (now + 3600 * 36))
+        self.assertEqual(2, _get_resp.json['total'])
+        _get_resp = self.app.get(
+            '/12345project/vmexpires/?expire_after=%d&notified=false' % now)
+        self.assertEqual(['filter1', 'filter2'],
+                         sorted(o['instance_name']
+                                for o in _get_resp.json['vmexpires']))
+        _get_resp = self.app.get('/12345project/vmexpires/'
+                                 '?instance_name=filter3&user_id=filter3user')
+        self.assertEqual(1, _get_resp.json['total'])
+        self.assertTrue(_get_resp.json['vmexpires'][0]['notified'])
+        _get_resp = self.app.get('/12345project/vmexpires/?instance_name=f%25')
+        self.assertEqual(0, _get_resp.json['total'])
+
+    def test_can_sort_and_page_vmexpires(self):
+        now = int(time.time())
+        for index in range(5):
+            entity = create_vmexpire_model(prefix='sort%d' % index)
+            entity.project_id = '12345project'
+            # Same expiration for some entities, ordered by id then
+            entity.expire = now + (index // 2) * 3600
+            create_vmexpire(entity)
+        expected = [o['id'] for o in sorted(
+            self.app.get('/12345project/vmexpires/').json['vmexpires'],
+            key=lambda o: (o['expire'], o['id']), reverse=True)]
+        _get_resp = self.app.get(
+            '/12345project/vmexpires/?sort_key=expire&sort_dir=desc&limit=2'
+            '&notified=false')
+        ids = [o['id'] for o in _get_resp.json['vmexpires']]
+        self.assertIn('sort_key=expire', _get_resp.json['next'])
+        self.assertIn('notified=false', _get_resp.json['next'])
+        while 'next' in _get_resp.json:
+            _get_resp = self._follow(_get_resp.json['next'])
+            ids.extend([o['id'] for o in _get_resp.json['vmexpires']])
+        self.assertEqual(expected, ids)
+        _get_resp = self._follow(_get_resp.json['previous'])
+        self.assertEqual(expected[2:4],
+                         [o['id'] for o in _get_resp.json['vmexpires']])
+
+    def test_streamed_listing_matches_built_listing(self):
+        self._create_project_vmexpires(5)
+        self.addCleanup(repositories.CONF.clear_override,
+                        'stream_listing_threshold')
+        responses = []
+        for threshold in (0, 1000):
+            repositories.CONF.set_override('stream_listing_threshold',
+                                           threshold)
+            _get_resp = self.app.get(
+                '/12345project/vmexpires/?limit=2&sort_key=expire')
+            self.assertEqual(200, _get_resp.status_int)
+            self.assertEqual('application/json', _get_resp.content_type)
+            responses.append(_get_resp.json)
+            _get_resp = self._follow(_get_resp.json['next'])
+            responses.append(_get_resp.json)
+        self.assertEqual(responses[:2], responses[2:])
+        self.assertEqual(5, responses[0]['total'])
+        self.assertIn('next', responses[0])
+        self.assertIn('previous', responses[1])
+
+    def test_row_serializer_matches_entity_serializer(self):
+        entity = create_vmexpire_model()
+        instance = create_vmexpire(entity)
+        repo = repositories.get_vmexpire_repository()
+        row = repo.get_page(project_id=entity.project_id,
+                            rows=True).entities[0]
+        base_url = 'http://localhost:9411'
+        self.assertEqual(
+            hrefs.convert_to_hrefs(instance.to_dict_fields(), base_url),
+            vmexpire.vmexpire_row_to_dict(
+                row, vmexpire.vmexpire_href_prefix(base_url)))
+
+    def test_conditional_get_vmexpires(self):
+        ids = self._create_project_vmexpires(2)
+        _get_resp = self.app.get('/12345project/vmexpires/?limit=1')
+        etag = _get_resp.headers['ETag']
+        self.app.get('/12345project/vmexpires/?limit=1',
+                     headers={'If-None-Match': etag}, status=304)
+        # Other query, other representation
+        _get_resp = self.app.get('/12345project/vmexpires/?limit=2',
+                                 headers={'If-None-Match': etag})
+        self.assertEqual(200, _get_resp.status_int)
+        self.assertNotEqual(etag, _get_resp.headers['ETag'])
+
+        _get_resp = self.app.get('/12345project/vmexpires/' + ids[0])
+        instance_etag = _get_resp.headers['ETag']
+        self.app.get('/12345project/vmexpires/' + ids[0],
+                     headers={'If-None-Match': instance_etag}, status=304)
+
+        # Updates change the version of the listing and of the resource
+        repo = repositories.get_vmexpire_repository()
+        time.sleep(0.01)
+        repo.update_instance_info(_get_resp.json['vmexpire']['instance_id'],
+                                  instance_name='renamed')
+        repositories.commit()
+        _get_resp = self.app.get('/12345project/vmexpires/?limit=1',
+                                 headers={'If-None-Match': etag})
+        self.assertEqual(200, _get_resp.status_int)
+        _get_resp = self.app.get('/12345project/vmexpires/' + ids[0],
+                                 headers={'If-None-Match': instance_etag})
+        self.assertEqual(200, _get_resp.status_int)
+
+    def _count_page_loads(self):
+        """Counts the pages of expirations read from the database."""
+        loads = []
+        for name in ('get_page', 'stream_page'):
+            method = getattr(repositories.VmExpireRepo, name)
+            patcher = mock.patch.object(repositories.VmExpireRepo, name,
+                                        autospec=True, side_effect=method)
+            loads.append(patcher.start())
+            self.addCleanup(patcher.stop)
+        return lambda: sum(load.call_count for load in loads)
+
+    def _enable_listing_cache(self):
+        repositories.CONF.set_override('enabled', True, group='cache')
+        self.addCleanup(repositories.CONF.clear_override, 'enabled',
+                        group='cache')
+        cache.invalidate()
+
+    def test_cached_listing_invalidated_on_write(self):
+        self._enable_listing_cache()
+        ids = self._create_project_vmexpires(3)
+        page_loads = self._count_page_loads()
+        url = '/12345project/vmexpires/?limit=10'
+        _get_resp = self.app.get(url)
+        self.assertEqual(3, _get_resp.json['total'])
+        self.assertEqual(1, page_loads())
+        _cached_resp = self.app.get(url)
+        self.assertEqual(1, page_loads())
+        self.assertEqual(_get_resp.json, _cached_resp.json)
+
+        # API write
+        self.app.delete('/12345project/vmexpires/' + ids[0],
+                        headers={'Content-Type': 'application/json'})
+        _get_resp = self.app.get(url)
+        self.assertEqual(2, page_loads())
+        self.assertEqual(2, _get_resp.json['total'])
+
+        # Worker write
+        repo = repositories.get_vmexpire_repository()
+        instance_id = _get_resp.json['vmexpires'][0]['instance_id']
+        repo.update_instance_info(instance_id, instance_name='renamed')
+        repositories.commit()
+        _get_resp = self.app.get(url)
+        self.assertEqual(3, page_loads())
+        self.assertEqual('renamed',
+                         _get_resp.json['vmexpires'][0]['instance_name'])
+
+        # Cleaner write
+        entity = repo.get(entity_id=ids[2])
+        entity.notified = True
+        entity.save()
+        repositories.commit()
+        _get_resp = self.app.get(url + '&notified=true')
+        self.assertEqual([ids[2]],
+                         [o['id'] for o in _get_resp.json['vmexpires']])
+        _get_resp = self.app.get(url)
+        self.assertEqual(5, page_loads())
+        self.assertEqual(2, _get_resp.json['total'])
+
+    def test_default_listing_is_cached(self):
+        self._enable_listing_cache()
+        self._create_project_vmexpires(3)
+        page_loads = self._count_page_loads()
+        _get_resp = self.app.get('/12345project/vmexpires/')
+        self.assertEqual(3, _get_resp.json['total'])
+        _cached_resp = self.app.get('/12345project/vmexpires/')
+        self.assertEqual(_get_resp.json, _cached_resp.json)
+        self.assertEqual(1, page_loads())
+
+    def test_can_get_vmexpires_by_instance_ids(self):
+        self._create_project_vmexpires(3)
+        other = create_vmexpire_model(prefix='other')
+        create_vmexpire(other)
+        _get_resp = self.app.get(
+            '/12345project/vmexpires/?instance_id=page0instance,'
+            'page2instance,otherinstance,unknown')
+        self.assertEqual(200, _get_resp.status_int)
+        self.assertEqual(2, _get_resp.json['total'])
+        self.assertEqual(['page0instance', 'page2instance'],
+                         sorted(_get_resp.json['vmexpires']))
+        self.assertEqual(
+            'page2instance',
+            _get_resp.json['vmexpires']['page2instance']['instance_id'])
+
+        _post_resp = self.app.post_json(
+            '/12345project/vmexpires/lookup',
+            {'instance_ids': ['page0instance', 'page2instance',
+                              'otherinstance', 'unknown']},
+            headers={'Content-Type': 'application/json'})
+        self.assertEqual(200, _post_resp.status_int)
+        self.assertEqual(_get_resp.json, _post_resp.json)
+
+    def test_invalid_vmexpires_lookup(self):
+        repositories.CONF.set_override('max_instances_per_request', 2)
+        self.addCleanup(repositories.CONF.clear_override,
+                        'max_instances_per_request')
+        self.app.get('/12345project/vmexpires/?instance_id=a,b,c',
+                     status=400)
+        self.app.post_json('/12345project/vmexpires/lookup',
+                           {'instance_ids': ['a', 'b', 'c']},
+                           headers={'Content-Type': 'application/json'},
+                           status=400)
+        self.app.post_json('/12345project/vmexpires/lookup',
+                           {'instance_ids': 'a'},
+                           headers={'Content-Type': 'application/json'},
+                           status=400)
+
+    def _bulk_instance(self, instance_id, token=None):
+        if instance_id.startswith('unknown'):
+            return None
+        return {
+            'display_name': instance_id,
+            'tenant_id': ('excluded' if instance_id.startswith('excluded')
+                          else '12345project'),
+            'user_id': '12345user'
+        }
+
+    @mock.patch.object(repositories, 'get_project_domain',
+                       return_value='domain')
+    @mock.patch.object(repositories, 'get_identity_token',
+                       return_value='token')
+    def test_can_bulk_add_vmexpires(self, mock_token, mock_domain):
+        exclude = models.VmExclude()
+        exclude.exclude_id = 'excluded'
+        exclude.exclude_type = 1
+        repositories.get_vmexclude_repository().create_exclude(exclude)
+        repositories.commit()
+        self.addCleanup(repositories.commit)
+        self.addCleanup(
+            repositories.get_vmexclude_repository().delete_all_entities)
+        create_vmexpire(create_vmexpire_model(prefix='bulk0'))
+
+        with mock.patch.object(repositories, 'get_instance',
+                               side_effect=self._bulk_instance):
+            _post_resp = self.app.post_json(
+                '/12345project/vmexpires/bulk',
+                {'instance_ids': ['bulk0instance', 'bulk1instance',
+                                  'excludedinstance', 'unknowninstance',
+                                  'bulk1instance']},
+                headers={'Content-Type': 'application/json'})
+        self.assertEqual(200, _post_resp.status_int)
+        results = _post_resp.json['results']
+        self.assertEqual(
+            [('bulk0instance', 202), ('bulk1instance', 202),
+             ('excludedinstance', 403), ('unknowninstance', 404)],
+            [(r['instance_id'], r['status']) for r in results])
+        self.assertEqual('12345project',
+                         results[0]['vmexpire']['project_id'])
+        self.assertIn('error', results[2])
+        # Project domain is looked up once per project
+        self.assertEqual(2, mock_domain.call_count)
+        mock_token.assert_called_once_with()
+
+        repo = repositories.get_vmexpire_repository()
+        found = repo.get_by_instances(
+            ['bulk0instance', 'bulk1instance', 'excludedinstance'])
+        self.assertEqual(['bulk0instance', 'bulk1instance'],
+                         sorted(row.instance_id for row in found))
+
+    def test_can_bulk_extend_vmexpires(self):
+        self._create_project_vmexpires(2)
+        other = create_vmexpire_model(prefix='other')
+        create_vmexpire(other)
+        _put_resp = self.app.put_json(
+            '/12345project/vmexpires/bulk',
+            {'instance_ids': ['page0instance', 'page1instance',
+                              'otherinstance']},
+            headers={'Content-Type': 'application/json'})
+        self.assertEqual(200, _put_resp.status_int)
+        results = _put_resp.json['results']
+        self.assertEqual([202, 202, 404], [r['status'] for r in results])
+        self.assertGreater(results[0]['vmexpire']['expire'], time.time())
+
+        repositories.CONF.max_vm_total_duration = 0
+        _put_resp = self.app.put_json(
+            '/12345project/vmexpires/bulk',
+            {'instance_ids': ['page0instance']},
+            headers={'Content-Type': 'application/json'})
+        self.assertEqual([403],
+                         [r['status'] for r in _put_resp.json['results']])
+
+    def test_can_bulk_delete_vmexpires(self):
+        self._create_project_vmexpires(2)
+        other = create_vmexpire_model(prefix='other')
+        create_vmexpire(other)
+        _delete_resp = self.app.delete_json(
+            '/12345project/vmexpires/bulk',
+            {'instance_ids': ['page0instance', 'otherinstance']},
+            headers={'Content-Type': 'application/json'})
+        self.assertEqual(200, _delete_resp.status_int)
+        self.assertEqual(
+            [{'instance_id': 'page0instance', 'status': 204},
+             {'instance_id': 'otherinstance', 'status': 404,
+              'error': _delete_resp.json['results'][1]['error']}],
+            _delete_resp.json['results'])
+        _get_resp = self.app.get('/12345project/vmexpires/')
+        self.assertEqual(['page1instance'],
+                         [o['instance_id']
+                          for o in _get_resp.json['vmexpires']])
+
+    def test_invalid_vmexpires_bulk(self):
+        repositories.CONF.set_override('max_instances_per_request', 2)
+        self.addCleanup(repositories.CONF.clear_override,
+                        'max_instances_per_request')
+        self.app.put_json('/12345project/vmexpires/bulk',
+                          {'instance_ids': ['a', 'b', 'c']},
+                          headers={'Content-Type': 'application/json'},
+                          status=400)
+        self.app.delete_json('/12345project/vmexpires/bulk',
+                             {'instance_ids': [1]},
+                             headers={'Content-Type': 'application/json'},
+                             status=400)
+
+    def _create_stats_vmexpires(self):
+        now = int(time.time())
+        start = now - now % (24 * 3600)
+        for prefix, project_id, day, notified in (
+                ('stats0', '12345project', 1, True),
+                ('stats1', '12345project', 1, False),
+                ('stats2', '12345project', 3, False),
+                ('stats3', 'otherproject', 1, False),
+                ('stats4', '12345project', 40, False)):
+            entity = create_vmexpire_model(prefix=prefix)
+            entity.project_id = project_id
+            entity.expire = start + day * 24 * 3600 + 60
+            entity.notified = notified
+            create_vmexpire(entity)
+        return start
+
+    def test_can_get_vmexpires_stats(self):
+        start = self._create_stats_vmexpires()
+
+        def day(index):
+            return time.strftime(
+                '%Y-%m-%d', time.gmtime(start + index * 24 * 3600))
+
+        _get_resp = self.app.get('/12345project/vmexpires/stats?days=7')
+        self.assertEqual(200, _get_resp.status_int)
+        self.assertEqual(start, _get_resp.json['start'])
+        self.assertEqual(7, _get_resp.json['days'])
+        self.assertEqual(3, _get_resp.json['total'])
+        self.assertEqual(
+            [{'project_id': '12345project', 'day': day(1), 'count': 2,
+              'notified': 1, 'notified_last': 0},
+             {'project_id': '12345project', 'day': day(3), 'count': 1,
+              'notified': 0, 'notified_last': 0}],
+            _get_resp.json['stats'])
+
+        # 30 days by default
+        _get_resp = self.app.get('/12345project/vmexpires/stats')
+        self.assertEqual(3, _get_resp.json['total'])
+        _get_resp = self.app.get('/12345project/vmexpires/stats?days=60')
+        self.assertEqual(4, _get_resp.json['total'])
+
+        self.app.extra_environ = {
+            'os_vm_expire.context': self._build_context(self.project_id,
+                                                        is_admin=True)
+        }
+        _get_resp = self.app.get(
+            '/12345project/vmexpires/stats?days=7&all_tenants=1')
+        self.assertEqual(
+            [('12345project', 2), ('12345project', 1), ('otherproject', 1)],
+            [(item['project_id'], item['count'])
+             for item in _get_resp.json['stats']])
+
+    def test_cached_vmexpires_stats_invalidated_on_write(self):
+        repositories.CONF.set_override('enabled', True, group='cache')
+        self.addCleanup(repositories.CONF.clear_override, 'enabled',
+                        group='cache')
+        cache.invalidate()
+        self._create_stats_vmexpires()
+        _get_resp = self.app.get('/12345project/vmexpires/stats')
+        with mock.patch.object(repositories.VmExpireRepo,
+                               'get_stats') as get_stats:
+            _cached_resp = self.app.get('/12345project/vmexpires/stats')
+            self.assertFalse(get_stats.called)
+        self.assertEqual(_get_resp.json, _cached_resp.json)
+
+        entity = create_vmexpire_model(prefix='stats5')
+        entity.project_id = '12345project'
+        entity.expire = _get_resp.json['start'] + 24 * 3600
+        create_vmexpire(entity)
+        _get_resp = self.app.get('/12345project/vmexpires/stats')
+        self.assertEqual(_cached_resp.json['total'] + 1,
+                         _get_resp.json['total'])
+
+    def test_invalid_vmexpires_stats(self):
+        self.app.get('/12345project/vmexpires/stats?days=0', status=400)
+        self.app.get('/12345project/vmexpires/stats?days=week', status=400)
+        self.app.get('/12345project/vmexpires/stats?days=1000', status=400)
+        self.app.get('/12345project/vmexpires/stats?all_tenants=1',
+                     status=403)
+
+    def _get_changes(self, since=None, limit=None):
+        params = []
+        if since is not None:
+            params.append('since=' + since)
+        if limit is not None:
+            params.append('limit=%d' % limit)
+        return self.app.get('/12345project/vmexpires/changes?' +
+                            '&'.join(params)).json
+
+    def test_can_get_vmexpires_changes(self):
+        repositories.CONF.set_override('changes_grace_time', 0)
+        self.addCleanup(repositories.CONF.clear_override,
+                        'changes_grace_time')
+        self.addCleanup(repositories.commit)
+        self.addCleanup(repositories.get_vmexpire_deletion_repository(
+        ).delete_all_entities)
+        ids = self._create_project_vmexpires(3)
+        create_vmexpire(create_vmexpire_model(prefix='other'))
+
+        changes = self._get_changes()
+        self.assertEqual(ids, sorted(o['id'] for o in changes['vmexpires']))
+        self.assertEqual([], changes['deleted'])
+        self.assertFalse(changes['truncated'])
+        cursor = changes['cursor']
+        self.assertEqual([], self._get_changes(cursor)['vmexpires'])
+
+        # Removals are logged, whatever the path deleting expirations
+        self.app.put('/12345project/vmexpires/' + ids[0],
+                     headers={'Content-Type': 'application/json'})
+        self.app.delete('/12345project/vmexpires/' + ids[1],
+                        headers={'Content-Type': 'application/json'})
+        self.app.delete_json('/12345project/vmexpires/bulk',
+                             {'instance_ids': ['otherinstance']},
+                             headers={'Content-Type': 'application/json'})
+        entity = create_vmexpire_model(prefix='new')
+        entity.project_id = '12345project'
+        new_id = create_vmexpire(entity).id
+
+        changes = self._get_changes(cursor)
+        self.assertEqual(sorted([ids[0], new_id]),
+                         sorted(o['id'] for o in changes['vmexpires']))
+        self.assertEqual([ids[1]], [o['id'] for o in changes['deleted']])
+        self.assertEqual([], self._get_changes(changes['cursor'])['deleted'])
+
+        # Truncated changes are completed by the next pages
+        seen = []
+        deleted = []
+        changes = {'truncated': True, 'cursor': cursor}
+        while changes['truncated']:
+            changes = self._get_changes(changes['cursor'], limit=1)
+            seen.extend(o['id'] for o in changes['vmexpires'])
+            deleted.extend(o['id'] for o in changes['deleted'])
+        self.assertEqual(sorted([ids[0], new_id]), sorted(seen))
+        self.assertEqual([ids[1]], deleted)
+
+    def test_invalid_vmexpires_changes(self):
+        self.app.get('/12345project/vmexpires/changes?since=soon',
+                     status=400)
+        self.app.get('/12345project/vmexpires/changes?since=0', status=410)
+
+    def test_invalid_list_parameters(self):
+        self.app.get('/12345project/vmexpires/?sort_key=user_id', status=400)
+        self.app.get('/12345project/vmexpires/?sort_dir=up', status=400)
+        self.app.get('/12345project/vmexpires/?notified=maybe', status=400)
+        self.app.get('/12345project/vmexpires/?expire_before=soon',
+                     status=400)
+        self.app.get('/12345project/vmexpires/?marker=unknown', status=400)
+
 
 def create_vmexpire_model(prefix=None):
     if not prefix:
@@ -0,0 +1,115 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import gzip
+import zlib
+
+import oslotest.base as oslotest
+import webob
+import webob.dec
+
+from os_vm_expire.api.middleware import compress
+from os_vm_expire.common import config
+
+CONF = config.CONF
+
+BODY = b'{"vmexpires": [' + b', '.join([b'{"id": "x"}'] * 200) + b']}'
+
+
+def json_app(body=BODY, streamed=False, content_type='application/json',
+             etag=None, content_encoding=None):
+    @webob.dec.wsgify
+    def app(req):
+        resp = webob.Response(content_type=content_type)
+        if streamed:
+            resp.app_iter = iter([body[:100], body[100:]])
+        else:
+            resp.body = body
+        if etag:
+            resp.headers['ETag'] = etag
+        resp.content_encoding = content_encoding
+        return resp
+    return app
+
+
+class WhenTestingCompressionMiddleware(oslotest.BaseTestCase):
+
+    def _get(self, app, accept_encoding='gzip', method='GET'):
+        req = webob.Request.blank('/', method=method)
+        if accept_encoding is not None:
+            req.headers['Accept-Encoding'] = accept_encoding
+        return req.get_response(compress.CompressionMiddleware(app))
+
+    def test_gzip(self):
+        resp = self._get(json_app(etag='"abc"'))
+        self.assertEqual('gzip', resp.content_encoding)
+        self.assertEqual(BODY, gzip.decompress(resp.body))
+        self.assertIn('Accept-Encoding', resp.vary)
+        self.assertEqual('W/"abc"', resp.headers['ETag'])
+
+    def test_streamed_body_is_compressed(self):
+        resp = self._get(json_app(streamed=True))
+        self.assertEqual('gzip', resp.content_encoding)
+        self.assertEqual(BODY, gzip.decompress(resp.body))
+
+    def test_quality_values(self):
+        CONF.set_override('algorithms', ['gzip', 'deflate'],
+                          group='compression')
+        self.addCleanup(CONF.clear_override, 'algorithms',
+                        group='compression')
+        resp = self._get(json_app(), 'gzip;q=0.5, deflate')
+        self.assertEqual('deflate', resp.content_encoding)
+        self.assertEqual(BODY, zlib.decompress(resp.body))
+        resp = self._get(json_app(), 'deflate;q=0, gzip;q=0.2')
+        self.assertEqual('gzip', resp.content_encoding)
+        resp = self._get(json_app(), 'identity, gzip;q=0.5')
+        self.assertIsNone(resp.content_encoding)
+
+    def test_malformed_entries_ignored(self):
+        resp = self._get(json_app(), 'gzip;q=1;x=y')
+        self.assertEqual('gzip', resp.content_encoding)
+        resp = self._get(json_app(), 'br;q=high, , GZIP;q=2, gzip;Q=0.5')
+        self.assertEqual('gzip', resp.content_encoding)
+        resp = self._get(json_app(), 'gzip;q=')
+        self.assertIsNone(resp.content_encoding)
+
+    def test_wildcard_skips_refused_codings(self):
+        CONF.set_override('algorithms', ['gzip', 'deflate'],
+                          group='compression')
+        self.addCleanup(CONF.clear_override, 'algorithms',
+                        group='compression')
+        resp = self._get(json_app(), '*')
+        self.assertEqual('gzip', resp.content_encoding)
+        resp = self._get(json_app(), 'gzip;q=0, *')
+        self.assertEqual('deflate', resp.content_encoding)
+        resp = self._get(json_app(), 'gzip;q=0.5, *')
+        self.assertEqual('deflate', resp.content_encoding)
+        resp = self._get(json_app(), 'gzip;q=0, deflate;q=0, *')
+        self.assertIsNone(resp.content_encoding)
+
+    def test_skipped_responses(self):
+        # Client not accepting compression
+        self.assertIsNone(self._get(json_app(), None).content_encoding)
+        self.assertIsNone(self._get(json_app(), 'br').content_encoding)
+        # Tiny body
+        resp = self._get(json_app(body=b'{}'))
+        self.assertIsNone(resp.content_encoding)
+        self.assertEqual(b'{}', resp.body)
+        # Not JSON
+        resp = self._get(json_app(content_type='text/plain'))
+        self.assertIsNone(resp.content_encoding)
+        self.assertNotIn('Accept-Encoding', resp.vary or ())
+        # Already compressed
+        resp = self._get(json_app(body=gzip.compress(BODY),
+                                  content_encoding='gzip'))
+        self.assertEqual(BODY, gzip.decompress(resp.body))
+        self.assertEqual('gzip', resp.content_encoding)
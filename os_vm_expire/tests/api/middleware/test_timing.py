@@ -0,0 +1,112 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import re
+
+import mock
+import oslotest.base as oslotest
+import sqlalchemy
+import testtools
+import webob
+import webob.dec
+
+from os_vm_expire.api.middleware import context
+from os_vm_expire.api.middleware import timing
+from os_vm_expire.common import instrumentation
+from os_vm_expire.model import repositories
+from os_vm_expire.tests import database_utils
+
+
+@webob.dec.wsgify
+def db_app(req):
+    session = repositories.get_session()
+    session.execute(sqlalchemy.text('SELECT 1'))
+    session.execute(sqlalchemy.text('SELECT 2'))
+    repositories.commit()
+    with mock.patch('requests.get') as get:
+        get.return_value.status_code = 404
+        repositories.get_instance('instance', token='token')
+    return webob.Response(json_body={})
+
+
+class WhenTestingTimingMiddleware(oslotest.BaseTestCase):
+
+    def setUp(self):
+        super(WhenTestingTimingMiddleware, self).setUp()
+        database_utils.setup_in_memory_db()
+        self.addCleanup(database_utils.in_memory_cleanup)
+
+    def test_server_timing_header(self):
+        resp = webob.Request.blank('/').get_response(
+            timing.TimingMiddleware(db_app))
+        self.assertEqual(200, resp.status_int)
+        server_timing = resp.headers['Server-Timing']
+        self.assertIn('total;dur=', server_timing)
+        # Connection checkout may issue a ping statement
+        statements = re.search(r'db;dur=[0-9.]+;desc="(\d+) statements"',
+                               server_timing).group(1)
+        self.assertGreaterEqual(int(statements), 2)
+        self.assertIn('http;dur=', server_timing)
+        self.assertIn('desc="1 requests"', server_timing)
+        self.assertIsNone(instrumentation.get_current())
+
+    def test_processed_request_log_fields(self):
+        app = timing.TimingMiddleware(context.BaseContextMiddleware(db_app))
+        with mock.patch.object(context.LOG, 'info') as info:
+            webob.Request.blank('/').get_response(app)
+        extra = info.call_args[1]['extra']
+        self.assertGreaterEqual(extra['db_statements'], 2)
+        self.assertEqual(1, extra['http_requests'])
+        self.assertGreaterEqual(extra['request_time_ms'],
+                                extra['db_time_ms'])
+
+    def test_statement_budget_warning(self):
+        instrumentation.CONF.set_override('statement_budgets', {'api': '1'})
+        self.addCleanup(instrumentation.CONF.clear_override,
+                        'statement_budgets')
+        with mock.patch.object(instrumentation.LOG, 'warning') as warning:
+            webob.Request.blank('/').get_response(
+                timing.TimingMiddleware(db_app))
+        fields = warning.call_args[0][1]
+        self.assertEqual('api', fields['unit'])
+        self.assertEqual(1, fields['budget'])
+        self.assertGreaterEqual(fields['count'], 2)
+
+        instrumentation.CONF.set_override('statement_budgets', {})
+        with mock.patch.object(instrumentation.LOG, 'warning') as warning:
+            webob.Request.blank('/').get_response(
+                timing.TimingMiddleware(db_app))
+        self.assertFalse(warning.called)
+
+    def test_nested_units(self):
+        with database_utils.StatementBudget(10) as budget:
+            with instrumentation.unit('worker') as stats:
+                session = repositories.get_session()
+                session.execute(sqlalchemy.text('SELECT 1'))
+                session.execute(sqlalchemy.text('SELECT 1'))
+                repositories.commit()
+            self.assertEqual(stats.counts[instrumentation.DB], budget.count)
+            self.assertEqual([('SELECT 1', 2)], stats.most_repeated(1))
+        self.assertIsNone(instrumentation.get_current())
+
+        budget = database_utils.StatementBudget(0)
+        with testtools.ExpectedException(AssertionError,
+                                         '.*over the budget of 0.*'):
+            with budget:
+                repositories.get_vmexpire_repository().get_entities()
+
+    def test_no_recording_outside_requests(self):
+        instrumentation.record(instrumentation.DB, 1.0)
+        session = repositories.get_session()
+        session.execute(sqlalchemy.text('SELECT 1'))
+        repositories.commit()
+        self.assertIsNone(instrumentation.get_current())
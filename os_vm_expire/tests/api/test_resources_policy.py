@@ -20,12 +20,13 @@ For typical-flow business logic tests of these classes, see the
 import os
 
 import mock
-from oslo_policy import policy
 from webob import exc
 
+from os_vm_expire.api import controllers
 from os_vm_expire.api.controllers import versions
 from os_vm_expire.api.controllers import vmexpire
 from os_vm_expire.common import config
+from os_vm_expire.common import policy
 from os_vm_expire import context
 # from os_vm_expire.model import models
 from os_vm_expire.tests import utils
@@ -292,6 +293,36 @@ class WhenTestingVmExpireResource(BaseTestCase):
         self.req = self._generate_req(roles=['member'])
         self.assertRaises(webob.exc.HTTPForbidden, self._invoke_on_post, '12345')
 
+    def test_rbac_results_are_memoized(self):
+        controllers._RBAC_MEMO.clear()
+        with mock.patch.object(self.policy_enforcer, 'enforce',
+                               wraps=self.policy_enforcer.enforce) as enforce:
+            for _ in range(2):
+                self.req = self._generate_req(
+                    roles=['member'], content_type='application/json',
+                    project_id=self.project_id)
+                self._invoke_on_get('12345expire')
+            self.assertEqual(1, enforce.call_count)
+            # Other project, other result
+            self.req = self._generate_req(roles=['member'],
+                                          project_id='otherproject')
+            self.assertRaises(webob.exc.HTTPForbidden, self._invoke_on_get,
+                              '12345expire')
+            self.assertEqual(2, enforce.call_count)
+            # Reloaded rules are evaluated again
+            self.policy_enforcer.load_rules(True)
+            self.req = self._generate_req(roles=['member'],
+                                          content_type='application/json',
+                                          project_id=self.project_id)
+            self._invoke_on_get('12345expire')
+            self.assertEqual(3, enforce.call_count)
+
+    def test_context_uses_process_enforcer(self):
+        self.assertIs(policy.get_enforcer(),
+                      context.RequestContext().policy_enforcer)
+        self.assertIs(policy.get_enforcer(),
+                      context.RequestContext().policy_enforcer)
+
     def _invoke_on_put(self, instance_id=None):
         return self.resource.on_put(self.req, self.resp, 'vmexpires', instance_id)
 
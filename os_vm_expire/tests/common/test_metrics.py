@@ -0,0 +1,205 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import socket
+import subprocess
+import sys
+
+import fixtures
+import mock
+from oslo_utils import timeutils
+import oslotest.base as oslotest
+import prometheus_client
+from six.moves import urllib
+import webtest
+
+from os_vm_expire.api import app
+from os_vm_expire.cmd import cleaner
+from os_vm_expire.common import metrics
+from os_vm_expire.model import repositories
+from os_vm_expire.queue import server
+from os_vm_expire.tests.api.controllers import test_vmexpires
+from os_vm_expire.tests import utils
+
+
+def sample_value(name, **labels):
+    return metrics.REGISTRY.get_sample_value(name, labels) or 0
+
+
+class WhenTestingMetricsExporter(oslotest.BaseTestCase):
+
+    def test_exporter_writes_textfile(self):
+        textfile_dir = self.useFixture(fixtures.TempDir()).path
+        metrics.CONF.set_override('textfile_dir', textfile_dir,
+                                  group='metrics')
+        self.addCleanup(metrics.CONF.clear_override, 'textfile_dir',
+                        group='metrics')
+        exporter = metrics.Exporter('test', 0)
+        exporter.start()
+        exporter.stop()
+        with open(os.path.join(textfile_dir,
+                               'os_vm_expire_test.prom')) as f:
+            self.assertEqual(
+                prometheus_client.generate_latest(metrics.REGISTRY),
+                f.read().encode('utf-8'))
+        self.assertEqual(['os_vm_expire_test.prom'],
+                         os.listdir(textfile_dir))
+
+    def test_exporter_serves_metrics(self):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        exporter = metrics.Exporter('test', port)
+        exporter.start()
+        self.addCleanup(exporter.stop)
+        resp = urllib.request.urlopen('http://127.0.0.1:%d/' % port)
+        self.assertIn(b'os_vm_expire_db_pool_checkout_wait_seconds_count',
+                      resp.read())
+
+    def test_exporter_serves_metrics_in_green_services(self):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        # The listener thread must not block the eventlet hub of the
+        # worker and the cleaner, monkey patched before any other import.
+        script = '\n'.join((
+            'from os_vm_expire.cmd.green import worker',
+            'from six.moves import urllib',
+            'from os_vm_expire.common import metrics',
+            'exporter = metrics.Exporter("test", %d, textfile=False)' % port,
+            'exporter.start()',
+            'urllib.request.urlopen("http://127.0.0.1:%d/").read()' % port,
+            'exporter.stop()'))
+        subprocess.check_call([sys.executable, '-c', script], timeout=60)
+
+    def test_exporters_of_several_processes(self):
+        multiproc_dir = self.useFixture(fixtures.TempDir()).path
+        textfile_dir = self.useFixture(fixtures.TempDir()).path
+        env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=multiproc_dir)
+        # Each process counts one email and writes the file on exit
+        script = '\n'.join((
+            'from os_vm_expire.common import metrics',
+            'metrics.CONF.set_override("textfile_dir", %r, group="metrics")'
+            % textfile_dir,
+            'exporter = metrics.Exporter("test", 0)',
+            'exporter.start()',
+            'metrics.CLEANER_EMAILS.labels("expire", "sent").inc()',
+            'exporter.stop()'))
+        for _ in range(2):
+            subprocess.check_call([sys.executable, '-c', script], env=env)
+        with open(os.path.join(textfile_dir,
+                               'os_vm_expire_test.prom')) as f:
+            self.assertIn('os_vm_expire_cleaner_emails_total{kind="expire",'
+                          'result="sent"} 2.0', f.read())
+
+        self.useFixture(fixtures.EnvironmentVariable(
+            'PROMETHEUS_MULTIPROC_DIR', multiproc_dir))
+        resp = webtest.TestApp(metrics.wsgi_app).get('/metrics')
+        self.assertIn('os_vm_expire_cleaner_emails_total{kind="expire",'
+                      'result="sent"} 2.0', resp.text)
+
+    @mock.patch.object(metrics, 'Exporter')
+    def test_api_exporter_is_opt_in(self, mock_exporter):
+        app._start_metrics_exporter()
+        self.assertFalse(mock_exporter.called)
+        metrics.CONF.set_override('api_port', 9412, group='metrics')
+        self.addCleanup(metrics.CONF.clear_override, 'api_port',
+                        group='metrics')
+        app._start_metrics_exporter()
+        mock_exporter.assert_called_once_with('api', 9412, textfile=False)
+        mock_exporter.return_value.start.assert_called_once_with()
+
+
+class WhenTestingServiceMetrics(utils.OsVMExpireAPIBaseTestCase):
+
+    def tearDown(self):
+        super(WhenTestingServiceMetrics, self).tearDown()
+        repositories.get_vmexpire_repository().delete_all_entities()
+        repositories.get_vmtombstone_repository().delete_all_entities()
+        repositories.commit()
+
+    def test_api_request_duration(self):
+        labels = {'controller': 'VmExpireController', 'method': 'GET'}
+        ok = sample_value('os_vm_expire_api_request_duration_seconds_count',
+                          code='200', **labels)
+        error = sample_value(
+            'os_vm_expire_api_request_duration_seconds_count',
+            code='500', **labels)
+        self.app.get('/12345project/vmexpires/')
+        self.app.get('/12345project/vmexpires/unknown', status=500)
+        self.assertEqual(
+            ok + 1,
+            sample_value('os_vm_expire_api_request_duration_seconds_count',
+                         code='200', **labels))
+        self.assertEqual(
+            error + 1,
+            sample_value('os_vm_expire_api_request_duration_seconds_count',
+                         code='500', **labels))
+
+        resp = webtest.TestApp(metrics.wsgi_app).get('/metrics')
+        self.assertEqual('text/plain', resp.content_type)
+        self.assertIn('os_vm_expire_api_request_duration_seconds_bucket{'
+                      'code="200",controller="VmExpireController",'
+                      'le="+Inf",method="GET"}', resp.text)
+
+    def test_db_pool_checkout_wait(self):
+        count = sample_value(
+            'os_vm_expire_db_pool_checkout_wait_seconds_count')
+        repositories.get_vmexpire_repository().get_entities()
+        repositories.clear()
+        self.assertEqual(
+            count + 1,
+            sample_value('os_vm_expire_db_pool_checkout_wait_seconds_count'))
+
+    def test_worker_events(self):
+        event_type = 'instance.delete.end'
+        count = sample_value('os_vm_expire_worker_events_total',
+                             event_type=event_type)
+        lag = sample_value('os_vm_expire_worker_event_lag_seconds_count',
+                           event_type=event_type)
+        server.Tasks().info(None, 'compute', event_type,
+                            {'instance_id': 'metricsinstance'},
+                            {'timestamp': str(timeutils.utcnow())})
+        server.Tasks().info(None, 'compute', event_type,
+                            {'instance_id': 'metricsinstance'}, {})
+        self.assertEqual(count + 2,
+                         sample_value('os_vm_expire_worker_events_total',
+                                      event_type=event_type))
+        self.assertEqual(
+            lag + 1,
+            sample_value('os_vm_expire_worker_event_lag_seconds_count',
+                         event_type=event_type))
+
+    @mock.patch('requests.get')
+    @mock.patch('requests.delete')
+    def test_cleaner_counters(self, mock_delete, mock_get):
+        mock_delete.return_value.status_code = 204
+        mock_get.return_value.status_code = 404
+        deleted = sample_value('os_vm_expire_cleaner_nova_deletes_total',
+                               status='204')
+        failed = sample_value('os_vm_expire_cleaner_emails_total',
+                              kind='delete', result='failed')
+        entity = test_vmexpires.create_vmexpire_model(prefix='metrics')
+        self.assertTrue(cleaner.delete_vm(entity.instance_id,
+                                          entity.project_id, 'token'))
+        self.assertFalse(cleaner.send_email(entity, 'token', delete=True))
+        self.assertEqual(
+            deleted + 1,
+            sample_value('os_vm_expire_cleaner_nova_deletes_total',
+                         status='204'))
+        self.assertEqual(
+            failed + 1,
+            sample_value('os_vm_expire_cleaner_emails_total',
+                         kind='delete', result='failed'))
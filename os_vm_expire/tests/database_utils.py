@@ -19,9 +19,11 @@ break the DevStack functional test discovery process.
 import datetime
 import time
 
+import fixtures
 # from sqlalchemy.engine import Engine
 # from sqlalchemy import event
 
+from os_vm_expire.common import instrumentation
 from os_vm_expire.model.migration import commands
 from os_vm_expire.model import models
 from os_vm_expire.model import repositories
@@ -76,6 +78,44 @@ def get_session():
     return repositories.get_session()
 
 
+class StatementBudget(fixtures.Fixture):
+    """Fails if more SQL statements than budget are executed in its scope.
+
+    Use it as a context manager around the code under test, or with
+    useFixture() for the remainder of a test::
+
+        with database_utils.StatementBudget(2):
+            repo.get_by_instance(instance_id)
+
+    Statements of nested units of work, such as worker events, are counted
+    too. The failure lists the executed statements, repeated ones usually
+    revealing N+1 queries.
+    """
+
+    def __init__(self, budget):
+        super(StatementBudget, self).__init__()
+        self.budget = budget
+        self.stats = None
+
+    def _setUp(self):
+        self.stats = instrumentation.start('test', track_statements=True)
+        self.addCleanup(self._check)
+
+    @property
+    def count(self):
+        return self.stats.counts[instrumentation.DB]
+
+    def _check(self):
+        instrumentation.stop()
+        if self.count > self.budget:
+            raise AssertionError(
+                '%d SQL statements executed, over the budget of %d:\n%s' % (
+                    self.count, self.budget, '\n'.join(
+                        '%d x %s' % (executions, statement)
+                        for statement, executions
+                        in self.stats.statements.most_common())))
+
+
 class RepositoryTestCase(oslotest.BaseTestCase):
     """Base test case class for in-memory database unit tests.
 
@@ -0,0 +1,200 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import mock
+import os
+
+from os_vm_expire.model import models
+from os_vm_expire.model import repositories
+from os_vm_expire.tests import database_utils
+
+
+class WhenTestingEngineLifecycle(database_utils.RepositoryTestCase):
+
+    def test_engine_owned_by_current_process(self):
+        self.assertEqual(os.getpid(), repositories._ENGINE_PID)
+
+    def test_session_factory_reset_after_fork(self):
+        engine = repositories._ENGINE
+        factory = repositories._SESSION_FACTORY
+        # Simulate a session requested from a forked child process
+        repositories._ENGINE_PID = -1
+        session = repositories.get_session()
+        self.assertEqual(os.getpid(), repositories._ENGINE_PID)
+        self.assertIs(engine, repositories._ENGINE)
+        self.assertIsNot(factory, repositories._SESSION_FACTORY)
+        self.assertIsNotNone(session)
+        repo = repositories.get_vmexpire_repository()
+        self.assertEqual([], repo.get_all_by(project_id='fork-test'))
+
+    def test_dispose_is_noop_in_same_process(self):
+        factory = repositories._SESSION_FACTORY
+        repositories.dispose_engine_after_fork()
+        self.assertIs(factory, repositories._SESSION_FACTORY)
+
+
+class WhenTestingCacheGenerations(database_utils.RepositoryTestCase):
+
+    def setUp(self):
+        super(WhenTestingCacheGenerations, self).setUp()
+        self.repo = repositories.get_cache_generation_repository()
+        self.addCleanup(self._delete_entities)
+
+    def _delete_entities(self):
+        repositories.get_vmexpire_repository().delete_all_entities()
+        repositories.commit()
+
+    def _generation(self, project_id):
+        return self.repo.get_generation(
+            repositories.vmexpire_cache_scope(project_id))
+
+    def _save_vmexpire(self):
+        instance = models.VmExpire()
+        instance.instance_id = 'gen-instance'
+        instance.instance_name = 'gen'
+        instance.project_id = 'gen-project'
+        instance.user_id = 'gen-user'
+        instance.expire = 0
+        instance.notified = False
+        instance.notified_last = False
+        instance.save()
+        return instance
+
+    def test_flush_bumps_generation_once_per_transaction(self):
+        generation = self._generation('gen-project')
+        instance = self._save_vmexpire()
+        instance.notified = True
+        instance.save()
+        repositories.commit()
+        self.assertEqual(generation + 1, self._generation('gen-project'))
+
+        # Moving an expiration invalidates both projects
+        other = self._generation('gen-other')
+        instance = repositories.get_vmexpire_repository().get_by_instance(
+            'gen-instance')
+        instance.project_id = 'gen-other'
+        instance.save()
+        repositories.commit()
+        self.assertEqual(generation + 2, self._generation('gen-project'))
+        self.assertEqual(other + 1, self._generation('gen-other'))
+
+    def test_update_instance_info_moves_expiration(self):
+        generation = self._generation('gen-project')
+        other = self._generation('gen-other')
+        instance = self._save_vmexpire()
+        repositories.commit()
+        repo = repositories.get_vmexpire_repository()
+        self.assertEqual(1, repo.update_instance_info(
+            'gen-instance', project_id='gen-other'))
+        repositories.commit()
+        self.assertEqual(generation + 2, self._generation('gen-project'))
+        self.assertEqual(other + 1, self._generation('gen-other'))
+        session = repositories.get_session()
+        deletions = session.query(models.VmExpireDeletion).filter_by(
+            vmexpire_id=instance.id).all()
+        self.assertEqual(['gen-project'], [d.project_id for d in deletions])
+        repositories.get_vmexpire_deletion_repository().delete_all_entities()
+        repositories.commit()
+
+    def test_generation_written_without_caching(self):
+        # API processes may cache listings written by a worker or a
+        # cleaner which does not.
+        repositories.CONF.set_override('enabled', False, group='cache')
+        self.addCleanup(repositories.CONF.clear_override, 'enabled',
+                        group='cache')
+        generation = self._generation('gen-project')
+        self._save_vmexpire()
+        repositories.commit()
+        self.assertEqual(generation + 1, self._generation('gen-project'))
+
+    def test_delete_all_entities_creates_missing_generations(self):
+        self._save_vmexpire()
+        repositories.commit()
+        table = models.CacheGeneration.__table__
+        with repositories.get_engine().begin() as connection:
+            connection.execute(table.delete().where(
+                table.c.scope == repositories.vmexpire_cache_scope(
+                    'gen-project')))
+        repositories.get_vmexpire_repository().delete_all_entities()
+        repositories.commit()
+        self.assertEqual(1, self._generation('gen-project'))
+
+    def test_bump_without_upsert_creates_complete_row(self):
+        scope = repositories.vmexpire_cache_scope('gen-fallback')
+        generation = self._generation('gen-fallback')
+        with mock.patch.object(self.repo, '_build_upsert',
+                               return_value=None):
+            self.repo.bump_generations([scope])
+            repositories.commit()
+            self.repo.bump_generations([scope])
+            repositories.commit()
+        self.assertEqual(generation + 2, self._generation('gen-fallback'))
+        table = models.CacheGeneration.__table__
+        with repositories.get_engine().connect() as connection:
+            row = connection.execute(table.select().where(
+                table.c.scope == scope)).one()
+        self.assertIsNotNone(row.id)
+        self.assertIsNotNone(row.created_at)
+        self.assertFalse(row.deleted)
+
+    def test_update_of_unknown_instance_keeps_generation(self):
+        generation = self._generation('gen-project')
+        self.repo.bump_generations([repositories.vmexpire_cache_scope(
+            'gen-project')])
+        repositories.commit()
+        self.assertEqual(generation + 1, self._generation('gen-project'))
+        repo = repositories.get_vmexpire_repository()
+        self.assertEqual(0, repo.update_instance_info('gen-unknown',
+                                                      instance_name='gen'))
+        repositories.commit()
+        self.assertEqual(generation + 1, self._generation('gen-project'))
+
+
+class WhenTestingVmExpireStats(database_utils.RepositoryTestCase):
+
+    def setUp(self):
+        super(WhenTestingVmExpireStats, self).setUp()
+        self.repo = repositories.get_vmexpire_repository()
+        self.addCleanup(self._delete_entities)
+
+    def _delete_entities(self):
+        self.repo.delete_all_entities()
+        repositories.commit()
+
+    def _save_vmexpire(self, instance_id, expire, notified=False):
+        instance = models.VmExpire()
+        instance.instance_id = instance_id
+        instance.instance_name = instance_id
+        instance.project_id = 'stats-project'
+        instance.user_id = 'stats-user'
+        instance.expire = expire
+        instance.notified = notified
+        instance.notified_last = False
+        instance.save()
+
+    def test_stats_grouped_by_whole_days(self):
+        start = 1000000
+        day = 24 * 3600
+        self._save_vmexpire('stats-1', start)
+        self._save_vmexpire('stats-2', start + day - 1, notified=True)
+        self._save_vmexpire('stats-3', start + day)
+        self._save_vmexpire('stats-4', start + 2 * day + 1)
+        self._save_vmexpire('stats-5', start + 3 * day)
+        self._save_vmexpire('stats-6', start - 1)
+        repositories.commit()
+        rows = self.repo.get_stats(start, 3, project_id='stats-project')
+        self.assertEqual([('stats-project', 0, 2, 1, 0),
+                          ('stats-project', 1, 1, 0, 0),
+                          ('stats-project', 2, 1, 0, 0)],
+                         [tuple(row) for row in rows])
+        for row in rows:
+            self.assertIsInstance(row.day, int)
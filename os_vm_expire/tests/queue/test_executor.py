@@ -0,0 +1,118 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import threading
+
+import mock
+import oslo_messaging
+from oslo_service import service
+
+from os_vm_expire.queue import executor
+from os_vm_expire.queue import server
+from os_vm_expire.queue.server import EVENT_TYPES
+from os_vm_expire.queue.server import get_instance_uuid
+from os_vm_expire.tests import base
+
+
+class WhenTestingKeyedExecutor(base.TestCase):
+
+    def test_same_key_same_lane(self):
+        keyed = executor.KeyedExecutor(workers=4)
+        self.assertEqual(keyed.lane_for('1-2-3-4-5'),
+                         keyed.lane_for('1-2-3-4-5'))
+        self.assertEqual(0, keyed.lane_for(None))
+
+    def test_tasks_for_same_key_are_ordered(self):
+        keyed = executor.KeyedExecutor(workers=4, queue_size=2)
+        keyed.start()
+        results = {}
+
+        def record(key, value):
+            results.setdefault(key, []).append(value)
+
+        for value in range(50):
+            for key in ('a', 'b', 'c'):
+                keyed.submit(key, record, key, value)
+        keyed.stop()
+        for key in ('a', 'b', 'c'):
+            self.assertEqual(list(range(50)), results[key])
+
+    def test_keys_are_processed_in_parallel(self):
+        keyed = executor.KeyedExecutor(workers=2)
+        key_a = 'a'
+        key_b = [k for k in ('b', 'c', 'd', 'e')
+                 if keyed.lane_for(k) != keyed.lane_for(key_a)][0]
+        blocked = threading.Event()
+        done = threading.Event()
+        keyed.start()
+        keyed.submit(key_a, blocked.wait, 5)
+        keyed.submit(key_b, done.set)
+        self.assertTrue(done.wait(5))
+        blocked.set()
+        keyed.stop()
+
+    def test_failing_task_does_not_stop_lane(self):
+        keyed = executor.KeyedExecutor(workers=1)
+        keyed.start()
+        done = threading.Event()
+
+        def fail():
+            raise Exception('boom')
+
+        keyed.submit('a', fail)
+        keyed.submit('a', done.set)
+        self.assertTrue(done.wait(5))
+        keyed.stop()
+
+    def test_get_instance_uuid(self):
+        self.assertEqual('1-2-3', get_instance_uuid(
+            {'nova_object.data': {'uuid': '1-2-3'}}))
+        self.assertEqual('1-2-3', get_instance_uuid({'instance_id': '1-2-3'}))
+        self.assertIsNone(get_instance_uuid({}))
+
+
+class WhenTestingTaskServer(base.TestCase):
+
+    @mock.patch.object(oslo_messaging, 'get_notification_listener')
+    @mock.patch.object(oslo_messaging, 'get_transport')
+    def test_stop_drains_lanes(self, mock_transport, mock_listener):
+        task_server = server.TaskServer()
+        processed = []
+        unblock = threading.Event()
+
+        def process(value):
+            unblock.wait(5)
+            processed.append(value)
+
+        task_server._executor.start()
+        for value in range(5):
+            task_server._executor.submit('a', process, value)
+        threading.Timer(0.1, unblock.set).start()
+        with mock.patch.object(service.Service, 'stop') as mock_stop:
+            mock_stop.side_effect = lambda: self.assertEqual(
+                list(range(5)), processed)
+            task_server.stop()
+            self.assertTrue(mock_stop.called)
+        self.assertTrue(mock_listener.return_value.stop.called)
+        self.assertEqual(list(range(5)), processed)
+
+
+class WhenTestingEventTypeFilter(base.TestCase):
+
+    def test_event_types(self):
+        rule = oslo_messaging.NotificationFilter(event_type=EVENT_TYPES)
+        for event_type in ('instance.create.end', 'compute.instance.update',
+                           'instance.update', 'instance.delete.end'):
+            self.assertTrue(rule.match(None, 'mock', event_type, {}, {}))
+        for event_type in ('instance.create.start', 'instance.power_off.end',
+                           'instance.updated'):
+            self.assertFalse(rule.match(None, 'mock', event_type, {}, {}))
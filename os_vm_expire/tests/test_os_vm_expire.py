@@ -20,9 +20,14 @@ Tests for `os_vm_expire` module.
 """
 
 from os_vm_expire.tests import base
+from os_vm_expire import version
 
 
 class TestOs_vm_expire(base.TestCase):
 
     def test_something(self):
         pass
+
+    def test_get_version(self):
+        self.assertEqual(version.version_info.release_string(),
+                         version.get_version())
@@ -17,4 +17,13 @@
 import pbr.version
 
 version_info = pbr.version.VersionInfo('os-vm-expire')
-__version__ = version_info.release_string()
+
+
+def get_version():
+    """Returns the release version of os-vm-expire.
+
+    The version is read from the package metadata, or from git, which is
+    slow: it is computed on the first call, not when this module is
+    imported by each process.
+    """
+    return version_info.release_string()